@@ -28,16 +28,20 @@ from pathlib import Path
 import rasterio
 
 # Importar lógica de negocio y las nuevas pestañas GIS
-from core_logic.gis_utils import get_raster_value_at_point, get_vector_feature_at_point, get_layer_path, load_geojson_from_gpkg, LAYER_MAPPING, get_local_path_from_url
+from core_logic.gis_utils import get_raster_value_at_point, sample_quantiles, get_vector_feature_at_point, get_layer_path, LAYER_MAPPING, get_local_path_from_url
 from core_logic.basin_calculator_refactored import BasinCalculatorRefactored
+from core_logic.asset_prefetch import get_asset_prefetcher
+from core_logic.map_layers import get_map_layer, SerializedGeoJson, padded_bounds, viewport_bounds, zoom_band
+from core_logic.vector_tiles import get_tile_server
 from core_logic.hydrology_methods import (
     calculate_rational_method, calculate_gev_fit, calculate_tcev_fit, 
-    get_flow_from_gev, get_flow_from_tcev, get_median_for_plot,
+    get_flows_from_gev, get_flows_from_tcev, get_median_for_plot,
     interpolate_rainfall
 )
  
 
-from pyproj import Transformer, CRS
+from core_logic.crs_transform import UTM30N, WGS84, transform_point
+from core_logic.raster_pool import open_raster
 # from pysheds.grid import Grid  ---> no hace falta aquí == crea problemas en el deploy
 
 
@@ -49,10 +53,14 @@ from perfil_terreno_tab import render_perfil_terreno_tab
 # from tabs.perfil_terreno_tab import render_perfil_terreno_tab # (línea nueva)
 
 # --- Configuración de CRS ---
-crs_utm30n = CRS("EPSG:25830")
-crs_wgs84 = CRS("EPSG:4326")
-transformer_wgs84_to_utm30n = Transformer.from_crs(crs_wgs84, crs_utm30n, always_xy=True)
-transformer_utm30n_to_wgs84 = Transformer.from_crs(crs_utm30n, crs_wgs84, always_xy=True)
+# Las conversiones WGS84 <-> UTM30N usan los Transformers cacheados para todo el proceso
+# en core_logic.crs_transform (compartidos por todas las sesiones y reruns).
+
+# --- Precarga de capas ---
+# Todas las capas de LAYER_MAPPING se descargan en segundo plano desde el primer arranque.
+asset_prefetcher = get_asset_prefetcher()
+# Servidor local de teselas vectoriales de ZONES, BASINS y RIVERS (None si no está disponible).
+tile_server = get_tile_server()
 
 # --- Rutas y Mapeo de Capas ---
 # DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'data')
@@ -62,34 +70,6 @@ EXTRAPOLATION_PERIODS = [1000, 5000, 10000] # <-- ADICIÓN
 TCEV_REGIONS = [72, 73, 84, 821, 822]
 
 
-# Añadimos un parámetro "dummy" para forzar al caché a invalidarse.
-# Cambia el número (ej. a _v=2) si necesitas forzarlo de nuevo en el futuro.
-@st.cache_data
-def get_cached_geojson_layer(layer_key, _v=1):
-    try:
-        gpkg_url = get_layer_path(layer_key)
-        if not gpkg_url:
-            print(f"ERROR: No se encontró la URL para la capa '{layer_key}' en LAYER_MAPPING.")
-            return None
-
-        local_gpkg_path = get_local_path_from_url(gpkg_url)
-        if not local_gpkg_path:
-            print(f"ERROR: Falló la descarga del archivo para la capa '{layer_key}' desde la URL: {gpkg_url}")
-            return None
-
-        geojson_data = load_geojson_from_gpkg(local_gpkg_path)
-        if not geojson_data:
-            print(f"ERROR: Falló el procesamiento del archivo local '{local_gpkg_path}' para la capa '{layer_key}'.")
-            return None
-            
-        return geojson_data
-    except Exception as e:
-        # --- ¡AQUÍ ESTÁ EL CAMBIO! ---
-        # Ahora, si hay un error, lo imprimimos en los logs del servidor para nosotros,
-        # pero no mostramos nada al usuario. La app simplemente no dibujará la capa.
-        print(f"Error crítico al cargar la capa {layer_key}: {e}")
-        return None
-
 def create_all_download_zips(basin_calculator, outlet_coords):
     if not basin_calculator.basinGeometryUTM:
         return None, None, None, None
@@ -127,7 +107,9 @@ def create_all_download_zips(basin_calculator, outlet_coords):
             dem_path = get_local_path_from_url(dem_url)
             dem_tif_path_out = os.path.join(tmpdir, "mdt_recortado.tif")
             options_dem = gdal.WarpOptions(format='GTiff', cutlineDSName=basin_shp_path, cropToCutline=True, dstNodata=-9999)
-            gdal.Warp(dem_tif_path_out, dem_path, options=options_dem)
+            # El MDT se abre una vez por proceso (pool de core_logic.raster_pool), no en cada descarga.
+            with open_raster(dem_path, backend="gdal") as dem_ds:
+                gdal.Warp(dem_tif_path_out, dem_ds, options=options_dem)
             if os.path.exists(dem_tif_path_out) and os.path.getsize(dem_tif_path_out) > 0:
                 dem_zip_io = io.BytesIO()
                 with zipfile.ZipFile(dem_zip_io, 'w', zipfile.ZIP_DEFLATED) as zf:
@@ -292,7 +274,7 @@ def export_geometry_to_zip(geometry, filename_base, crs_wkt):
 if 'lon_wgs84' not in st.session_state:
     st.session_state.lon_wgs84 = -3.703790
     st.session_state.lat_wgs84 = 40.416775
-    x_utm_init, y_utm_init = transformer_wgs84_to_utm30n.transform(st.session_state.lon_wgs84, st.session_state.lat_wgs84)
+    x_utm_init, y_utm_init = transform_point(st.session_state.lon_wgs84, st.session_state.lat_wgs84, WGS84, UTM30N)
     st.session_state.x_utm = round(x_utm_init, 6)
     st.session_state.y_utm = round(y_utm_init, 6)
     
@@ -303,11 +285,13 @@ if 'lon_wgs84' not in st.session_state:
     
     st.session_state.basin_geojson = None
     st.session_state.max_dist_point_wgs84 = None
+    st.session_state.longest_flow_path_geojson = None
     st.session_state.last_calculated_x = None
     st.session_state.last_calculated_y = None
     st.session_state.last_calculated_rp = None
     st.session_state.map_zoom = 6
     st.session_state.map_center = [st.session_state.lat_wgs84, st.session_state.lon_wgs84]
+    st.session_state.map_view = None
     st.session_state.shapefile_zip_io = None
     st.session_state.fit_bounds_on_next_run = None
     st.session_state.rivers_zip_io = None
@@ -338,17 +322,28 @@ if 'lon_wgs84' not in st.session_state:
 
 def update_coords_from_wgs84():
     lon, lat = st.session_state.lon_wgs84_input, st.session_state.lat_wgs84_input
-    x_utm, y_utm = transformer_wgs84_to_utm30n.transform(lon, lat)
+    x_utm, y_utm = transform_point(lon, lat, WGS84, UTM30N)
     st.session_state.x_utm, st.session_state.y_utm = round(x_utm, 3), round(y_utm, 3)
     st.session_state.lon_wgs84, st.session_state.lat_wgs84 = lon, lat
     st.session_state.map_center = [lat, lon]
+    st.session_state.map_view = None
 
 def update_coords_from_utm():
     x_utm, y_utm = st.session_state.x_utm_input, st.session_state.y_utm_input
-    lon, lat = transformer_utm30n_to_wgs84.transform(x_utm, y_utm)
+    lon, lat = transform_point(x_utm, y_utm, UTM30N, WGS84)
     st.session_state.lon_wgs84, st.session_state.lat_wgs84 = round(lon, 6), round(lat, 6)
     st.session_state.x_utm, st.session_state.y_utm = x_utm, y_utm
     st.session_state.map_center = [lat, lon]
+    st.session_state.map_view = None
+
+def add_vector_layer(m, layer_key, style, name):
+    """Capa vectorial del mapa: teselas del servidor local o, si no hay, GeoJSON de la vista consultada."""
+    if tile_server:
+        tile_server.layer(layer_key, style, name=name).add_to(m)
+        return
+    layer = get_map_layer(layer_key)
+    if layer:
+        SerializedGeoJson(layer.view(st.session_state.map_view, st.session_state.map_zoom)[0], style, name=name).add_to(m)
 
 with st.sidebar:
     if os.path.exists("logo.png"):
@@ -369,12 +364,20 @@ with st.sidebar:
         st.session_state.current_return_period = return_period_user
         st.session_state.show_dem25_map = False
         st.rerun()
+    prefetch_summary = asset_prefetcher.summary()
+    if not prefetch_summary["done"]:
+        fraction = prefetch_summary["received_bytes"] / prefetch_summary["total_bytes"] if prefetch_summary["total_bytes"] else 0.0
+        st.progress(min(fraction, 1.0), text=f"Preparando capas: {prefetch_summary['ready']}/{prefetch_summary['total']} "
+                                               f"({prefetch_summary['received_bytes'] / 2**20:.0f} MB)")
+    elif prefetch_summary["errors"]:
+        st.warning(f"No se pudieron precargar las capas: {', '.join(prefetch_summary['errors'])}")
     st.header("Visibilidad de Capas")
     st.checkbox("Demarcaciones Hidrográficas", value=True, key="show_demarcaciones")
     st.checkbox("Regiones Hidrológicas", value=True, key="show_regiones")
     st.checkbox("Red Fluvial (10km)", value=True, key="show_rios")
     st.checkbox("Cuenca Calculada", value=bool(st.session_state.basin_geojson), key="show_cuenca", disabled=not st.session_state.basin_geojson)
     st.checkbox("Punto Más Alejado", value=bool(st.session_state.max_dist_point_wgs84), key="show_max_dist_point", disabled=not st.session_state.max_dist_point_wgs84)
+    st.checkbox("Recorrido de Flujo Más Largo", value=bool(st.session_state.longest_flow_path_geojson), key="show_longest_flow_path", disabled=not st.session_state.longest_flow_path_geojson)
     st.checkbox("Punto de Interés", value=True, key="show_point")
     # --- INICIO: LÍNEA ELIMINADA ---
     # st.checkbox("Cauce Principal Calculado", value=True, key="show_main_channel", disabled=not st.session_state.main_channel_geojson)
@@ -404,24 +407,48 @@ st.info("💡 **Consejo:** Para obtener los mejores resultados, haga clic direct
 m = folium.Map(location=st.session_state.map_center, zoom_start=st.session_state.map_zoom, tiles='OpenStreetMap')
 folium.TileLayer('CartoDB positron', name='CartoDB Positron').add_to(m)
 folium.TileLayer(tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', attr='Esri', name='Esri World Imagery').add_to(m)
-if st.session_state.show_regiones and get_cached_geojson_layer("ZONES"): folium.GeoJson(get_cached_geojson_layer("ZONES"), name="Regiones", style_function=lambda x: {'color': 'darkorange', 'weight': 1, 'fillOpacity': 0.2}).add_to(m)
-if st.session_state.show_demarcaciones and get_cached_geojson_layer("BASINS"): folium.GeoJson(get_cached_geojson_layer("BASINS"), name="Demarcaciones", style_function=lambda x: {'color': 'black', 'weight': 1, 'fillOpacity': 0.1}).add_to(m)
+# Las capas vectoriales van como teselas MVT (core_logic/vector_tiles.py) o, sin servidor de
+# teselas, como GeoJSON de la vista consultada (extensión visible con margen, simplificada
+# para el zoom; core_logic/map_layers.py).
+if st.session_state.get("map_view") is None:
+    st.session_state.map_view = padded_bounds(viewport_bounds(st.session_state.map_center, st.session_state.map_zoom))
+if st.session_state.show_regiones: add_vector_layer(m, "ZONES", {'color': 'darkorange', 'weight': 1, 'fill': True, 'fillOpacity': 0.2}, "Regiones")
+if st.session_state.show_demarcaciones: add_vector_layer(m, "BASINS", {'color': 'black', 'weight': 1, 'fill': True, 'fillOpacity': 0.1}, "Demarcaciones")
 if st.session_state.basin_geojson and st.session_state.show_cuenca: folium.GeoJson(json.loads(st.session_state.basin_geojson), name="Cuenca Calculada", style_function=lambda x: {'color': 'red', 'weight': 3, 'fillOpacity': 0.3}).add_to(m)
-if st.session_state.show_rios and get_cached_geojson_layer("RIVERS"): folium.GeoJson(get_cached_geojson_layer("RIVERS"), name="Red Fluvial", style_function=lambda x: {'color': 'cyan', 'weight': 2.0}).add_to(m)
+if st.session_state.show_rios: add_vector_layer(m, "RIVERS", {'color': 'cyan', 'weight': 2.0}, "Red Fluvial")
 # --- INICIO: LÍNEA ELIMINADA ---
 # if st.session_state.main_channel_geojson and st.session_state.show_main_channel: folium.GeoJson(json.loads(st.session_state.main_channel_geojson), name="Cauce Principal Calculado", style_function=lambda x: {'color': 'blue', 'weight': 3.5, 'opacity': 0.9}).add_to(m)
 # --- FIN: LÍNEA ELIMINADA ---
+if st.session_state.longest_flow_path_geojson and st.session_state.show_longest_flow_path: folium.GeoJson(json.loads(st.session_state.longest_flow_path_geojson), name="Recorrido de Flujo Más Largo", style_function=lambda x: {'color': 'blue', 'weight': 3}).add_to(m)
 if st.session_state.max_dist_point_wgs84 and st.session_state.show_max_dist_point: folium.CircleMarker([st.session_state.max_dist_point_wgs84['lat'], st.session_state.max_dist_point_wgs84['lon']], radius=5, color='green', fill=True, fill_color='green', popup="Punto Más Alejado").add_to(m)
 if st.session_state.show_point: folium.Marker([st.session_state.lat_wgs84, st.session_state.lon_wgs84], popup="Punto de Interés", icon=folium.Icon(color="red", icon="info-sign")).add_to(m)
 folium.LayerControl().add_to(m)
 if st.session_state.get("fit_bounds_on_next_run"):
     m.fit_bounds(st.session_state.fit_bounds_on_next_run)
     st.session_state.fit_bounds_on_next_run = None
-st_map_output = st_folium(m, key="folium_map", returned_objects=["last_clicked"], width=None, height=600)
+# Con teselas el navegador ya pide sólo lo visible: no hace falta seguir la vista del mapa.
+map_returned_objects = ["last_clicked"] if tile_server else ["last_clicked", "bounds", "zoom", "center"]
+st_map_output = st_folium(m, key="folium_map", returned_objects=map_returned_objects, width=None, height=600)
+# "center" sólo llega cuando el mapa del navegador ha informado de su vista (no en los valores por defecto).
+if st_map_output and st_map_output.get("center") and st_map_output.get("bounds"):
+    south_west, north_east = st_map_output["bounds"]["_southWest"], st_map_output["bounds"]["_northEast"]
+    visible = (south_west["lng"], south_west["lat"], north_east["lng"], north_east["lat"])
+    west, south, east, north = st.session_state.map_view
+    inside = west <= visible[0] and south <= visible[1] and visible[2] <= east and visible[3] <= north
+    # Se vuelve a consultar (y a dibujar el mapa en la misma vista) sólo si la vista sale de la
+    # extensión consultada o cambia la banda de zoom.
+    if not inside or zoom_band(st_map_output["zoom"]) != zoom_band(st.session_state.map_zoom):
+        st.session_state.map_center = [st_map_output["center"]["lat"], st_map_output["center"]["lng"]]
+        st.session_state.map_zoom = st_map_output["zoom"]
+        st.session_state.map_view = padded_bounds(visible)
+        if st_map_output.get("last_clicked") is None:
+            st.rerun()
 if st_map_output and st_map_output.get("last_clicked") is not None:
+    if st_map_output.get("zoom"):
+        st.session_state.map_zoom = st_map_output["zoom"]
     st.session_state.lon_wgs84, st.session_state.lat_wgs84 = st_map_output["last_clicked"]["lng"], st_map_output["last_clicked"]["lat"]
     st.session_state.map_center = [st.session_state.lat_wgs84, st.session_state.lon_wgs84]
-    x_utm, y_utm = transformer_wgs84_to_utm30n.transform(st.session_state.lon_wgs84, st.session_state.lat_wgs84)
+    x_utm, y_utm = transform_point(st.session_state.lon_wgs84, st.session_state.lat_wgs84, WGS84, UTM30N)
     st.session_state.x_utm, st.session_state.y_utm = round(x_utm, 3), round(y_utm, 3)
     st.rerun()
 
@@ -445,16 +472,26 @@ with tab1:
                 results['region_info'] = {k: region_props.get(k) for k in ['tmco', 'cp0t2', 'cp0t5', 'cp0t10', 'cp0t25', 'cp0t100', 'cp0t500', 'betamedio', 'IC50', 'IC67', 'IC90']}
                 results['region_info']['id'] = region_id
 
-                basin_calc = BasinCalculatorRefactored(None, LAYER_MAPPING)
+                # El calculador se guarda en la sesión: si el nuevo punto está unas celdas aguas
+                # abajo del anterior, calculate() sólo añade las aportaciones laterales.
+                if st.session_state.get("basin_calc") is None:
+                    st.session_state.basin_calc = BasinCalculatorRefactored(None, LAYER_MAPPING)
+                basin_calc = st.session_state.basin_calc
                 basin_calc.calculate((x_utm, y_utm))
                 area_km2 = basin_calc.area / 1_000_000
                 results['basin_properties'] = {"area_km2": round(area_km2, 3), "concentration_time_h": round(basin_calc.concentrationTime, 3), "max_distance_m": round(basin_calc.maxDistance, 0), "max_h_msnm": round(basin_calc.minH, 3), "min_h_msnm": round(basin_calc.minH, 3)}
-                st.session_state.basin_geojson = json.dumps(basin_calc.basinGeometry[0].__geo_interface__) if basin_calc.basinGeometry else None
+                st.session_state.basin_geojson = json.dumps(basin_calc.basinGeometryDisplay[0].__geo_interface__) if basin_calc.basinGeometryDisplay else None
+                st.session_state.longest_flow_path_geojson = json.dumps(basin_calc.longestFlowPath.__geo_interface__) if basin_calc.longestFlowPath is not None else None
+                # Tiempos de concentración de todas las fórmulas, perfil del recorrido más largo y
+                # longitud de flujo máxima del ráster de longitudes (igual a Lmax).
+                results['concentration_times'] = {name: round(value, 3) for name, value in basin_calc.concentrationTimes.items()}
+                results['flow_path_profile'] = basin_calc.longestFlowPathProfile
+                results['flow_length_max_m'] = round(float(np.nanmax(basin_calc.flowLength)), 0) if basin_calc.flowLength is not None and basin_calc.flowLength.size else None
 
                 st.session_state.shapefile_zip_io, st.session_state.rivers_zip_io, st.session_state.dem_zip_io, st.session_state.point_zip_io = create_all_download_zips(basin_calc, (x_utm, y_utm))
 
                 if basin_calc.xMaxDistance is not None:
-                    lon_md, lat_md = transformer_utm30n_to_wgs84.transform(basin_calc.xMaxDistance, basin_calc.yMaxDistance)
+                    lon_md, lat_md = transform_point(basin_calc.xMaxDistance, basin_calc.yMaxDistance, UTM30N, WGS84)
                     st.session_state.max_dist_point_wgs84 = {"lon": lon_md, "lat": lat_md}
                 if basin_calc.basinGeometry:
                     bounds = unary_union(basin_calc.basinGeometry).bounds
@@ -476,9 +513,16 @@ with tab1:
                     intermediate_variables['rainfall_mm_for_T'] = round(user_rainfall_mm, 2)
                 else:
                     method_used = "Interpolación de Cuantiles"
+                    # Todos los periodos de retorno en una lectura del cubo de cuantiles; si el
+                    # cubo no está construido se lee cada COG por separado.
+                    quantiles = sample_quantiles((x_utm, y_utm))
                     for rp in STANDARD_RETURN_PERIODS:
-                        flow_val = get_raster_value_at_point(get_layer_path(f"FLOW_{rp}"), (x_utm, y_utm))
-                        rain_val = get_raster_value_at_point(get_layer_path(f"RAIN_{rp}"), (x_utm, y_utm))
+                        if quantiles is not None:
+                            flow_val = quantiles["FLOW"].get(rp)
+                            rain_val = quantiles["RAIN"].get(rp)
+                        else:
+                            flow_val = get_raster_value_at_point(get_layer_path(f"FLOW_{rp}"), (x_utm, y_utm))
+                            rain_val = get_raster_value_at_point(get_layer_path(f"RAIN_{rp}"), (x_utm, y_utm))
                         if flow_val not in [None, 99999] and rain_val not in [None, 99999] and flow_val > 0 and rain_val > 0:
                             flows_for_fitting.append(flow_val); rains_for_fitting.append(rain_val); r_periods_for_fitting.append(rp)
 
@@ -490,7 +534,8 @@ with tab1:
                 flow_fit_params, rain_fit_params = None, None
                 results['flow_fit_info'], results['rain_fit_info'] = None, None
                 fit_func = calculate_tcev_fit if use_tcev else calculate_gev_fit
-                value_func = get_flow_from_tcev if use_tcev else get_flow_from_gev
+                # Versión vectorizada: todos los periodos de la tabla o de una curva en una llamada.
+                values_func = get_flows_from_tcev if use_tcev else get_flows_from_gev
 
                 if len(flows_for_fitting) >= 3:
                     flow_fit_params = fit_func(flows_for_fitting, r_periods_for_fitting)
@@ -518,33 +563,38 @@ with tab1:
                 tmco_period = results['region_info'].get('tmco')
                 all_rps = sorted(list(set(STANDARD_RETURN_PERIODS + EXTRAPOLATION_PERIODS + [return_period] + ([tmco_period] if tmco_period else []))))
 
+                all_rps = [rp for rp in all_rps if rp != 0]
+                rain_quantiles = dict(zip(all_rps, values_func(all_rps, rain_fit_params))) if rain_fit_params is not None else None
+                flow_quantiles = dict(zip(all_rps, values_func(all_rps, flow_fit_params))) if flow_fit_params is not None else None
                 for rp in all_rps:
-                    if rp == 0: continue
                     row = {"Periodo (años)": rp}
-                    row["Lluvia P24máx (mm)"] = round(value_func(rp, rain_fit_params), 2) if rain_fit_params is not None else 'N/A'
-                    row["Caudal (m³/s)"] = round(value_func(rp, flow_fit_params), 2) if flow_fit_params is not None else 'N/A'
+                    row["Lluvia P24máx (mm)"] = round(rain_quantiles[rp], 2) if rain_quantiles is not None else 'N/A'
+                    row["Caudal (m³/s)"] = round(flow_quantiles[rp], 2) if flow_quantiles is not None else 'N/A'
                     closest_rp = min(STANDARD_RETURN_PERIODS, key=lambda x:abs(x-rp))
                     p0_val = results['region_info'].get(f'cp0t{closest_rp}')
                     row["Coef. P0"] = f"{p0_val:.3f}" if p0_val else "N/A"
                     derived_quantiles.append(row)
 
                 results['derived_quantiles_table'] = pd.DataFrame(derived_quantiles).set_index("Periodo (años)")
-                results['rain_user_rp'] = round(value_func(return_period, rain_fit_params), 2) if rain_fit_params is not None else 'N/A'
-                results['flow_user_rp'] = round(value_func(return_period, flow_fit_params), 2) if flow_fit_params is not None else 'N/A'
-                results['flow_tmco'] = round(value_func(tmco_period, flow_fit_params), 2) if flow_fit_params is not None and tmco_period else 'N/A'
+                results['rain_user_rp'] = round(rain_quantiles[return_period], 2) if rain_quantiles is not None else 'N/A'
+                results['flow_user_rp'] = round(flow_quantiles[return_period], 2) if flow_quantiles is not None else 'N/A'
+                results['flow_tmco'] = round(flow_quantiles[tmco_period], 2) if flow_quantiles is not None and tmco_period else 'N/A'
 
                 def prepare_plot_data(fit_params, data_points, rp_points, user_rp, tmco_rp):
                     if fit_params is None: return None
                     max_ext_rp = max(EXTRAPOLATION_PERIODS)
                     curve_fit_rps = np.logspace(np.log10(min(rp_points)), np.log10(max(rp_points)), 100)
                     curve_ext_rps = np.logspace(np.log10(max(rp_points)), np.log10(max_ext_rp + 1), 100)
+                    # Curvas, puntos extrapolados, T del usuario y TMCO en una sola llamada.
+                    n_fit, n_ext, n_points = len(curve_fit_rps), len(curve_ext_rps), len(EXTRAPOLATION_PERIODS)
+                    values = values_func(np.concatenate([curve_fit_rps, curve_ext_rps, EXTRAPOLATION_PERIODS, [user_rp, tmco_rp or 0]]), fit_params)
                     return {
-                        "fit_periods": curve_fit_rps, "fit_values": [value_func(p, fit_params) for p in curve_fit_rps],
-                        "ext_periods": curve_ext_rps, "ext_values": [value_func(p, fit_params) for p in curve_ext_rps],
+                        "fit_periods": curve_fit_rps, "fit_values": values[:n_fit],
+                        "ext_periods": curve_ext_rps, "ext_values": values[n_fit:n_fit + n_ext],
                         "points_rp": rp_points, "points_values": data_points,
-                        "ext_points_rp": EXTRAPOLATION_PERIODS, "ext_points_values": [value_func(p, fit_params) for p in EXTRAPOLATION_PERIODS],
-                        "user_rp": user_rp, "user_val": value_func(user_rp, fit_params),
-                        "tmco_rp": tmco_rp, "tmco_val": value_func(tmco_rp, fit_params) if tmco_rp else 0
+                        "ext_points_rp": EXTRAPOLATION_PERIODS, "ext_points_values": values[n_fit + n_ext:n_fit + n_ext + n_points],
+                        "user_rp": user_rp, "user_val": values[-2],
+                        "tmco_rp": tmco_rp, "tmco_val": values[-1] if tmco_rp else 0
                     }
                 results['flow_plot_data'] = prepare_plot_data(flow_fit_params, flows_for_fitting, r_periods_for_fitting, return_period, tmco_period)
                 results['rain_plot_data'] = prepare_plot_data(rain_fit_params, rains_for_fitting, r_periods_for_fitting, return_period, tmco_period)
@@ -576,6 +626,18 @@ with tab1:
         if bp['max_distance_m'] > 0: slope_text = f"| **Pdte. Med.:** {((bp['max_h_msnm'] - bp['min_h_msnm']) / bp['max_distance_m']):.4f} m/m"
         else: slope_text = ""
         st.markdown(f"**Área:** {bp['area_km2']} km² | **Lmax:** {bp['max_distance_m']} m | **Tc:** {bp['concentration_time_h']} h | **Hmax:** {bp['max_h_msnm']} msnm | **Hmin:** {bp['min_h_msnm']} msnm {slope_text}")
+        if results.get('concentration_times'):
+            TC_NAMES = {"temez": "Témez", "kirpich": "Kirpich", "california": "California", "giandotti": "Giandotti"}
+            tc_text = " | ".join(f"**{TC_NAMES.get(name, name)}:** {value} h" for name, value in results['concentration_times'].items())
+            st.markdown(f"**Tiempos de concentración:** {tc_text}")
+        profile = results.get('flow_path_profile')
+        if profile is not None and len(profile['distance_m']) > 1:
+            with st.expander("Perfil del recorrido de flujo más largo"):
+                if results.get('flow_length_max_m') is not None:
+                    st.caption(f"Longitud de flujo máxima: {results['flow_length_max_m']} m")
+                fig_profile = go.Figure(go.Scatter(x=profile['distance_m'], y=profile['elevation_m'], mode='lines', line=dict(color='saddlebrown')))
+                fig_profile.update_layout(xaxis_title='Distancia desde el punto más alejado (m)', yaxis_title='Elevación (msnm)', height=300, margin=dict(t=20))
+                st.plotly_chart(fig_profile, use_container_width=True)
         st.subheader("Descargas GIS")
         # --- INICIO: MODIFICACIÓN DE COLUMNAS ---
         dl_col1, dl_col2, dl_col3, dl_col4 = st.columns(4)
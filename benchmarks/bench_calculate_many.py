@@ -0,0 +1,93 @@
+# benchmarks/bench_calculate_many.py
+#
+# Compara BasinCalculatorRefactored.calculate_many con un bucle de calculate() sobre
+# puntos de salida escalonados a lo largo del cauce principal de una rejilla sintética
+# (ver bench_upstream_traversal.synthetic_grid), como las obras de drenaje de una carretera.
+# El bucle incluye la poligonización de cada cuenca, que calculate_many no hace.
+#
+# Uso: python benchmarks/bench_calculate_many.py [--cells 1e6] [--outlets 50]
+
+import argparse
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from osgeo import gdal, osr
+
+from benchmarks.bench_upstream_traversal import CELLSIZE, NODATA, synthetic_grid
+from core_logic.basin_calculator_refactored import BasinCalculatorRefactored
+from core_logic.basin_data import RAIN_FILES
+from core_logic.zonal_stats import ZonalStatistics
+
+SECONDARY_CELLS = 4  # Celdas del MDT por píxel de las capas secundarias.
+
+
+def synthetic_context(n_cells):
+    """Objeto con los atributos de BasinDataContext construido sobre la rejilla sintética."""
+    dirs, mdt, outlet = synthetic_grid(n_cells)
+    rows, cols = dirs.shape
+    gt = (500000.0, CELLSIZE, 0.0, 4800000.0, 0.0, -CELLSIZE)
+    layer_gt = (gt[0], CELLSIZE * SECONDARY_CELLS, 0.0, gt[3], 0.0, -CELLSIZE * SECONDARY_CELLS)
+    rng = np.random.default_rng(1)
+    shape = (rows // SECONDARY_CELLS + 1, cols // SECONDARY_CELLS + 1)
+
+    names = ["I1ID", "P0"] + list(RAIN_FILES)
+    layers = {name: (rng.random(shape) * 100.0).astype(np.float32) for name in names}
+    keys = {"I1ID": "I1ID", "P0": "P0", **RAIN_FILES}
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(25830)
+
+    context = types.SimpleNamespace(
+        local_layer_paths={}, mdt=mdt, nodataMdt=NODATA, geoTransform=gt, crs_wkt=srs.ExportToWkt(),
+        cellsize=CELLSIZE, cellarea=CELLSIZE * CELLSIZE, dirs=dirs, nodataDirs=0,
+        upstreamIndex=None, accumulatedAttributes=None,
+        secondaryLayers=layers, secondaryNodata={name: NODATA for name in names},
+        secondaryTransforms={name: layer_gt for name in names}, rainFiles=dict(RAIN_FILES),
+    )
+    context.zonalStatistics = ZonalStatistics(
+        {keys[name]: layers[name] for name in names}, {keys[name]: layer_gt for name in names},
+        {keys[name]: NODATA for name in names}, gt, mdt.shape,
+    )
+    return context, outlet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calculate_many frente a un bucle de calculate().")
+    parser.add_argument("--cells", type=float, default=1e6, help="Celdas de la rejilla sintética.")
+    parser.add_argument("--outlets", type=int, default=50, help="Puntos de salida a lo largo del cauce.")
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    context, (row0, col) = synthetic_context(int(args.cells))
+    gt = context.geoTransform
+    step = max(1, row0 // args.outlets)
+    points = [(gt[0] + (col + 0.5) * gt[1], gt[3] + (row + 0.5) * gt[5])
+              for row in range(row0, 0, -step)][:args.outlets]
+
+    calculator = BasinCalculatorRefactored(None, None, context=context)
+
+    start = time.perf_counter()
+    batch = calculator.calculate_many(points)
+    batch_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    worst = 0.0
+    for point, result in zip(points, batch):
+        calculator.calculate(point)
+        worst = max(worst, abs(calculator.area - result["area"]),
+                    abs(calculator.maxDistance - result["max_distance"]))
+    loop_s = time.perf_counter() - start
+
+    print(f"{len(points)} puntos sobre {context.mdt.size:.0e} celdas")
+    print(f"calculate_many: {batch_s:.2f} s ({len(points) / batch_s:.1f} puntos/s)")
+    print(f"bucle calculate(): {loop_s:.2f} s ({len(points) / loop_s:.1f} puntos/s)")
+    print(f"máxima diferencia en área / longitud de flujo: {worst:.3g}")
+
+
+if __name__ == "__main__":
+    main()
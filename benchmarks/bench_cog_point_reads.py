@@ -0,0 +1,113 @@
+# benchmarks/bench_cog_point_reads.py
+#
+# Latencia de get_raster_value_at_point (lectura del bloque que contiene el píxel, con
+# caché de bloques) frente a la ruta anterior (descargar el COG entero y leer la banda
+# completa). Los COG sintéticos se sirven desde un servidor HTTP local con rangos.
+#
+# Uso: python benchmarks/bench_cog_point_reads.py [--side 8000] [--layers 12] [--points 20]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+import requests
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.http_range_server import serve_directory
+from core_logic import gis_utils
+
+CELLSIZE = 25.0
+ORIGIN = (300000.0, 4800000.0)
+
+
+def synthetic_cog(path, side, seed):
+    """COG Float32 con un campo suave (comprime como las capas reales de cuantiles)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:side, 0:side].astype(np.float32) / side
+    data = (100.0 + 50.0 * np.sin(6 * x + seed) * np.cos(4 * y) + rng.random((side, side), dtype=np.float32))
+    profile = {
+        "driver": "COG", "width": side, "height": side, "count": 1, "dtype": "float32",
+        "crs": "EPSG:25830", "transform": from_origin(ORIGIN[0], ORIGIN[1], CELLSIZE, CELLSIZE),
+        "nodata": -9999.0, "compress": "DEFLATE", "blocksize": 512,
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+
+
+def full_download_value(url, point, tmpdir):
+    """Ruta anterior: descarga completa + src.read(1) para un píxel."""
+    local_path = os.path.join(tmpdir, "dl_" + os.path.basename(url))
+    with requests.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        with open(local_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+    with rasterio.open(local_path) as src:
+        row, col = src.index(*point)
+        value = src.read(1)[row, col]
+    os.remove(local_path)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lecturas puntuales de COG: bloque con caché frente a descarga completa.")
+    parser.add_argument("--side", type=int, default=8000, help="Lado en celdas de cada COG sintético.")
+    parser.add_argument("--layers", type=int, default=12, help="Número de capas (FLOW_T + RAIN_T en la app).")
+    parser.add_argument("--points", type=int, default=20, help="Clics aleatorios para la caché caliente.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    extent = args.side * CELLSIZE
+    points = [(ORIGIN[0] + rng.random() * extent, ORIGIN[1] - rng.random() * extent) for _ in range(args.points)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        serve_dir = os.path.join(tmp, "bucket")
+        os.makedirs(serve_dir)
+        for i in range(args.layers):
+            synthetic_cog(os.path.join(serve_dir, f"q{i}_COG.tif"), args.side, i)
+        size_mb = sum(os.path.getsize(os.path.join(serve_dir, f)) for f in os.listdir(serve_dir)) / 1e6
+        base_url, stats, server = serve_directory(serve_dir)
+        urls = [f"{base_url}/q{i}_COG.tif" for i in range(args.layers)]
+        print(f"{args.layers} COG de {args.side}x{args.side} ({size_mb:.0f} MB en total) servidos en {base_url}")
+
+        start = time.perf_counter()
+        reference = [full_download_value(url, points[0], tmp) for url in urls]
+        old_s = time.perf_counter() - start
+        old_bytes = stats["bytes"]
+
+        stats["bytes"] = stats["requests"] = 0
+        start = time.perf_counter()
+        cold = [gis_utils.get_raster_value_at_point(url, points[0]) for url in urls]
+        cold_s = time.perf_counter() - start
+        cold_bytes, cold_requests = stats["bytes"], stats["requests"]
+
+        start = time.perf_counter()
+        for url in urls:
+            gis_utils.get_raster_value_at_point(url, points[0])
+        warm_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for point in points[1:]:
+            for url in urls:
+                gis_utils.get_raster_value_at_point(url, point)
+        other_s = (time.perf_counter() - start) / max(1, len(points) - 1)
+        server.shutdown()
+
+        cache = gis_utils._raster_block_cache
+        print(f"descarga completa (ruta anterior): {old_s:.3f} s por clic, {old_bytes / 1e6:.1f} MB")
+        print(f"bloque, caché fría:   {cold_s:.3f} s por clic, {cold_bytes / 1e6:.2f} MB en {cold_requests} peticiones")
+        print(f"bloque, caché caliente (mismo punto): {warm_s:.4f} s por clic")
+        print(f"bloque, otros {len(points) - 1} clics al azar: {other_s:.4f} s por clic "
+              f"(aciertos {cache.hits}, fallos {cache.misses}, {cache.bytes / 1e6:.1f} MB en caché)")
+        if not np.allclose(np.asarray(reference, dtype=np.float64), np.asarray(cold, dtype=np.float64)):
+            print("ERROR: Los valores de ambas rutas no coinciden.")
+
+
+if __name__ == "__main__":
+    main()
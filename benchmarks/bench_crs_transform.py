@@ -0,0 +1,94 @@
+# benchmarks/bench_crs_transform.py
+#
+# Micro-benchmark de core_logic.crs_transform frente a los patrones que sustituye:
+#   - un punto: Transformer.from_crs en cada llamada (get_raster_value_at_point, app.py...)
+#     frente a transform_point con el Transformer cacheado para el proceso;
+#   - muchos puntos: un transform() por punto frente a transform_points con arrays;
+#   - geometrías: shapely.ops.transform feature a feature (load_geojson_from_gpkg) frente a
+#     transform_geometry sobre el array de geometrías (una llamada a PROJ).
+# Comprueba además que los resultados coinciden y que varios hilos usan la caché a la vez.
+#
+# Uso: python benchmarks/bench_crs_transform.py [--points 20000] [--polygons 2000]
+
+import argparse
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+from shapely.ops import transform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core_logic.crs_transform import UTM30N, WGS84, transform_geometry, transform_point, transform_points
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transformaciones de CRS cacheadas y vectorizadas.")
+    parser.add_argument("--points", type=int, default=20000, help="Puntos de la prueba por lotes.")
+    parser.add_argument("--polygons", type=int, default=2000, help="Polígonos de la prueba de geometrías.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    xs = rng.uniform(200000.0, 900000.0, args.points)
+    ys = rng.uniform(4000000.0, 4800000.0, args.points)
+    etrs89 = CRS("EPSG:4258")
+
+    # Un punto: construir el Transformer en cada llamada frente a la caché.
+    n_single = 200
+
+    def legacy_point():
+        for x, y in zip(xs[:n_single], ys[:n_single]):
+            Transformer.from_crs(CRS(UTM30N), etrs89, always_xy=True).transform(x, y)
+
+    def cached_point():
+        for x, y in zip(xs[:n_single], ys[:n_single]):
+            transform_point(x, y, UTM30N, etrs89)
+
+    legacy_s, _ = timed(legacy_point)
+    transform_point(xs[0], ys[0], UTM30N, etrs89)
+    cached_s, _ = timed(cached_point)
+    print(f"un punto: Transformer nuevo {legacy_s / n_single * 1e6:.0f} µs, cacheado {cached_s / n_single * 1e6:.1f} µs")
+
+    # Muchos puntos: un transform por punto frente a arrays.
+    transformer = Transformer.from_crs(UTM30N, WGS84, always_xy=True)
+    loop_s, loop = timed(lambda: np.array([transformer.transform(x, y) for x, y in zip(xs, ys)]))
+    batch_s, batch = timed(lambda: np.column_stack(transform_points(xs, ys, UTM30N, WGS84)), repeat=5)
+    max_diff = np.abs(loop - batch).max()
+    print(f"{args.points} puntos: punto a punto {loop_s * 1000:.0f} ms, transform_points {batch_s * 1000:.1f} ms "
+          f"(diferencia máxima {max_diff:.1e})")
+
+    # Geometrías: polígonos con 200 vértices, como las regiones y demarcaciones.
+    centers = np.column_stack((xs[:args.polygons], ys[:args.polygons]))
+    polygons = shapely.segmentize(shapely.buffer(shapely.points(centers), 5000.0, quad_segs=8), 200.0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)  # Es la ruta anterior, a propósito.
+        loop_s, loop = timed(lambda: [transform(transformer.transform, p) for p in polygons])
+    batch_s, batch = timed(lambda: transform_geometry(polygons, UTM30N, WGS84), repeat=5)
+    same = all(shapely.equals_exact(a, b, tolerance=1e-9) for a, b in zip(loop, batch))
+    n_vertices = shapely.get_num_coordinates(polygons).sum()
+    print(f"{args.polygons} polígonos ({n_vertices} vértices): shapely.ops.transform {loop_s * 1000:.0f} ms, "
+          f"transform_geometry {batch_s * 1000:.1f} ms, {'iguales' if same else 'DISTINTOS'}")
+
+    # Varios hilos a la vez: cada uno con su Transformer, mismos resultados.
+    expected = np.column_stack(transform_points(xs, ys, UTM30N, etrs89))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        chunks = list(pool.map(lambda i: np.column_stack(transform_points(xs[i::8], ys[i::8], UTM30N, etrs89)),
+                               range(8)))
+    ok = all(np.allclose(chunk, expected[i::8], rtol=0, atol=1e-12) for i, chunk in enumerate(chunks))
+    print(f"8 hilos: {'resultados correctos' if ok else 'ERROR: resultados distintos'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmarks/bench_layer_viewport.py
+#
+# Tamaño del script de Leaflet y tiempo por rerun del mapa con las capas vectoriales
+# completas (MapLayer.geojson) frente a la vista que usa app.py (MapLayer.view: features
+# que cortan la extensión visible con margen, simplificadas para la banda de zoom), a
+# varios zooms típicos sobre las capas sintéticas de bench_map_layers.
+#
+# Uso: python benchmarks/bench_layer_viewport.py [--rivers 20000] [--reruns 5]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import folium
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CAUMAX_ASSET_CACHE_DIR", tempfile.mkdtemp(prefix="caumax_bench_"))
+
+from benchmarks.bench_map_layers import STYLES, st_folium_work, synthetic_layers
+from benchmarks.http_range_server import serve_directory
+from core_logic import gis_utils
+from core_logic.map_layers import SerializedGeoJson, get_map_layer, padded_bounds, viewport_bounds
+
+CENTER = [39.5, -3.5]
+NAMES = {"ZONES": "Regiones", "BASINS": "Demarcaciones", "RIVERS": "Red Fluvial"}
+
+
+def rerun(center, zoom, view):
+    m = folium.Map(location=center, zoom_start=zoom)
+    bounds = padded_bounds(viewport_bounds(center, zoom))
+    features = 0
+    for key, name in NAMES.items():
+        layer = get_map_layer(key)
+        if view:
+            geojson, count = layer.view(bounds, zoom)
+        else:
+            geojson, count = layer.geojson, layer.feature_count
+        features += count
+        SerializedGeoJson(geojson, STYLES[key], name=name).add_to(m)
+    folium.LayerControl().add_to(m)
+    return st_folium_work(m), features
+
+
+def timed(reruns, *args):
+    rerun(*args)  # Primera llamada: carga la capa y calcula la banda de zoom.
+    start = time.perf_counter()
+    for _ in range(reruns):
+        html, features = rerun(*args)
+    return (time.perf_counter() - start) / reruns, len(html), features
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capas completas frente a la vista recortada y simplificada.")
+    parser.add_argument("--rivers", type=int, default=20000, help="Tramos de río de la capa sintética.")
+    parser.add_argument("--reruns", type=int, default=5, help="Reruns medidos tras el primero.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic_layers(tmp, args.rivers)
+        base_url, _stats, server = serve_directory(tmp)
+        gis_utils.LAYER_MAPPING.update({key: f"{base_url}/{os.path.basename(path)}" for key, path in paths.items()})
+        try:
+            full_s, full_html, full_features = timed(args.reruns, CENTER, 6, False)
+            print(f"capas completas: {full_features} features, {full_html / 2**20:.2f} MB, {full_s * 1000:.0f} ms por rerun")
+            for zoom in (6, 9, 12, 14):
+                view_s, view_html, view_features = timed(args.reruns, CENTER, zoom, True)
+                print(f"vista a zoom {zoom:2d}: {view_features} features, {view_html / 2**10:.0f} KB "
+                      f"(x{full_html / view_html:.0f} menos), {view_s * 1000:.1f} ms por rerun")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# benchmarks/bench_map_layers.py
+#
+# Tiempo por rerun que dedica app.py a las capas vectoriales del mapa (ZONES, BASINS,
+# RIVERS): la ruta anterior (get_cached_geojson_layer con st.cache_data, llamado dos veces
+# por capa, + folium.GeoJson con style_function) frente a core_logic.map_layers
+# (get_map_layer con st.cache_resource + SerializedGeoJson). En ambos casos se incluye el
+# trabajo que hace st_folium con el mapa en cada rerun: render de la figura y generación del
+# script de Leaflet elemento a elemento (streamlit_folium._get_map_string).
+#
+# Uso: python benchmarks/bench_map_layers.py [--rivers 20000] [--reruns 5]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import fiona
+import folium
+import numpy as np
+import shapely
+import streamlit as st
+import streamlit_folium
+from shapely.geometry import mapping
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Las capas se descargan del servidor local a una caché de capas temporal.
+os.environ.setdefault("CAUMAX_ASSET_CACHE_DIR", tempfile.mkdtemp(prefix="caumax_bench_"))
+
+from benchmarks.http_range_server import serve_directory
+from core_logic import gis_utils
+from core_logic.map_layers import SerializedGeoJson, get_map_layer
+
+STYLES = {
+    "ZONES": {'color': 'darkorange', 'weight': 1, 'fillOpacity': 0.2},
+    "BASINS": {'color': 'black', 'weight': 1, 'fillOpacity': 0.1},
+    "RIVERS": {'color': 'cyan', 'weight': 2.0},
+}
+
+
+def synthetic_layers(folder, n_rivers, seed=0):
+    """GPKG en EPSG:25830: 120 regiones y 16 demarcaciones (Voronoi) y n_rivers tramos de río."""
+    rng = np.random.default_rng(seed)
+    extent = shapely.box(200000.0, 4000000.0, 900000.0, 4800000.0)
+    paths = {}
+    for key, n_polygons in (("ZONES", 120), ("BASINS", 16)):
+        seeds = shapely.multipoints(rng.uniform((200000.0, 4000000.0), (900000.0, 4800000.0), (n_polygons, 2)))
+        cells = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=extent)), extent)
+        paths[key] = os.path.join(folder, f"{key.lower()}.gpkg")
+        schema = {"geometry": "Polygon", "properties": {"id": "int", "nombre": "str"}}
+        with fiona.open(paths[key], "w", driver="GPKG", crs="EPSG:25830", schema=schema) as dst:
+            for i, cell in enumerate(cells):
+                dst.write({"geometry": mapping(shapely.segmentize(cell, 1000.0)),
+                           "properties": {"id": i, "nombre": f"{key} {i}"}})
+
+    paths["RIVERS"] = os.path.join(folder, "rivers.gpkg")
+    schema = {"geometry": "LineString", "properties": {"id": "int"}}
+    with fiona.open(paths["RIVERS"], "w", driver="GPKG", crs="EPSG:25830", schema=schema) as dst:
+        for i in range(n_rivers):
+            start = rng.uniform((200000.0, 4000000.0), (900000.0, 4800000.0))
+            coords = start + np.cumsum(rng.normal(0.0, 300.0, (12, 2)), axis=0)
+            dst.write({"geometry": mapping(shapely.LineString(coords)), "properties": {"id": i}})
+    return paths
+
+
+@st.cache_data
+def legacy_cached_geojson_layer(layer_key, _v=1):
+    """get_cached_geojson_layer de app.py antes de core_logic.map_layers."""
+    local_gpkg_path = gis_utils.get_local_path_from_url(gis_utils.get_layer_path(layer_key))
+    return gis_utils.load_geojson_from_gpkg(local_gpkg_path)
+
+
+def st_folium_work(m):
+    """Lo que st_folium hace con el mapa antes de enviarlo al navegador."""
+    m.render()
+    m.get_root().render()
+    return streamlit_folium._get_map_string(m)
+
+
+def legacy_rerun():
+    m = folium.Map(location=[40.0, -3.7], zoom_start=6)
+    for key, name in (("ZONES", "Regiones"), ("BASINS", "Demarcaciones"), ("RIVERS", "Red Fluvial")):
+        style = STYLES[key]
+        if legacy_cached_geojson_layer(key):
+            folium.GeoJson(legacy_cached_geojson_layer(key), name=name, style_function=lambda x, s=style: s).add_to(m)
+    folium.LayerControl().add_to(m)
+    return st_folium_work(m)
+
+
+def current_rerun():
+    m = folium.Map(location=[40.0, -3.7], zoom_start=6)
+    for key, name in (("ZONES", "Regiones"), ("BASINS", "Demarcaciones"), ("RIVERS", "Red Fluvial")):
+        layer = get_map_layer(key)
+        if layer:
+            SerializedGeoJson(layer.geojson, STYLES[key], name=name).add_to(m)
+    folium.LayerControl().add_to(m)
+    return st_folium_work(m)
+
+
+def timed(fn, reruns):
+    fn()  # Primera llamada: carga y llena las cachés.
+    start = time.perf_counter()
+    for _ in range(reruns):
+        html = fn()
+    return (time.perf_counter() - start) / reruns, len(html)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste por rerun de las capas vectoriales del mapa.")
+    parser.add_argument("--rivers", type=int, default=20000, help="Tramos de río de la capa sintética.")
+    parser.add_argument("--reruns", type=int, default=5, help="Reruns medidos tras el primero.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic_layers(tmp, args.rivers)
+        base_url, _stats, server = serve_directory(tmp)
+        gis_utils.LAYER_MAPPING.update({key: f"{base_url}/{os.path.basename(path)}" for key, path in paths.items()})
+        try:
+            legacy_s, legacy_html = timed(legacy_rerun, args.reruns)
+            current_s, current_html = timed(current_rerun, args.reruns)
+        finally:
+            server.shutdown()
+
+    print(f"capas: {args.rivers} tramos de río, script de Leaflet {legacy_html / 2**20:.1f} MB antes / "
+          f"{current_html / 2**20:.1f} MB ahora")
+    print(f"antes (st.cache_data + folium.GeoJson): {legacy_s * 1000:.0f} ms por rerun")
+    print(f"ahora (st.cache_resource + GeoJSON serializado): {current_s * 1000:.0f} ms por rerun")
+
+
+if __name__ == "__main__":
+    main()
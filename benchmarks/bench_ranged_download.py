@@ -0,0 +1,100 @@
+# benchmarks/bench_ranged_download.py
+#
+# Descarga de un fichero grande con core_logic.asset_cache: un único stream frente a
+# segmentos Range en paralelo, servidos por un servidor HTTP local con el ancho de banda
+# de cada conexión limitado (como el de un bucket remoto). Después corta el servidor a
+# mitad de una descarga y comprueba que el segundo intento sólo pide los segmentos que
+# faltaban y que el fichero final es idéntico al original.
+#
+# Uso: python benchmarks/bench_ranged_download.py [--size-mb 256] [--mbps 40]
+#          [--segment-mb 16] [--concurrency 8]
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.http_range_server import serve_directory
+from core_logic.asset_cache import AssetCache, DownloadManager
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def timed_fetch(folder, url, downloader):
+    cache = AssetCache(folder, max_bytes=2**40, downloader=downloader)
+    start = time.perf_counter()
+    path = cache.fetch(url)
+    return path, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descarga por segmentos Range frente a un único stream.")
+    parser.add_argument("--size-mb", type=int, default=256, help="Tamaño del fichero servido.")
+    parser.add_argument("--mbps", type=float, default=40.0, help="Límite por conexión del servidor, en MB/s.")
+    parser.add_argument("--segment-mb", type=int, default=16, help="Tamaño de segmento.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Segmentos simultáneos.")
+    args = parser.parse_args()
+    segment_bytes = args.segment_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        served = os.path.join(tmp, "served")
+        os.makedirs(served)
+        source = os.path.join(served, "mdt_COG.tif")
+        with open(source, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        expected = sha256_of(source)
+        base_url, stats, server = serve_directory(served, bytes_per_s=args.mbps * 2**20)
+        url = f"{base_url}/mdt_COG.tif"
+
+        try:
+            stream = DownloadManager(parallel_min_bytes=2**62)
+            path, stream_s = timed_fetch(os.path.join(tmp, "stream"), url, stream)
+            ok = sha256_of(path) == expected
+            print(f"un stream: {stream_s:.2f} s ({args.size_mb / stream_s:.0f} MB/s), {'correcto' if ok else 'CORRUPTO'}")
+
+            ranged = DownloadManager(segment_bytes=segment_bytes, concurrency=args.concurrency, parallel_min_bytes=0)
+            path, ranged_s = timed_fetch(os.path.join(tmp, "ranged"), url, ranged)
+            ok = sha256_of(path) == expected
+            print(f"{args.concurrency} segmentos de {args.segment_mb} MB en paralelo: {ranged_s:.2f} s "
+                  f"({args.size_mb / ranged_s:.0f} MB/s), {'correcto' if ok else 'CORRUPTO'}")
+
+            # Corte a mitad de la descarga: las peticiones a partir de la mitad de segmentos fallan.
+            n_segments = -(-args.size_mb * 1024 * 1024 // segment_bytes)
+            folder = os.path.join(tmp, "resume")
+            with stats["lock"]:
+                stats["requests"] = 0
+                stats["fail_after"] = n_segments // 2
+            try:
+                timed_fetch(folder, url, DownloadManager(segment_bytes=segment_bytes, concurrency=args.concurrency,
+                                                         parallel_min_bytes=0))
+                print("ERROR: La descarga debería haber fallado con el servidor cortado.")
+            except Exception as e:
+                print(f"descarga cortada tras {stats['requests']} de {n_segments} segmentos: {type(e).__name__}")
+            with stats["lock"]:
+                stats["requests"] = 0
+                stats["fail_after"] = None
+            resumed = DownloadManager(segment_bytes=segment_bytes, concurrency=args.concurrency, parallel_min_bytes=0)
+            path, resume_s = timed_fetch(folder, url, resumed)
+            ok = sha256_of(path) == expected
+            info = resumed.throughput[url]
+            print(f"reanudación: {stats['requests']} segmentos pedidos, {info['resumed_bytes'] / 2**20:.0f} MB "
+                  f"reutilizados, {resume_s:.2f} s, {'correcto' if ok else 'CORRUPTO'}")
+            if not ok or stats["requests"] >= n_segments:
+                print("ERROR: La reanudación no ha reutilizado los segmentos ya descargados.")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_raster_pool.py
+#
+# Lecturas de un píxel (como get_raster_value_at_point con la caché de bloques fallando) de
+# un GeoTIFF teselado servido por HTTP local: abrir el ráster con rasterio.open en cada
+# consulta frente a tomarlo del pool de core_logic.raster_pool. Cuenta tiempo y peticiones
+# HTTP, y comprueba con varios hilos a la vez que los valores coinciden y que el pool no
+# abre más datasets que hilos.
+#
+# Uso: python benchmarks/bench_raster_pool.py [--size 4096] [--queries 300] [--threads 8]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.http_range_server import serve_directory
+from core_logic.raster_pool import VSICURL_OPTIONS, RasterSourcePool
+
+
+def synthetic_raster(path, size, seed=0):
+    """GeoTIFF float32 en EPSG:25830, teselado en bloques de 256 y comprimido, como los COG de la app."""
+    rng = np.random.default_rng(seed)
+    profile = {
+        "driver": "GTiff", "width": size, "height": size, "count": 1, "dtype": "float32",
+        "crs": "EPSG:25830", "transform": from_origin(400000.0, 4500000.0, 25.0, 25.0),
+        "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        for row0 in range(0, size, 1024):
+            dst.write(rng.random((1, 1024, size), dtype=np.float32), window=Window(0, row0, size, 1024))
+
+
+def legacy_query(url, row, col):
+    with rasterio.Env(**VSICURL_OPTIONS), rasterio.open(url) as src:
+        return float(src.read(1, window=Window(col, row, 1, 1))[0, 0])
+
+
+def pooled_query(pool, url, row, col):
+    with pool.open(url) as src:
+        return float(src.read(1, window=Window(col, row, 1, 1))[0, 0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Datasets reabiertos en cada consulta frente al pool.")
+    parser.add_argument("--size", type=int, default=4096, help="Lado del ráster en píxeles.")
+    parser.add_argument("--queries", type=int, default=300, help="Consultas de un píxel.")
+    parser.add_argument("--threads", type=int, default=8, help="Hilos de la prueba concurrente.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    pixels = rng.integers(0, args.size, (args.queries, 2))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic_raster(os.path.join(tmp, "mdt_COG.tif"), args.size)
+        base_url, stats, server = serve_directory(tmp)
+        url = f"/vsicurl/{base_url}/mdt_COG.tif"
+        try:
+            results = {}
+            for name, query in (("rasterio.open por consulta", legacy_query),
+                                ("pool", lambda u, r, c, pool=RasterSourcePool(): pooled_query(pool, u, r, c))):
+                with stats["lock"]:
+                    stats["requests"] = 0
+                start = time.perf_counter()
+                results[name] = [query(url, int(r), int(c)) for r, c in pixels]
+                elapsed = time.perf_counter() - start
+                print(f"{name}: {elapsed / args.queries * 1000:.2f} ms/consulta, "
+                      f"{stats['requests'] / args.queries:.2f} peticiones HTTP/consulta")
+            legacy, pooled = results.values()
+            if legacy != pooled:
+                print("ERROR: Los valores leídos no coinciden.")
+
+            pool = RasterSourcePool()
+            with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                concurrent = list(executor.map(lambda rc: pooled_query(pool, url, int(rc[0]), int(rc[1])), pixels))
+            pool_stats = pool.stats()
+            print(f"{args.threads} hilos: {pool_stats['opens']} aperturas, {pool_stats['reuses']} reutilizaciones, "
+                  f"{'valores correctos' if concurrent == legacy else 'ERROR: valores distintos'}")
+            if pool_stats["opens"] > args.threads:
+                print("ERROR: El pool ha abierto más datasets que hilos.")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/bench_raster_store.py
+#
+# Compara el arranque de la Pestaña 1 leyendo un ráster con GDAL (ReadAsArray completo)
+# frente a abrirlo desde el almacén .npy de core_logic.raster_store con np.memmap.
+# Cada variante se ejecuta en un proceso hijo para medir su tiempo y su RSS por separado.
+#
+# Uso: python benchmarks/bench_raster_store.py [--side 20000] [--window 1000]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from osgeo import gdal
+
+from core_logic.raster_store import RasterStore, ingest_raster
+
+KEY = "MDT"
+
+
+def rss_mb():
+    """VmRSS y VmHWM (pico) del proceso actual, en MB."""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                name, amount, _unit = line.split()
+                values[name[:-1]] = int(amount) / 1024.0
+    return values.get("VmRSS", 0.0), values.get("VmHWM", 0.0)
+
+
+def synthetic_tif(path, side, rows_per_chunk=1024):
+    """GeoTIFF Float32 tileado y comprimido, como los COG de la Pestaña 1."""
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(path, side, side, 1, gdal.GDT_Float32,
+                       options=["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"])
+    ds.SetGeoTransform((500000.0, 25.0, 0.0, 4800000.0, 0.0, -25.0))
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(-9999.0)
+    rng = np.random.default_rng(0)
+    for row0 in range(0, side, rows_per_chunk):
+        n_rows = min(rows_per_chunk, side - row0)
+        band.WriteArray(rng.random((n_rows, side), dtype=np.float32) * 1000.0, 0, row0)
+    ds.FlushCache()
+    ds = None
+
+
+def child(mode, path, window):
+    """Carga el ráster, toca una ventana del tamaño de una cuenca y devuelve las métricas."""
+    start = time.perf_counter()
+    if mode == "gdal":
+        gdal.UseExceptions()
+        ds = gdal.Open(path, gdal.GA_ReadOnly)
+        array = ds.GetRasterBand(1).ReadAsArray()
+    else:
+        array, _meta = RasterStore(path).load(KEY)
+    load_s = time.perf_counter() - start
+    rss_load, _ = rss_mb()
+
+    start = time.perf_counter()
+    row0 = array.shape[0] // 2
+    col0 = array.shape[1] // 2
+    checksum = float(np.asarray(array[row0:row0 + window, col0:col0 + window], dtype=np.float64).sum())
+    window_s = time.perf_counter() - start
+    rss_window, peak = rss_mb()
+
+    print(json.dumps({"load_s": load_s, "window_s": window_s, "rss_load_mb": rss_load,
+                      "rss_window_mb": rss_window, "peak_mb": peak, "checksum": checksum}))
+
+
+def run_child(mode, path, window):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--path", path, "--window", str(window)],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arranque GDAL frente a almacén .npy mapeado en memoria.")
+    parser.add_argument("--side", type=int, default=20000, help="Lado en celdas del ráster sintético.")
+    parser.add_argument("--window", type=int, default=1000, help="Lado de la ventana leída tras la carga.")
+    parser.add_argument("--child", choices=("gdal", "store"), help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.path, args.window)
+        return
+
+    gdal.UseExceptions()
+    with tempfile.TemporaryDirectory() as tmp:
+        tif_path = os.path.join(tmp, "mdt.tif")
+        store_dir = os.path.join(tmp, "store")
+
+        start = time.perf_counter()
+        synthetic_tif(tif_path, args.side)
+        print(f"GeoTIFF sintético {args.side}x{args.side}: {time.perf_counter() - start:.1f} s")
+        start = time.perf_counter()
+        ingest_raster(tif_path, KEY, store_dir)
+        print(f"Ingesta al almacén .npy: {time.perf_counter() - start:.1f} s")
+
+        print(f"{'ruta':>6} {'carga (s)':>10} {'ventana (s)':>12} {'RSS carga':>10} {'RSS ventana':>12} {'pico':>8}")
+        results = {}
+        for mode, path in (("gdal", tif_path), ("store", store_dir)):
+            r = run_child(mode, path, args.window)
+            results[mode] = r
+            print(f"{mode:>6} {r['load_s']:10.3f} {r['window_s']:12.4f} {r['rss_load_mb']:9.0f}M "
+                  f"{r['rss_window_mb']:11.0f}M {r['peak_mb']:7.0f}M")
+        if results["gdal"]["checksum"] != results["store"]["checksum"]:
+            print("ERROR: Los valores leídos por ambas rutas no coinciden.")
+
+
+if __name__ == "__main__":
+    main()
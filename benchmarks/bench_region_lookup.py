@@ -0,0 +1,112 @@
+# benchmarks/bench_region_lookup.py
+#
+# get_vector_feature_at_point con el índice STRtree de gis_utils frente a la consulta
+# anterior (abrir el GPKG con fiona, crear el Transformer y probar contains() feature a
+# feature), sobre un GPKG sintético de regiones en EPSG:4258 (hay reproyección por punto).
+# También mide la clasificación por lotes con get_vector_features_at_points.
+#
+# Uso: python benchmarks/bench_region_lookup.py [--regions 400] [--points 2000]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import fiona
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+from shapely.geometry import Point, mapping, shape
+from shapely.ops import transform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# La capa se descarga del servidor local a una caché de capas temporal.
+os.environ.setdefault("CAUMAX_ASSET_CACHE_DIR", tempfile.mkdtemp(prefix="caumax_bench_"))
+
+from benchmarks.http_range_server import serve_directory
+from core_logic import gis_utils
+
+EXTENT_UTM = (200000.0, 4000000.0, 900000.0, 4800000.0)
+
+
+def synthetic_regions(path, n_regions, seed=0):
+    """Teselación de Voronoi del rectángulo EXTENT_UTM, guardada en EPSG:4258 con un atributo 'region'."""
+    rng = np.random.default_rng(seed)
+    x0, y0, x1, y1 = EXTENT_UTM
+    seeds = shapely.multipoints(np.column_stack([rng.uniform(x0, x1, n_regions), rng.uniform(y0, y1, n_regions)]))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=shapely.box(*EXTENT_UTM)))
+    cells = shapely.intersection(cells, shapely.box(*EXTENT_UTM))
+    to_geo = Transformer.from_crs("EPSG:25830", "EPSG:4258", always_xy=True)
+    schema = {"geometry": "Polygon", "properties": {"region": "int"}}
+    with fiona.open(path, "w", driver="GPKG", crs="EPSG:4258", schema=schema) as dst:
+        for i, cell in enumerate(cells):
+            cell = shapely.transform(shapely.segmentize(cell, 2000.0),
+                                     lambda xy: np.column_stack(to_geo.transform(xy[:, 0], xy[:, 1])))
+            dst.write({"geometry": mapping(cell), "properties": {"region": i}})
+
+
+def legacy_feature_at_point(local_path, point_utm):
+    """La implementación anterior de get_vector_feature_at_point."""
+    point_shapely = Point(point_utm)
+    with fiona.open(local_path, 'r') as source:
+        source_crs = CRS(source.crs)
+        point_crs = CRS("EPSG:25830")
+        if source_crs != point_crs:
+            transformer = Transformer.from_crs(point_crs, source_crs, always_xy=True)
+            point_shapely = transform(transformer.transform, point_shapely)
+        for feature in source:
+            if shape(feature['geometry']).contains(point_shapely):
+                return feature
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta punto en región: STRtree frente a recorrido de features.")
+    parser.add_argument("--regions", type=int, default=400, help="Polígonos del GPKG sintético.")
+    parser.add_argument("--points", type=int, default=2000, help="Puntos de la prueba por lotes.")
+    parser.add_argument("--legacy-points", type=int, default=20, help="Puntos medidos con la consulta anterior.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    x0, y0, x1, y1 = EXTENT_UTM
+    points = np.column_stack([rng.uniform(x0 - 50000, x1, args.points), rng.uniform(y0, y1 + 50000, args.points)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "regiones.gpkg")
+        synthetic_regions(path, args.regions)
+        base_url, _stats, server = serve_directory(tmp)
+        url = f"{base_url}/regiones.gpkg"
+
+        start = time.perf_counter()
+        legacy = [legacy_feature_at_point(path, p) for p in points[:args.legacy_points]]
+        legacy_ms = (time.perf_counter() - start) / args.legacy_points * 1000
+
+        start = time.perf_counter()
+        gis_utils.get_vector_feature_at_point(url, points[0])
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        single = [gis_utils.get_vector_feature_at_point(url, p) for p in points]
+        single_ms = (time.perf_counter() - start) / len(points) * 1000
+
+        start = time.perf_counter()
+        batch = gis_utils.get_vector_features_at_points(url, points)
+        batch_ms = (time.perf_counter() - start) * 1000
+        server.shutdown()
+
+        def region(feature):
+            return None if feature is None else feature["properties"]["region"]
+
+        mismatches = sum(region(a) != region(b) for a, b in zip(legacy, single))
+        mismatches += sum(region(a) != region(b) for a, b in zip(single, batch))
+        print(f"{args.regions} regiones, {len(points)} puntos ({sum(f is None for f in batch)} fuera)")
+        print(f"consulta anterior: {legacy_ms:.1f} ms/punto")
+        print(f"índice STRtree: construcción {build_ms:.0f} ms, {single_ms * 1000:.0f} µs/punto")
+        print(f"lote de {len(points)} puntos: {batch_ms:.1f} ms ({batch_ms / len(points) * 1000:.1f} µs/punto)")
+        if mismatches:
+            print(f"ERROR: {mismatches} puntos clasificados de forma distinta.")
+
+
+if __name__ == "__main__":
+    main()
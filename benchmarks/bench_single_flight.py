@@ -0,0 +1,137 @@
+# benchmarks/bench_single_flight.py
+#
+# Comprueba la deduplicación de descargas de core_logic.asset_cache contra un servidor
+# HTTP local: varios hilos piden a la vez la misma capa (y después capas distintas) y se
+# cuentan las peticiones y los bytes que sirve el servidor. Como referencia se repite la
+# prueba con la descarga anterior (cada hilo hace su propio requests.get al mismo fichero).
+# Las descargas grandes van por segmentos Range (varias peticiones HTTP para un mismo
+# fichero), así que la deduplicación se comprueba con las transferencias de la caché y los
+# bytes servidos, no con el número de peticiones. Por último se revalida varias veces una
+# capa sin cambios con un servidor que responde a HEAD sin Content-Length: con el mismo
+# ETag no debe volver a descargarse.
+#
+# Uso: python benchmarks/bench_single_flight.py [--size-mb 64] [--threads 8] [--files 4]
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.http_range_server import serve_directory
+from core_logic.asset_cache import AssetCache
+
+
+def run_threads(n_threads, target):
+    """Lanza `target(i)` en n_threads hilos que arrancan a la vez; devuelve (resultados, segundos)."""
+    barrier = threading.Barrier(n_threads)
+    results = [None] * n_threads
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = target(i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - start
+
+
+def reset(stats):
+    with stats["lock"]:
+        stats["requests"] = 0
+        stats["bytes"] = 0
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def naive_download(url, local_path):
+    """La descarga anterior de gis_utils: todos escriben en la misma ruta local."""
+    with requests.get(url, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        with open(local_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+    return local_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descargas concurrentes con y sin deduplicación por URL.")
+    parser.add_argument("--size-mb", type=int, default=64, help="Tamaño de cada fichero servido.")
+    parser.add_argument("--threads", type=int, default=8, help="Hilos que piden la misma URL.")
+    parser.add_argument("--files", type=int, default=4, help="URL distintas en la segunda prueba.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        served = os.path.join(tmp, "served")
+        os.makedirs(served)
+        for i in range(args.files):
+            with open(os.path.join(served, f"layer{i}.tif"), "wb") as f:
+                f.write(os.urandom(args.size_mb * 1024 * 1024))
+        expected = sha256_of(os.path.join(served, "layer0.tif"))
+        size = os.path.getsize(os.path.join(served, "layer0.tif"))
+        base_url, stats, server = serve_directory(served)
+        url = f"{base_url}/layer0.tif"
+
+        try:
+            print(f"{args.threads} hilos piden {url.rsplit('/', 1)[1]} ({args.size_mb} MB) a la vez")
+            naive_path = os.path.join(tmp, "naive_layer0.tif")
+            _, naive_s = run_threads(args.threads, lambda i: naive_download(url, naive_path))
+            print(f"  descarga anterior: {stats['requests']} peticiones, {stats['bytes'] / 2**20:.0f} MB servidos, "
+                  f"{naive_s:.2f} s, fichero {'correcto' if sha256_of(naive_path) == expected else 'CORRUPTO'}")
+
+            reset(stats)
+            cache = AssetCache(os.path.join(tmp, "cache"), max_bytes=10 * size * args.files)
+            paths, flight_s = run_threads(args.threads, lambda i: cache.fetch(url))
+            errors = [p for p in paths if isinstance(p, Exception)]
+            print(f"  single-flight: {stats['requests']} peticiones, {stats['bytes'] / 2**20:.0f} MB servidos, "
+                  f"{flight_s:.2f} s, {len(set(map(str, paths)))} ruta(s) devuelta(s), {cache.stats()}")
+            if (errors or cache.stats()["transfers"] != 1 or stats["bytes"] != size
+                    or sha256_of(paths[0]) != expected):
+                print(f"ERROR: La descarga no se ha deduplicado correctamente: {errors}")
+
+            reset(stats)
+            urls = [f"{base_url}/layer{i % args.files}.tif" for i in range(args.threads * args.files)]
+            cache = AssetCache(os.path.join(tmp, "cache2"), max_bytes=10 * size * args.files)
+            paths, mixed_s = run_threads(len(urls), lambda i: cache.fetch(urls[i]))
+            print(f"{len(urls)} hilos sobre {args.files} URL distintas: {stats['requests']} peticiones, "
+                  f"{stats['bytes'] / 2**20:.0f} MB servidos, {mixed_s:.2f} s")
+            if (cache.stats()["transfers"] != args.files or stats["bytes"] != size * args.files
+                    or any(isinstance(p, Exception) for p in paths)):
+                print("ERROR: Se esperaba exactamente una transferencia por URL.")
+
+            reset(stats)
+            with stats["lock"]:
+                stats["head_without_length"] = True
+            cache = AssetCache(os.path.join(tmp, "cache3"), max_bytes=10 * size, revalidate_seconds=0)
+            for _ in range(3):
+                cache.fetch(url)
+            cache_stats = cache.stats()
+            print(f"3 revalidaciones con HEAD sin Content-Length: {cache_stats['transfers']} transferencia(s), "
+                  f"{cache_stats['hits']} acierto(s), {stats['bytes'] / 2**20:.0f} MB servidos")
+            if cache_stats["transfers"] != 1 or cache_stats["hits"] != 2 or stats["bytes"] != size:
+                print("ERROR: Una capa sin cambios (mismo ETag) se ha vuelto a descargar al revalidarla.")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# benchmarks/bench_tcev_quantiles.py
+#
+# Cuantiles TCEV de las curvas del informe (prepare_plot_data: 2 x 100 periodos más los
+# puntos extrapolados, el T del usuario y la TMCO): fsolve periodo a periodo, como hacía
+# get_flow_from_tcev, frente a get_flows_from_tcev con todos los periodos en una llamada.
+# Comprueba el residuo en la función de distribución de ambas soluciones. Compara también
+# get_flow_from_gev punto a punto con get_flows_from_gev.
+#
+# Uso: python benchmarks/bench_tcev_quantiles.py [--fits 20] [--repeat 5]
+
+import argparse
+import math
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+from scipy.optimize import fsolve
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core_logic.hydrology_methods import get_flow_from_gev, get_flows_from_gev, get_flows_from_tcev
+
+RETURN_PERIODS = np.concatenate([
+    np.logspace(np.log10(2), np.log10(500), 100),
+    np.logspace(np.log10(500), np.log10(5001), 100),
+    [1000, 2500, 5000, 100, 25],
+])
+
+
+def fsolve_flow(return_period, tcev_params):
+    """
+    Ruta anterior: fsolve desde la semilla fija por tramos de get_flow_from_tcev. El
+    residuo convierte el array de fsolve a float (con NumPy 2 math.exp ya no acepta un
+    array de un elemento y la función original devolvía siempre 0).
+    """
+    alpha1, alpha2, lambda1, lambda2 = tcev_params
+    prob = 1 - 1.0 / return_period
+
+    def residual(val):
+        val = float(val[0])
+        try:
+            term1 = min(max(-val * lambda1, -700), 700)
+            term2 = min(max(-val * lambda2, -700), 700)
+            return math.exp(-alpha1 * math.exp(term1) - alpha2 * math.exp(term2)) - prob
+        except (OverflowError, ValueError):
+            return 1e10
+
+    initial_guess = 75
+    if return_period > 100: initial_guess = 150
+    if return_period > 250: initial_guess = 300
+    if return_period > 400: initial_guess = 400
+    return fsolve(residual, initial_guess)[0]
+
+
+def cdf_residual(flows, tcev_params):
+    alpha1, alpha2, lambda1, lambda2 = tcev_params
+    cdf = np.exp(-alpha1 * np.exp(-lambda1 * flows) - alpha2 * np.exp(-lambda2 * flows))
+    return np.abs(cdf - (1 - 1.0 / RETURN_PERIODS)).max()
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cuantiles TCEV con fsolve frente a la versión vectorizada.")
+    parser.add_argument("--fits", type=int, default=20, help="Juegos de parámetros TCEV aleatorios.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones de cada medida.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    scalar_total = vector_total = 0.0
+    worst_scalar = worst_vector = max_rel_diff = 0.0
+    for _ in range(args.fits):
+        # Rangos de los ajustes de caudal y lluvia de las regiones TCEV.
+        params = (rng.uniform(2, 10), rng.uniform(0.01, 0.5), rng.uniform(0.03, 0.15), rng.uniform(0.01, 0.03))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # fsolve avisa cuando no converge.
+            scalar_s, scalar = timed(lambda: np.array([fsolve_flow(t, params) for t in RETURN_PERIODS]), args.repeat)
+        vector_s, vector = timed(lambda: get_flows_from_tcev(RETURN_PERIODS, params), args.repeat)
+        scalar_total += scalar_s
+        vector_total += vector_s
+        worst_scalar = max(worst_scalar, cdf_residual(scalar, params))
+        worst_vector = max(worst_vector, cdf_residual(vector, params))
+        max_rel_diff = max(max_rel_diff, (np.abs(scalar - vector) / np.abs(vector)).max())
+
+    n = len(RETURN_PERIODS)
+    print(f"TCEV, {n} periodos x {args.fits} ajustes: fsolve {scalar_total / args.fits * 1000:.2f} ms/curva, "
+          f"vectorizado {vector_total / args.fits * 1000:.3f} ms/curva")
+    print(f"residuo máximo en F(Q): fsolve {worst_scalar:.1e}, vectorizado {worst_vector:.1e}; "
+          f"diferencia relativa máxima {max_rel_diff:.1e}")
+
+    gev_params = (30.0, 60.0, -0.1)
+    scalar_s, scalar = timed(lambda: np.array([get_flow_from_gev(t, gev_params) for t in RETURN_PERIODS]), args.repeat)
+    vector_s, vector = timed(lambda: get_flows_from_gev(RETURN_PERIODS, gev_params), args.repeat)
+    print(f"GEV, {n} periodos: punto a punto {scalar_s * 1000:.3f} ms, vectorizado {vector_s * 1000:.3f} ms, "
+          f"diferencia máxima {np.abs(scalar - vector).max():.1e}")
+
+
+if __name__ == "__main__":
+    main()
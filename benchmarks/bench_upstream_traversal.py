@@ -0,0 +1,130 @@
+# benchmarks/bench_upstream_traversal.py
+#
+# Compara el motor iterativo de core_logic.upstream_traversal con el recorrido
+# recursivo original (_processCell) sobre rejillas sintéticas de direcciones de flujo.
+#
+# Uso: python benchmarks/bench_upstream_traversal.py [--sizes 1e4 1e5 1e6 1e7]
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core_logic.upstream_traversal import D8_NEIGHBOURS, trace_upstream, farthest_position
+
+CELLSIZE = 25.0
+NODATA = -9999.0
+# Límite de celdas para ejecutar también la versión recursiva de referencia.
+RECURSIVE_LIMIT = 200_000
+
+
+def synthetic_grid(n_cells, seed=0):
+    """
+    Rejilla en espina de pez: la columna central drena hacia el sur y el resto de
+    celdas drenan hacia ella en horizontal o en diagonal descendente, al azar.
+    El punto de salida es la última celda de la columna central.
+    """
+    side = int(round(math.sqrt(n_cells)))
+    rng = np.random.default_rng(seed)
+    rows, cols = side, side
+    centre = cols // 2
+    col_idx = np.arange(cols)[None, :].repeat(rows, axis=0)
+    row_idx = np.arange(rows)[:, None].repeat(cols, axis=1)
+    diagonal = rng.random((rows, cols)) < 0.5
+    diagonal[-1, :] = False
+
+    dirs = np.zeros((rows, cols), dtype=np.uint8)
+    west = col_idx > centre
+    east = col_idx < centre
+    dirs[west & ~diagonal] = 16
+    dirs[west & diagonal] = 8
+    dirs[east & ~diagonal] = 1
+    dirs[east & diagonal] = 2
+    dirs[:, centre] = 4
+
+    mdt = (rows - row_idx + np.abs(col_idx - centre)).astype(np.float32)
+    mdt += rng.random((rows, cols), dtype=np.float32)
+    mdt[rng.random((rows, cols)) < 0.001] = NODATA
+    mdt[rows - 1, centre] = 0.0
+    return dirs, mdt, (rows - 1, centre)
+
+
+def recursive_reference(dirs, mdt, outlet):
+    """Réplica del recorrido recursivo original, sin capas secundarias."""
+    rows, cols = dirs.shape
+    state = {"area": 0, "maxDistance": 0, "far": None,
+             "minH": mdt[outlet], "maxH": mdt[outlet]}
+    visited = set()
+
+    def process(x, y, distance):
+        if not (0 <= y < rows and 0 <= x < cols) or (x, y) in visited:
+            return
+        visited.add((x, y))
+        h = mdt[y, x]
+        if h != NODATA:
+            state["minH"] = min(state["minH"], h)
+            state["maxH"] = max(state["maxH"], h)
+            if distance > state["maxDistance"]:
+                state["maxDistance"] = distance
+                state["far"] = (y, x)
+        state["area"] += 1
+        for dx, dy, code in D8_NEIGHBOURS:
+            x2, y2 = x + dx, y + dy
+            if 0 <= y2 < rows and 0 <= x2 < cols and dirs[y2, x2] == code:
+                step = 1 if (dx == 0 or dy == 0) else 1.414
+                process(x2, y2, distance + step * CELLSIZE)
+
+    old_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(old_limit, rows * cols + 1000))
+    try:
+        process(outlet[1], outlet[0], 0)
+    finally:
+        sys.setrecursionlimit(old_limit)
+    return state
+
+
+def iterative(dirs, mdt, outlet):
+    trace = trace_upstream(dirs, outlet[0], outlet[1], CELLSIZE)
+    heights = mdt.reshape(-1)[trace.cells]
+    valid = heights != NODATA
+    pos = farthest_position(trace, valid)
+    far = None
+    max_distance = 0
+    if pos is not None:
+        max_distance = float(trace.distances[pos])
+        far = divmod(int(trace.cells[pos]), dirs.shape[1])
+    return {"area": len(trace), "maxDistance": max_distance, "far": far,
+            "minH": heights[valid].min(), "maxH": heights[valid].max()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e4, 1e5, 1e6, 1e7])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'celdas':>10} {'iterativo (s)':>14} {'recursivo (s)':>14} {'idéntico':>9}")
+    for size in args.sizes:
+        dirs, mdt, outlet = synthetic_grid(int(size))
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            result = iterative(dirs, mdt, outlet)
+            best = min(best, time.perf_counter() - t0)
+
+        rec_time, same = "-", "-"
+        if dirs.size <= RECURSIVE_LIMIT:
+            t0 = time.perf_counter()
+            reference = recursive_reference(dirs, mdt, outlet)
+            rec_time = f"{time.perf_counter() - t0:.3f}"
+            same = "sí" if all(reference[k] == result[k] for k in reference) else "NO"
+        print(f"{dirs.size:>10} {best:>14.3f} {rec_time:>14} {same:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_vector_tiles.py
+#
+# Servidor de teselas vectoriales (core_logic/vector_tiles.py) sobre las capas sintéticas de
+# bench_map_layers con una red fluvial grande: tiempo de precálculo de los zooms bajos,
+# latencia de una tesela en frío (generada) y en caliente (desde disco) pedida por HTTP, y
+# bytes que descarga el navegador para una vista de 1200x600 px a varios zooms, frente al
+# GeoJSON completo que se incrustaba antes en la página.
+#
+# Uso: python benchmarks/bench_vector_tiles.py [--rivers 100000] [--precompute-zoom 7]
+
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import mapbox_vector_tile
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CAUMAX_ASSET_CACHE_DIR", tempfile.mkdtemp(prefix="caumax_bench_"))
+
+from benchmarks.bench_map_layers import synthetic_layers
+from benchmarks.http_range_server import serve_directory
+from core_logic import gis_utils
+from core_logic.map_layers import get_map_layer, viewport_bounds
+from core_logic.vector_tiles import VECTOR_TILE_LAYERS, VectorTileServer, tiles_in_bounds
+
+CENTER = (39.5, -3.5)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fetch_view(session, server, zoom):
+    """Bytes, número de teselas y segundos de todas las teselas de una vista de 1200x600 px."""
+    tiles = tiles_in_bounds(viewport_bounds(CENTER, zoom), zoom)
+    total, start = 0, time.perf_counter()
+    for layer_key in VECTOR_TILE_LAYERS:
+        for x, y in tiles:
+            url = server.url_for(layer_key).format(z=zoom, x=x, y=y)
+            response = session.get(url)
+            response.raise_for_status()
+            total += len(response.content)
+    return total, len(tiles) * len(VECTOR_TILE_LAYERS), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teselas vectoriales frente al GeoJSON completo.")
+    parser.add_argument("--rivers", type=int, default=100000, help="Tramos de río de la capa sintética.")
+    parser.add_argument("--precompute-zoom", type=int, default=7, help="Último zoom precalculado.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic_layers(tmp, args.rivers)
+        base_url, _stats, data_server = serve_directory(tmp)
+        gis_utils.LAYER_MAPPING.update({key: f"{base_url}/{os.path.basename(path)}" for key, path in paths.items()})
+        port = free_port()
+        server = VectorTileServer(f"http://127.0.0.1:{port}/tiles/{{layer}}/{{z}}/{{x}}/{{y}}.pbf",
+                                  cache_dir=os.path.join(tmp, "tiles"), port=port,
+                                  precompute_zoom=args.precompute_zoom)
+        session = requests.Session()
+        try:
+            geojson_bytes = sum(len(get_map_layer(key).geojson) for key in VECTOR_TILE_LAYERS)
+            start = time.perf_counter()
+            server.precompute()
+            precompute_s = time.perf_counter() - start
+            server.start()
+            print(f"GeoJSON completo: {geojson_bytes / 2**20:.1f} MB; precálculo zoom 0-{args.precompute_zoom}: "
+                  f"{sum(server.precomputed.values())} teselas en {precompute_s:.1f} s")
+
+            for zoom in (6, 9, 12, 14):
+                cold_bytes, n_tiles, cold_s = fetch_view(session, server, zoom)
+                _, _, warm_s = fetch_view(session, server, zoom)
+                print(f"vista a zoom {zoom:2d}: {n_tiles} teselas, {cold_bytes / 2**10:.0f} KB "
+                      f"(x{geojson_bytes / max(cold_bytes, 1):.0f} menos), primera vez {cold_s * 1000:.0f} ms, "
+                      f"desde disco {warm_s * 1000:.0f} ms")
+
+            # Comprobación: la tesela decodificada contiene la capa pedida.
+            x, y = tiles_in_bounds(viewport_bounds(CENTER, 9), 9)[0]
+            content = session.get(server.url_for("RIVERS").format(z=9, x=x, y=y)).content
+            decoded = mapbox_vector_tile.decode(content) if content else {}
+            print(f"tesela RIVERS 9/{x}/{y}: {len(decoded.get('RIVERS', {}).get('features', []))} features")
+        finally:
+            server.shutdown()
+            data_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/http_range_server.py
+#
+# Servidor HTTP local con soporte de cabeceras Range (bytes=a-b), para simular el bucket R2
+# de LAYER_MAPPING en los benchmarks. http.server de la biblioteca estándar no las admite.
+
+import http.server
+import os
+import re
+import threading
+import time
+from functools import partial
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler con respuestas 206 para un único rango de bytes."""
+
+    # Contadores compartidos por todas las instancias de un servidor (ver serve_directory).
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        fail_after = self.stats.get("fail_after") if self.stats is not None else None
+        if self.command == "GET" and fail_after is not None and self.stats["requests"] >= fail_after:
+            # Simula un corte de la conexión con el bucket a partir de la petición n.
+            self.send_error(503, "Service Unavailable")
+            return None
+        match = _RANGE_RE.match(self.headers.get("Range", "").strip())
+        info = os.stat(path)
+        size = info.st_size
+        etag = f'"{info.st_mtime_ns:x}-{size:x}"'
+        f = open(path, "rb")
+        if match is None or (not match.group(1) and not match.group(2)):
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            if self.command == "GET" or not self.stats or not self.stats.get("head_without_length"):
+                self.send_header("Content-Length", str(size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self._count(size)
+            return f
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start = max(0, size - int(match.group(2)))
+            end = size - 1
+        if start >= size or start > end:
+            f.close()
+            self.send_error(416, "Requested Range Not Satisfiable")
+            return None
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        f.seek(start)
+        self._range_remaining = end - start + 1
+        self._count(end - start + 1)
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, "_range_remaining", None)
+        self._range_remaining = None
+        rate = self.stats.get("bytes_per_s") if self.stats is not None else None
+        if remaining is None and rate is None:
+            return super().copyfile(source, outputfile)
+        start = time.perf_counter()
+        sent = 0
+        while remaining is None or remaining > 0:
+            chunk = source.read(64 * 1024 if remaining is None else min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            sent += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+            if rate:
+                # Ancho de banda limitado por conexión, como el de un bucket remoto.
+                delay = sent / rate - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def _count(self, n_bytes):
+        if self.stats is not None and self.command == "GET":
+            with self.stats["lock"]:
+                self.stats["requests"] += 1
+                self.stats["bytes"] += n_bytes
+
+
+def serve_directory(directory, bytes_per_s=None):
+    """
+    Arranca un servidor con hilos sobre `directory` en un puerto libre. Devuelve
+    (url_base, stats, server); stats cuenta peticiones y bytes servidos. Con
+    bytes_per_s se limita el ancho de banda de cada conexión, poniendo
+    stats["fail_after"] = n las peticiones GET a partir de la n-ésima reciben un 503, y
+    con stats["head_without_length"] = True las respuestas a HEAD no llevan
+    Content-Length (sí el ETag), como las de algunos servidores y CDN.
+    """
+    stats = {"requests": 0, "bytes": 0, "lock": threading.Lock(),
+             "bytes_per_s": bytes_per_s, "fail_after": None, "head_without_length": False}
+    handler = type("Handler", (RangeRequestHandler,), {"stats": stats})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", stats, server
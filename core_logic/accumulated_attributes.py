@@ -0,0 +1,232 @@
+# core_logic/accumulated_attributes.py
+#
+# Rásters de atributos acumulados aguas abajo para las capas de la Pestaña 1.
+#
+# Para cada capa (MDT, P0, I1ID y RAIN_2 ... RAIN_500) se acumula sobre FLOWDIRS la suma
+# y el número de celdas válidas, muestreadas en los centros de celda del MDT igual que
+# hace BasinCalculatorRefactored. Así la media de la cuenca de cualquier punto de salida
+# es suma / recuento leídos en un único píxel. Junto a ellas se guardan el número de
+# celdas, las cotas mínima y máxima y el recorrido de flujo más largo aguas arriba, de
+# modo que calculate() sólo recorre la cuenca cuando necesita su geometría.
+#
+# Construcción (offline, una vez por versión de las capas):
+#     python -m core_logic.accumulated_attributes [--output CARPETA]
+
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+from .gis_utils import DERIVED_DATA_DIR, LAYER_MAPPING, get_local_path_from_url
+from .upstream_index import accumulate, downstream_indices, longest_upstream_paths, topological_levels
+from .zonal_stats import LayerSampler
+
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    GDAL_AVAILABLE = False
+    gdal = None
+
+ACCUMULATED_DIR = os.path.join(DERIVED_DATA_DIR, "accumulated")
+RAIN_LAYERS = {2: "RAIN_2", 5: "RAIN_5", 10: "RAIN_10", 25: "RAIN_25", 100: "RAIN_100", 500: "RAIN_500"}
+ACCUMULATED_LAYERS = ("MDT", "P0", "I1ID") + tuple(RAIN_LAYERS.values())
+AREA_LAYER = "AREA"
+HEIGHT_LAYER = "HEIGHT"
+FLOWPATH_LAYER = "FLOWPATH"
+
+TIFF_OPTIONS = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"]
+
+
+def sample_on_grid(layer, layer_gt, layer_nodata, grid_gt, grid_shape, positive_only=True):
+    """
+    Values of `layer` at the cell centres of another grid, as float64 with NaN
+    where the centre falls outside the layer, on nodata or (if positive_only) on
+    values <= 0. Pixel lookup reproduces gdal.ApplyGeoTransform + int().
+    """
+    rows, cols = grid_shape
+    sampler = LayerSampler(layer, layer_gt, layer_nodata, grid_gt, grid_shape)
+    out = np.empty(grid_shape)
+    col_idx = np.arange(cols)
+    for row in range(rows):
+        out[row] = sampler.sample(np.full(cols, row), col_idx, positive_only)
+    return out
+
+
+def _write_raster(path, bands, geo_transform, projection, gdal_type):
+    rows, cols = bands[0].shape
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(path, cols, rows, len(bands), gdal_type, options=TIFF_OPTIONS)
+    ds.SetGeoTransform(geo_transform)
+    ds.SetProjection(projection)
+    for i, array in enumerate(bands, start=1):
+        band = ds.GetRasterBand(i)
+        band.WriteArray(array)
+        if np.issubdtype(array.dtype, np.floating):
+            band.SetNoDataValue(float("nan"))
+    ds.FlushCache()
+    ds = None
+
+
+def build_accumulated_rasters(layer_paths, output_dir):
+    """
+    Runs the weighted flow accumulations and writes acc_<LAYER>.tif (band 1: sum,
+    band 2: count of valid cells, both Float64), acc_AREA.tif (number of cells
+    draining to each cell), acc_HEIGHT.tif (minimum and maximum valid MDT height
+    upstream) and acc_FLOWPATH.tif (orthogonal steps, diagonal steps and flat index
+    of the first cell of the longest flow path, -1 if there is none).
+    Cells inside flow-direction cycles are written as NaN so that calculate()
+    falls back to gathering their values.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    mdt_ds = gdal.Open(layer_paths["MDT"], gdal.GA_ReadOnly)
+    mdt_band = mdt_ds.GetRasterBand(1)
+    mdt = mdt_band.ReadAsArray()
+    mdt_gt = mdt_ds.GetGeoTransform()
+    projection = mdt_ds.GetProjection()
+
+    dirs = gdal.Open(layer_paths["FLOWDIRS"], gdal.GA_ReadOnly).GetRasterBand(1).ReadAsArray()
+    down = downstream_indices(dirs)
+    levels = topological_levels(down)
+    in_cycle = np.ones(dirs.size, dtype=bool)
+    for level in levels:
+        in_cycle[level] = False
+    down[in_cycle] = -1
+
+    area = accumulate(np.ones(dirs.size, dtype=np.uint32), down, levels)
+    _write_raster(os.path.join(output_dir, f"acc_{AREA_LAYER}.tif"),
+                  [area.reshape(dirs.shape)], mdt_gt, projection, gdal.GDT_UInt32)
+    del area
+
+    heights = mdt.reshape(-1).astype(np.float64)
+    nodata = mdt_band.GetNoDataValue()
+    if nodata is not None:
+        heights[mdt.reshape(-1) == nodata] = np.nan
+    valid_h = ~np.isnan(heights)
+    min_h = accumulate(heights, down, levels, ufunc=np.fmin)
+    max_h = accumulate(heights, down, levels, ufunc=np.fmax)
+    min_h[in_cycle] = np.nan
+    max_h[in_cycle] = np.nan
+    _write_raster(os.path.join(output_dir, f"acc_{HEIGHT_LAYER}.tif"),
+                  [min_h.reshape(mdt.shape), max_h.reshape(mdt.shape)], mdt_gt, projection, gdal.GDT_Float64)
+    del min_h, max_h
+
+    # Pasos y celda de inicio en Float64 (exacto hasta 2**53) para poder marcar con NaN
+    # las celdas de los ciclos.
+    paths = [band.astype(np.float64) for band in longest_upstream_paths(down, levels, dirs.reshape(-1), valid_h)]
+    for band in paths:
+        band[in_cycle] = np.nan
+    _write_raster(os.path.join(output_dir, f"acc_{FLOWPATH_LAYER}.tif"),
+                  [band.reshape(mdt.shape) for band in paths], mdt_gt, projection, gdal.GDT_Float64)
+    del paths, heights
+
+    for key in ACCUMULATED_LAYERS:
+        if key == "MDT":
+            values = mdt.astype(np.float64)
+            nodata = mdt_band.GetNoDataValue()
+            if nodata is not None:
+                values[mdt == nodata] = np.nan
+        else:
+            ds = gdal.Open(layer_paths[key], gdal.GA_ReadOnly)
+            band = ds.GetRasterBand(1)
+            values = sample_on_grid(band.ReadAsArray(), ds.GetGeoTransform(), band.GetNoDataValue(),
+                                    mdt_gt, mdt.shape, positive_only=True)
+            ds = None
+        values = values.reshape(-1)
+        valid = ~np.isnan(values)
+        sums = accumulate(np.where(valid, values, 0.0), down, levels)
+        counts = accumulate(valid.astype(np.float64), down, levels)
+        sums[in_cycle] = np.nan
+        _write_raster(os.path.join(output_dir, f"acc_{key}.tif"),
+                      [sums.reshape(mdt.shape), counts.reshape(mdt.shape)],
+                      mdt_gt, projection, gdal.GDT_Float64)
+        print(f"Capa acumulada {key} escrita.")
+
+    meta = {"shape": list(mdt.shape), "geotransform": list(mdt_gt), "layers": list(ACCUMULATED_LAYERS)}
+    with open(os.path.join(output_dir, "accumulated.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class AccumulatedAttributes:
+    """
+    Point reader for the rasters written by build_accumulated_rasters. GDAL
+    datasets are not thread-safe, so reads are serialised with a lock.
+    """
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, "accumulated.json")) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta["shape"])
+        self._datasets = {}
+        self._lock = threading.Lock()
+        for key in (AREA_LAYER, HEIGHT_LAYER, FLOWPATH_LAYER) + tuple(self.meta["layers"]):
+            ds = gdal.Open(os.path.join(folder, f"acc_{key}.tif"), gdal.GA_ReadOnly)
+            if ds is None:
+                raise FileNotFoundError(f"Falta el ráster acumulado acc_{key}.tif")
+            self._datasets[key] = ds
+
+    @classmethod
+    def open(cls, folder=ACCUMULATED_DIR, expected_shape=None):
+        """Opens the rasters if they exist (and match `expected_shape`), otherwise returns None."""
+        if not GDAL_AVAILABLE or not os.path.exists(os.path.join(folder, "accumulated.json")):
+            return None
+        try:
+            acc = cls(folder)
+        except Exception as e:
+            print(f"Warning: No se pudieron abrir los rásters acumulados en {folder}: {e}")
+            return None
+        if expected_shape is not None and acc.shape != tuple(expected_shape):
+            print(f"Warning: Los rásters acumulados de {folder} no coinciden con el MDT. Se ignoran.")
+            return None
+        return acc
+
+    def _pixel(self, key, band_number, row, col):
+        band = self._datasets[key].GetRasterBand(band_number)
+        return band.ReadAsArray(int(col), int(row), 1, 1)[0, 0]
+
+    def read(self, row, col):
+        """
+        Basin attributes of the outlet cell (row, col), or None if the cell lies in
+        a flow-direction cycle. Returns a dict with cells, min_h, max_h (valid MDT
+        heights upstream, NaN if there are none), orth_steps and diag_steps of the
+        longest flow path, farthest (flat index of its first cell, -1 if none) and
+        sums ({layer: (sum, count)}).
+        """
+        sums = {}
+        with self._lock:
+            for key in self.meta["layers"]:
+                total = float(self._pixel(key, 1, row, col))
+                if np.isnan(total):
+                    return None
+                sums[key] = (total, int(self._pixel(key, 2, row, col)))
+            return {
+                "cells": int(self._pixel(AREA_LAYER, 1, row, col)),
+                "min_h": float(self._pixel(HEIGHT_LAYER, 1, row, col)),
+                "max_h": float(self._pixel(HEIGHT_LAYER, 2, row, col)),
+                "orth_steps": int(self._pixel(FLOWPATH_LAYER, 1, row, col)),
+                "diag_steps": int(self._pixel(FLOWPATH_LAYER, 2, row, col)),
+                "farthest": int(self._pixel(FLOWPATH_LAYER, 3, row, col)),
+                "sums": sums,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye los rásters acumulados de la Pestaña 1.")
+    parser.add_argument("--output", default=ACCUMULATED_DIR, help="Carpeta de salida.")
+    args = parser.parse_args()
+
+    if not GDAL_AVAILABLE:
+        raise ImportError("GDAL no está disponible. No se pueden construir los rásters acumulados.")
+    gdal.UseExceptions()
+
+    keys = ("MDT", "FLOWDIRS", "P0", "I1ID") + tuple(RAIN_LAYERS.values())
+    layer_paths = {key: get_local_path_from_url(LAYER_MAPPING[key]) for key in keys}
+    build_accumulated_rasters(layer_paths, args.output)
+    print(f"Rásters acumulados escritos en {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
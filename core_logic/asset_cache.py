@@ -0,0 +1,561 @@
+# core_logic/asset_cache.py
+#
+# Caché persistente de las capas que se descargan de R2 (GPKG, ZIP, COG...).
+#
+# Los ficheros se guardan por contenido (objects/<sha256><extensión>) en una carpeta
+# configurable con CAUMAX_ASSET_CACHE_DIR; en Render apunta al disco persistente, así que
+# un reinicio del contenedor ya no obliga a descargar todo otra vez. Un índice JSON relaciona
+# cada URL con su objeto, su ETag/tamaño remoto, su último acceso y sus bytes. Ficheros e
+# índice se escriben en un temporal y se renombran, de modo que un proceso interrumpido
+# nunca deja a medias una entrada. El presupuesto CAUMAX_ASSET_CACHE_MB incluye las
+# descargas en curso: antes de transferir un fichero se reserva su Content-Length y se
+# eliminan los objetos de acceso más antiguo hasta que quepa.
+#
+# Las transferencias pasan por un DownloadManager con una requests.Session compartida
+# (keep-alive) y una sola descarga en curso por URL: si varias sesiones o hilos piden a la
+# vez una capa que no está en la caché, el primero la descarga y los demás esperan su
+# resultado en lugar de repetir la transferencia.
+#
+# Los ficheros grandes (el MDT25 nacional, el ZIP del MTN25...) se descargan en segmentos
+# con cabeceras Range en un pool de hilos. Cada segmento terminado queda anotado junto al
+# fichero parcial, de modo que una transferencia interrumpida se reanuda donde se quedó.
+# Los parciales reanudables también cuentan en el presupuesto; el resto de temporales
+# que deja un proceso interrumpido se borra al arrancar.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ASSET_CACHE_DIR = os.environ.get(
+    "CAUMAX_ASSET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "caumax_asset_cache")
+)
+ASSET_CACHE_BYTES = int(os.environ.get("CAUMAX_ASSET_CACHE_MB", "900")) * 1024 * 1024
+# Segundos durante los que una entrada se da por vigente sin volver a preguntar (HEAD)
+# si su ETag ha cambiado.
+ASSET_REVALIDATE_SECONDS = int(os.environ.get("CAUMAX_ASSET_REVALIDATE_S", "3600"))
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT_S = 30
+# Conexiones keep-alive por host en la Session compartida.
+DOWNLOAD_POOL_SIZE = 16
+# Descargas por segmentos: a partir de qué tamaño, de cuánto cada segmento y cuántos a la vez.
+DOWNLOAD_PARALLEL_MIN_BYTES = int(os.environ.get("CAUMAX_DOWNLOAD_PARALLEL_MIN_MB", "64")) * 1024 * 1024
+DOWNLOAD_SEGMENT_BYTES = int(os.environ.get("CAUMAX_DOWNLOAD_SEGMENT_MB", "16")) * 1024 * 1024
+DOWNLOAD_CONCURRENCY = int(os.environ.get("CAUMAX_DOWNLOAD_CONCURRENCY", "8"))
+
+
+def _same_version(entry, etag, size):
+    """
+    Whether the remote (etag, size) still matches a cache entry: by ETag when both sides
+    have one, otherwise by size when both report one. Without either, it has changed.
+    """
+    if etag and entry.get("etag"):
+        return etag == entry["etag"]
+    if size is not None and entry.get("size") is not None:
+        return size == entry["size"]
+    return False
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _Flight:
+    """Una transferencia en curso: los que llegan después esperan a `done`."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DownloadManager:
+    """
+    Pooled HTTP session plus per-key in-flight de-duplication. `single_flight(key, fn)`
+    runs `fn` once for concurrent callers with the same key; the others block and get
+    the same result (or exception).
+    """
+
+    def __init__(self, pool_size=DOWNLOAD_POOL_SIZE, segment_bytes=DOWNLOAD_SEGMENT_BYTES,
+                 concurrency=DOWNLOAD_CONCURRENCY, parallel_min_bytes=DOWNLOAD_PARALLEL_MIN_BYTES):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=max(pool_size, concurrency))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.segment_bytes = segment_bytes
+        self.concurrency = concurrency
+        self.parallel_min_bytes = parallel_min_bytes
+        self.transfers = 0
+        self.coalesced = 0
+        self.transferred_bytes = 0
+        # Última transferencia de cada URL: bytes, segundos, MB/s, segmentos y bytes reanudados.
+        self.throughput = {}
+        # Bytes recibidos y totales (None si no se conocen) de cada URL, también en curso.
+        self.progress = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def single_flight(self, key, fn):
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def _probe(self, url):
+        try:
+            r = self.session.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT_S)
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            return None
+        return r.headers
+
+    @staticmethod
+    def _remote_size(headers):
+        # Con Content-Encoding el Content-Length no es el tamaño en disco.
+        if headers is None or headers.get("Content-Encoding"):
+            return None
+        size = headers.get("Content-Length")
+        return int(size) if size is not None else None
+
+    def head(self, url):
+        """
+        (etag, size) reported by a HEAD request, with size None when the server does not
+        give a usable one; None if the server cannot be reached.
+        """
+        headers = self._probe(url)
+        if headers is None:
+            return None
+        return headers.get("ETag"), self._remote_size(headers)
+
+    @staticmethod
+    def part_path(tmp_dir, url):
+        """Resumable partial file of a segmented download of `url`."""
+        return os.path.join(tmp_dir, hashlib.sha1(url.encode()).hexdigest() + ".part")
+
+    def download(self, url, tmp_dir, reserve=None):
+        """
+        Downloads `url` into a temporary file in `tmp_dir`: as parallel range segments
+        when the server accepts ranges and the file is at least parallel_min_bytes,
+        otherwise as a single stream. Before the transfer starts, `reserve` (if given)
+        is called with the expected size in bytes, or None if the server does not
+        report it. Returns (tmp_path, sha256, n_bytes, etag, size), where size is the
+        one reported by the server (or None) for later revalidation; the caller renames
+        the file.
+        """
+        with self._lock:
+            self.transfers += 1
+        start = time.perf_counter()
+        headers = self._probe(url)
+        size = self._remote_size(headers)
+        if reserve is not None:
+            reserve(size)
+        if (size is not None and size >= self.parallel_min_bytes
+                and headers.get("Accept-Ranges", "").lower() == "bytes"):
+            tmp_path, n_bytes, etag, transferred, segments = self._download_segments(
+                url, tmp_dir, headers.get("ETag"), size)
+            sha256 = self._sha256(tmp_path)
+        else:
+            tmp_path, sha256, n_bytes, etag = self._download_stream(url, tmp_dir)
+            transferred, segments = n_bytes, 1
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.transferred_bytes += transferred
+            self.throughput[url] = {
+                "bytes": transferred, "seconds": seconds,
+                "mb_per_s": transferred / 2**20 / seconds if seconds > 0 else 0.0,
+                "segments": segments, "resumed_bytes": n_bytes - transferred,
+            }
+        print(f"Descarga de {os.path.basename(url)}: {transferred / 2**20:.1f} MB en {seconds:.1f} s "
+              f"({self.throughput[url]['mb_per_s']:.1f} MB/s, {segments} segmento(s), "
+              f"{(n_bytes - transferred) / 2**20:.1f} MB reanudados)")
+        return tmp_path, sha256, n_bytes, etag, size
+
+    def _download_stream(self, url, tmp_dir):
+        tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        n_bytes = 0
+        try:
+            with self.session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT_S) as r:
+                r.raise_for_status()
+                etag = r.headers.get("ETag")
+                # Con Content-Encoding el Content-Length no es el tamaño descomprimido.
+                size = None if r.headers.get("Content-Encoding") else r.headers.get("Content-Length")
+                self.progress[url] = [0, int(size) if size is not None else None]
+                with open(tmp_path, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        n_bytes += len(chunk)
+                        self.progress[url][0] = n_bytes
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        size = int(size) if size is not None else n_bytes
+        if n_bytes == 0 or n_bytes != size:
+            os.remove(tmp_path)
+            raise IOError(f"Descarga incompleta de {url}: {n_bytes} de {size} bytes.")
+        return tmp_path, digest.hexdigest(), n_bytes, etag
+
+    def _download_segments(self, url, tmp_dir, etag, size):
+        """
+        Range download into <tmp_dir>/<sha1(url)>.part. Finished segments are listed in
+        a .part.json sidecar; if it matches the remote ETag/size and segment size, only
+        the missing segments are requested. Returns (part_path, size, etag,
+        transferred_bytes, n_segments).
+        """
+        part_path = self.part_path(tmp_dir, url)
+        state_path = part_path + ".json"
+        state = {"url": url, "etag": etag, "size": size, "segment_bytes": self.segment_bytes, "done": []}
+        try:
+            with open(state_path) as f:
+                previous = json.load(f)
+            if (all(previous.get(k) == state[k] for k in ("url", "etag", "size", "segment_bytes"))
+                    and os.path.getsize(part_path) == size):
+                state["done"] = previous["done"]
+        except (OSError, ValueError):
+            pass
+        if not state["done"]:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        done = set(state["done"])
+        progress = self.progress[url] = [0, size]
+        for i in done:
+            progress[0] += min(self.segment_bytes, size - i * self.segment_bytes)
+        segments = [(i, start, min(start + self.segment_bytes, size) - 1)
+                    for i, start in enumerate(range(0, size, self.segment_bytes)) if i not in done]
+        state_lock = threading.Lock()
+
+        def fetch_segment(segment):
+            i, start, end = segment
+            headers = {"Range": f"bytes={start}-{end}"}
+            if etag:
+                # Si el fichero remoto cambia, el servidor responde 200 en vez de 206.
+                headers["If-Range"] = etag
+            written = 0
+            with self.session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT_S) as r:
+                r.raise_for_status()
+                if r.status_code != 206 or not r.headers.get("Content-Range", "").startswith(f"bytes {start}-{end}/"):
+                    raise IOError(f"El servidor no ha devuelto el rango {start}-{end} de {url}.")
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        f.write(chunk)
+                        written += len(chunk)
+                        with state_lock:
+                            progress[0] += len(chunk)
+            if written != end - start + 1:
+                raise IOError(f"Segmento incompleto {start}-{end} de {url}: {written} bytes.")
+            with state_lock:
+                state["done"].append(i)
+                tmp_state = f"{state_path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_state, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_state, state_path)
+            return written
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            transferred = sum(pool.map(fetch_segment, segments))
+
+        if os.path.getsize(part_path) != size:
+            raise IOError(f"Tamaño final de {url} incorrecto: {os.path.getsize(part_path)} de {size} bytes.")
+        os.remove(state_path)
+        return part_path, size, etag, transferred, len(segments)
+
+    @staticmethod
+    def _sha256(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+class AssetCache:
+    """
+    Content-addressed, size-bounded cache of remote files. `fetch(url)` returns a
+    local path, downloading the file only when it is missing or its ETag/size has
+    changed; hits, misses and downloaded bytes are counted. Downloads go through
+    `downloader`, so concurrent misses on the same URL share one transfer.
+    """
+
+    def __init__(self, folder=ASSET_CACHE_DIR, max_bytes=ASSET_CACHE_BYTES,
+                 revalidate_seconds=ASSET_REVALIDATE_SECONDS, downloader=None):
+        self.folder = folder
+        self.downloader = downloader if downloader is not None else DownloadManager()
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.downloaded_bytes = 0
+        self._lock = threading.Lock()
+        self._validated_at = {}
+        # Bytes reservados por URL: descargas en curso y parciales reanudables en tmp/
+        # (_partials, los que no se están descargando ahora).
+        self._reserved = {}
+        self._partials = set()
+        self._tmp_dir = os.path.join(folder, "tmp")
+        os.makedirs(os.path.join(folder, "objects"), exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._clean_tmp()
+        self._index_path = os.path.join(folder, "index.json")
+        self._index = self._read_index()
+        # El presupuesto puede haber bajado desde el último arranque.
+        if self._used_bytes() > self.max_bytes:
+            self._evict(keep=None)
+            self._drop_partials(keep=None)
+            self._write_index()
+
+    def _clean_tmp(self):
+        """
+        Removes the temporary files left by an interrupted process, except the
+        partial files of segmented downloads that can be resumed, which are
+        reserved in the budget under their URL.
+        """
+        names = set(os.listdir(self._tmp_dir))
+        for name in names:
+            path = os.path.join(self._tmp_dir, name)
+            if name.endswith(".part") and name + ".json" in names:
+                try:
+                    with open(path + ".json") as f:
+                        url = json.load(f)["url"]
+                except (OSError, ValueError, KeyError):
+                    url = None
+                if url is not None and self.downloader.part_path(self._tmp_dir, url) == path:
+                    self._reserved[url] = os.path.getsize(path)
+                    self._partials.add(url)
+                    continue
+                _remove_file(path + ".json")
+            elif name.endswith(".part.json") and name[:-len(".json")] in names:
+                continue  # Se decide junto con su fichero parcial.
+            _remove_file(path)
+
+    # --- Índice ---
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Se descartan las entradas cuyo objeto ya no está en disco.
+        return {url: entry for url, entry in index.items()
+                if os.path.exists(os.path.join(self.folder, entry["object"]))}
+
+    def _write_index(self):
+        tmp_path = f"{self._index_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(tmp_path, self._index_path)
+
+    @property
+    def bytes(self):
+        """Bytes on disk of the cached objects (shared objects counted once)."""
+        objects = {entry["object"]: entry["bytes"] for entry in self._index.values()}
+        return sum(objects.values())
+
+    def _used_bytes(self):
+        """Cached objects plus the space reserved for transfers and resumable partial files."""
+        return self.bytes + sum(self._reserved.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "downloaded_bytes": self.downloaded_bytes, "bytes": self.bytes,
+                "reserved_bytes": sum(self._reserved.values()),
+                "max_bytes": self.max_bytes, "entries": len(self._index),
+                "transfers": self.downloader.transfers, "coalesced": self.downloader.coalesced,
+            }
+
+    # --- Descarga ---
+
+    def _path_if_fresh(self, url):
+        """Local path of `url` if it was (re)validated less than revalidate_seconds ago. Call with the lock held."""
+        entry = self._index.get(url)
+        checked = self._validated_at.get(url)
+        if entry is None or checked is None or time.time() - checked >= self.revalidate_seconds:
+            return None
+        return self._hit(entry)
+
+    def _hit(self, entry):
+        # El último acceso se guarda en disco con el siguiente cambio del índice (descarga,
+        # expulsión): reescribir index.json en cada acierto no compensa.
+        self.hits += 1
+        entry["last_access"] = time.time()
+        return os.path.join(self.folder, entry["object"])
+
+    def fetch(self, url):
+        """Local path of `url`, downloading it into the cache if needed."""
+        with self._lock:
+            path = self._path_if_fresh(url)
+            entry = self._index.get(url)
+        if path is not None:
+            return path
+
+        # La revalidación (HEAD) se hace sin el cerrojo para no bloquear otras URL.
+        if entry is not None:
+            version = self.downloader.head(url)
+            # Sin red se sirve lo que haya en disco.
+            if version is None or _same_version(entry, *version):
+                with self._lock:
+                    if self._index.get(url) is entry:
+                        self._validated_at[url] = time.time()
+                        return self._hit(entry)
+        return self.downloader.single_flight(url, lambda: self._download(url))
+
+    def _download(self, url):
+        with self._lock:
+            # Otro hilo puede haber terminado esta misma descarga justo antes.
+            path = self._path_if_fresh(url)
+            if path is not None:
+                return path
+            self.misses += 1
+
+        try:
+            tmp_path, sha256, n_bytes, etag, size = self.downloader.download(
+                url, self._tmp_dir, reserve=lambda size: self._reserve(url, size))
+        except BaseException:
+            with self._lock:
+                self._release(url)
+            raise
+        extension = os.path.splitext(os.path.basename(url.split("?")[0]))[1]
+        object_name = os.path.join("objects", sha256 + extension)
+        object_path = os.path.join(self.folder, object_name)
+
+        with self._lock:
+            if os.path.exists(object_path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, object_path)
+            self.downloaded_bytes += n_bytes
+            self._release(url)
+
+            previous = self._index.get(url)
+            self._index[url] = {
+                "object": object_name, "etag": etag, "size": size,
+                "bytes": n_bytes, "last_access": time.time(),
+            }
+            if previous is not None and previous["object"] != object_name:
+                self._remove_object_if_unused(previous["object"])
+            self._validated_at[url] = time.time()
+            self._evict(keep=url)
+            self._write_index()
+            return object_path
+
+    # --- Expulsión ---
+
+    def _remove_object_if_unused(self, object_name):
+        if any(entry["object"] == object_name for entry in self._index.values()):
+            return
+        try:
+            os.remove(os.path.join(self.folder, object_name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep):
+        """
+        Drops least recently used entries (never `keep`) until the objects and the
+        reserved space fit in max_bytes. Returns True if anything was dropped.
+        """
+        by_age = sorted((entry["last_access"], url) for url, entry in self._index.items() if url != keep)
+        evicted = False
+        for _, url in by_age:
+            if self._used_bytes() <= self.max_bytes:
+                break
+            entry = self._index.pop(url)
+            self._validated_at.pop(url, None)
+            self._remove_object_if_unused(entry["object"])
+            self.evictions += 1
+            evicted = True
+        return evicted
+
+    def _drop_partials(self, keep):
+        """Deletes resumable partial files (never the one of `keep`) while the budget is exceeded."""
+        for url in sorted(self._partials - {keep}):
+            if self._used_bytes() <= self.max_bytes:
+                break
+            part_path = self.downloader.part_path(self._tmp_dir, url)
+            _remove_file(part_path)
+            _remove_file(part_path + ".json")
+            self._partials.discard(url)
+            del self._reserved[url]
+
+    def _reserve(self, url, size):
+        """
+        Reserves `size` bytes for the download of `url` before it starts, evicting
+        least recently used objects (and stale partial files) until it fits.
+        """
+        if size is None:
+            return
+        with self._lock:
+            self._partials.discard(url)
+            self._reserved[url] = size
+            evicted = self._evict(keep=None)
+            self._drop_partials(keep=url)
+            if evicted:
+                self._write_index()
+            if self._used_bytes() > self.max_bytes:
+                print(f"Warning: {os.path.basename(url)} ({size / 2**20:.0f} MB) no cabe en el presupuesto "
+                      f"de la caché de capas ({self.max_bytes / 2**20:.0f} MB).")
+
+    def _release(self, url):
+        """Frees the reservation of `url`, keeping the size of a resumable partial file if one is left. Call with the lock held."""
+        self._reserved.pop(url, None)
+        self._partials.discard(url)
+        part_path = self.downloader.part_path(self._tmp_dir, url)
+        if os.path.exists(part_path + ".json") and os.path.exists(part_path):
+            self._reserved[url] = os.path.getsize(part_path)
+            self._partials.add(url)
+
+    def clear(self):
+        with self._lock:
+            for url in list(self._index):
+                entry = self._index.pop(url)
+                self._remove_object_if_unused(entry["object"])
+            self._validated_at.clear()
+            self._write_index()
+
+
+_asset_cache = None
+_asset_cache_lock = threading.Lock()
+
+
+def get_asset_cache():
+    """Process-wide AssetCache over ASSET_CACHE_DIR."""
+    global _asset_cache
+    with _asset_cache_lock:
+        if _asset_cache is None:
+            _asset_cache = AssetCache()
+        return _asset_cache
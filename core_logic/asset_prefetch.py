@@ -0,0 +1,153 @@
+# core_logic/asset_prefetch.py
+#
+# Precarga en segundo plano de las capas de LAYER_MAPPING que necesitan copia local.
+#
+# Sólo se precargan PREFETCH_LAYERS: las capas vectoriales del mapa y el MDT y FLOWDIRS
+# que carga el calculador de cuencas. Los COG de cuantiles (FLOW_*, RAIN_*) y el resto de
+# rásters se leen por /vsicurl/ bloque a bloque, o se descargan cuando se piden.
+#
+# Al arrancar el proceso se lanzan esas descargas a la vez en un pool de hilos, en
+# vez de hacerlas una a una dentro del primer cálculo o del primer dibujado del mapa. Un
+# registro guarda el estado de cada capa (pendiente, descargando, lista, error) y su
+# progreso en bytes, que consultan la barra lateral y, opcionalmente, un endpoint HTTP de
+# salud (CAUMAX_HEALTH_PORT). wait_for_assets(keys) espera sólo a las capas indicadas.
+
+import http.server
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import streamlit as st
+
+from .asset_cache import get_asset_cache
+from .gis_utils import LAYER_MAPPING, get_local_path_from_url
+
+PREFETCH_WORKERS = int(os.environ.get("CAUMAX_PREFETCH_WORKERS", "6"))
+HEALTH_PORT = os.environ.get("CAUMAX_HEALTH_PORT")
+PREFETCH_LAYERS = ("BASINS", "RIVERS", "ZONES", "MDT", "FLOWDIRS")
+
+
+class AssetPrefetcher:
+    """
+    Fetches every URL of `layer_mapping` into the asset cache from a thread pool and
+    keeps a per-key readiness registry (state, local path, error, bytes, seconds).
+    """
+
+    def __init__(self, layer_mapping, cache=None, max_workers=PREFETCH_WORKERS):
+        self.layer_mapping = dict(layer_mapping)
+        self.cache = cache if cache is not None else get_asset_cache()
+        self.max_workers = max_workers
+        self.futures = {}
+        self._registry = {key: {"state": "pending", "path": None, "error": None, "seconds": None}
+                          for key in self.layer_mapping}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def start(self):
+        if self._pool is not None:
+            return self
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="asset-prefetch")
+        for key in self.layer_mapping:
+            self.futures[key] = self._pool.submit(self._fetch, key)
+        self._pool.shutdown(wait=False)
+        return self
+
+    def _fetch(self, key):
+        start = time.perf_counter()
+        self._update(key, state="downloading")
+        try:
+            path = self.cache.fetch(self.layer_mapping[key])
+        except Exception as e:
+            print(f"Warning: No se pudo precargar la capa {key}: {e}")
+            self._update(key, state="error", error=str(e), seconds=time.perf_counter() - start)
+            return None
+        self._update(key, state="ready", path=path, seconds=time.perf_counter() - start)
+        return path
+
+    def _update(self, key, **values):
+        with self._lock:
+            self._registry[key].update(values)
+
+    def status(self):
+        """{key: {state, path, error, seconds, received_bytes, total_bytes}} for every layer."""
+        progress = self.cache.downloader.progress
+        with self._lock:
+            status = {key: dict(entry) for key, entry in self._registry.items()}
+        for key, entry in status.items():
+            received, total = progress.get(self.layer_mapping[key], (0, None))
+            if entry["state"] == "ready" and entry["path"] is not None:
+                received = total = os.path.getsize(entry["path"]) if os.path.exists(entry["path"]) else received
+            entry["received_bytes"], entry["total_bytes"] = received, total
+        return status
+
+    def summary(self):
+        status = self.status()
+        ready = [key for key, entry in status.items() if entry["state"] == "ready"]
+        errors = {key: entry["error"] for key, entry in status.items() if entry["state"] == "error"}
+        return {
+            "ready": len(ready), "total": len(status), "errors": errors,
+            "done": len(ready) + len(errors) == len(status),
+            "received_bytes": sum(entry["received_bytes"] or 0 for entry in status.values()),
+            "total_bytes": sum(entry["total_bytes"] or 0 for entry in status.values()),
+        }
+
+    def wait(self, keys, timeout=None):
+        """{key: local path or None} once the given layers have finished (or `timeout` expires)."""
+        futures = [self.futures[key] for key in keys if key in self.futures]
+        wait(futures, timeout=timeout)
+        return {key: self.futures[key].result() if key in self.futures and self.futures[key].done() else None
+                for key in keys}
+
+
+def start_health_server(prefetcher, port):
+    """
+    Serves the prefetch summary and per-layer status as JSON on `port`: 200 once every
+    layer is ready, 503 while any is pending or has failed.
+    """
+    class HealthHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            summary = prefetcher.summary()
+            body = json.dumps({**summary, "assets": prefetcher.status()}).encode()
+            healthy = summary["done"] and not summary["errors"]
+            self.send_response(200 if healthy else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("0.0.0.0", port), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="asset-health").start()
+    return server
+
+
+@st.cache_resource
+def get_asset_prefetcher():
+    """Process-wide AssetPrefetcher over the PREFETCH_LAYERS of LAYER_MAPPING, started on first use."""
+    prefetcher = AssetPrefetcher({key: LAYER_MAPPING[key] for key in PREFETCH_LAYERS}).start()
+    if HEALTH_PORT:
+        try:
+            start_health_server(prefetcher, int(HEALTH_PORT))
+        except OSError as e:
+            print(f"Warning: No se pudo abrir el endpoint de salud en el puerto {HEALTH_PORT}: {e}")
+    return prefetcher
+
+
+def wait_for_assets(keys, layer_mapping=LAYER_MAPPING, timeout=None):
+    """
+    {key: local path or None} for the LAYER_MAPPING keys in `keys`. Layers that the
+    prefetcher is fetching are awaited; any other URL, or one whose prefetch failed,
+    is fetched on the spot.
+    """
+    prefetcher = get_asset_prefetcher()
+    prefetched = [key for key in keys if prefetcher.layer_mapping.get(key) == layer_mapping.get(key)]
+    paths = prefetcher.wait(prefetched, timeout=timeout)
+    for key in keys:
+        failed = key in paths and paths[key] is None and prefetcher.futures[key].done()
+        if key not in paths or failed:
+            paths[key] = get_local_path_from_url(layer_mapping[key])
+    return paths
@@ -1,7 +1,14 @@
 # core_logic/basin_calculator_refactored.py
 
 import numpy as np
-from .gis_utils import get_local_path_from_url, LAYER_MAPPING
+from .basin_data import get_basin_data_context
+from .upstream_index import accumulate, strahler_order, topological_levels
+from .hydrology_methods import calculate_concentration_times
+from .upstream_traversal import (
+    D8_BRANCH, D8_DOWNSTREAM, DIAGONAL_STEP, UpstreamTrace,
+    trace_upstream, farthest_position, walk_downstream,
+)
+from .crs_transform import WGS84, get_transformer, reproject_geometry
 try:
     from osgeo import gdal, osr, ogr
     GDAL_AVAILABLE = True
@@ -10,110 +17,123 @@ except ImportError:
     gdal = None
     osr = None
     ogr = None
-from shapely.geometry import shape, mapping
-from shapely.ops import transform as shapely_transform
+import shapely
+from shapely import wkb
+from shapely.geometry import LineString, mapping
 import os
 import math
-import statistics
 from collections import defaultdict
-import json
-from pyproj import Transformer
 import fiona
 
+# Tolerancia de simplificación de la geometría para el mapa, en celdas del MDT. Elimina
+# la escalera de vértices del contorno ráster sin alterar su topología.
+DISPLAY_SIMPLIFY_CELLS = 1.0
+# Máximo de celdas aguas abajo que puede moverse el punto de salida para reaprovechar la
+# cuenca anterior en lugar de recalcularla.
+NUDGE_MAX_STEPS = 10
+# Orden de Strahler mínimo por defecto de los cauces que delimitan subcuencas.
+SUBBASIN_MIN_ORDER = 3
+
+
 class BasinCalculatorRefactored:
-    def __init__(self, data_folder_unused, layer_mapping_from_app):
+    def __init__(self, data_folder_unused, layer_mapping_from_app, context=None):
         if not GDAL_AVAILABLE:
             raise ImportError("GDAL no está disponible. No se puede inicializar BasinCalculator.")
-        
-        gdal.UseExceptions()
-        gdal.AllRegister()
-
-        # --- LÓGICA REVERTIDA: Descargamos todos los archivos necesarios para la Pestaña 1 ---
-        # Estos archivos son los TIFs de la Pestaña 1, que son de tamaño manejable y ya funcionaban descargándolos.
-        self.local_layer_paths = {
-            key: get_local_path_from_url(url)
-            for key, url in layer_mapping_from_app.items()
-        }
 
-        # --- APERTURA DE ARCHIVOS ORIGINAL ---
-        mdt_path = self.local_layer_paths["MDT"]
-        flowdirs_path = self.local_layer_paths["FLOWDIRS"]
-
-        mdt_dataset = gdal.Open(mdt_path, gdal.GA_ReadOnly)
-        if mdt_dataset is None:
-            raise FileNotFoundError(f"No se pudo abrir el dataset MDT en {mdt_path}")
-        
-        mdt_band = mdt_dataset.GetRasterBand(1)
-        self.nodataMdt = mdt_band.GetNoDataValue()
-        self.mdt = mdt_band.ReadAsArray() # Este ReadAsArray funcionaba con el MDT pequeño
-        self.geoTransform = mdt_dataset.GetGeoTransform()
-        self.crs_wkt = mdt_dataset.GetProjection()
-
-        self.cellsize = self.geoTransform[1]
-        self.cellarea = self.cellsize * self.cellsize
-
-        flowdirs_dataset = gdal.Open(flowdirs_path, gdal.GA_ReadOnly)
-        if flowdirs_dataset is None:
-            raise FileNotFoundError(f"No se pudo abrir el dataset FLOWDIRS en {flowdirs_path}")
-        flowdirs_band = flowdirs_dataset.GetRasterBand(1)
-        self.nodataDirs = flowdirs_band.GetNoDataValue()
-        self.dirs = flowdirs_band.ReadAsArray() # Este ReadAsArray funcionaba con el DIR pequeño
-
-        self.secondaryLayers = {}
-        self.secondaryNodata = {}
-        self.secondaryTransforms = {}
-        
-        self._open_secondary_layer(self.local_layer_paths["I1ID"], "I1ID")
-        self._open_secondary_layer(self.local_layer_paths["P0"], "P0")
-
-        self.rainFiles = {
-            2: "RAIN_2", 5: "RAIN_5", 10: "RAIN_10",
-            25: "RAIN_25", 100: "RAIN_100", 500: "RAIN_500",
-        }
-        for returnPeriod, rainFileKey in self.rainFiles.items():
-            self._open_secondary_layer(self.local_layer_paths[rainFileKey], returnPeriod)
+        # Los rásters viven en un BasinDataContext compartido por todo el proceso; el
+        # calculador sólo guarda referencias (no copias) y el estado de cada punto de salida.
+        self.context = context if context is not None else get_basin_data_context(layer_mapping_from_app)
+
+        self.local_layer_paths = self.context.local_layer_paths
+        self.mdt = self.context.mdt
+        self.nodataMdt = self.context.nodataMdt
+        self.geoTransform = self.context.geoTransform
+        self.crs_wkt = self.context.crs_wkt
+        self.cellsize = self.context.cellsize
+        self.cellarea = self.context.cellarea
+        self.dirs = self.context.dirs
+        self.nodataDirs = self.context.nodataDirs
+        self.upstreamIndex = self.context.upstreamIndex
+        self.accumulatedAttributes = self.context.accumulatedAttributes
+        self.secondaryLayers = self.context.secondaryLayers
+        self.secondaryNodata = self.context.secondaryNodata
+        self.secondaryTransforms = self.context.secondaryTransforms
+        self.rainFiles = self.context.rainFiles
+        self.zonalStatistics = self.context.zonalStatistics
 
         self._resetValues()
 
-    def _open_secondary_layer(self, path, name):
-        ds = gdal.Open(path, gdal.GA_ReadOnly)
-        if ds is None:
-            print(f"Warning: Could not open secondary layer dataset at {path}")
-            return
-        band = ds.GetRasterBand(1)
-        self.secondaryLayers[name] = band.ReadAsArray()
-        self.secondaryTransforms[name] = ds.GetGeoTransform()
-        self.secondaryNodata[name] = band.GetNoDataValue()
-        ds = None
-
     def _resetValues(self):
         self.maxH = -float('inf')
         self.minH = float('inf')
         self.area = 0
         self.maxDistance = 0
+        self.meanH = None
         self.concentrationTime = 0
         self.xMaxDistance = None
         self.yMaxDistance = None
-        self.p0Values = []
-        self.i1idValues = []
-        self.rainValues = defaultdict(list)
-        self.basinCells = np.zeros(self.mdt.shape, dtype=np.int8)
-        self.visited_cells = set()
+        # Máscara de la cuenca recortada a su rectángulo envolvente; basinWindow es la
+        # (fila, columna) del MDT de su esquina superior izquierda.
+        self.basinCells = None
+        self.basinWindow = None
+        self.trace = None
+        self.outletCell = None
+        self.basinSums = None # {clave de LAYER_MAPPING: (suma, recuento)}, incluido "MDT"
+        self.farthestPos = None
+        self.subbasinLabels = None
+        self.subbasins = []
+        self.subbasinGeometry = {}
+        self.subbasinGeometryUTM = {}
+        self.flowLength = None # Longitud de flujo hasta la salida (m) sobre basinWindow
+        self.longestFlowPath = None # Polilínea del recorrido más largo en WGS84
+        self.longestFlowPathUTM = None
+        self.longestFlowPathProfile = None
+        self.concentrationTimes = {}
         self.basinGeometry = [] # <-- Geometría en WGS84 para el mapa
         self.basinGeometryUTM = [] # <-- MEJORA 2: Geometría en UTM para exportar
+        self.basinGeometryDisplay = [] # Geometría en WGS84 simplificada para dibujar en el mapa
 
-    def _mean(self, array):
-        if not array:
-            return None
-        valid_values = [float(v) for v in array if v is not None]
-        if not valid_values:
-            return None
-        return statistics.mean(valid_values)
-
-    def calculate(self, pt_utm):
-        self._resetValues()
-        self.pt_utm = pt_utm
+    def _meansFromSums(self, sums):
+        """
+        Basin means from (sum, count) pairs keyed like LAYER_MAPPING, as a dict
+        with i1id, p0, rain ({return period: mean}) and mean_h. Layers missing
+        from `sums` or without valid cells get no mean.
+        """
+        def mean_of(key):
+            total, count = sums.get(key, (0.0, 0))
+            return total / count if count > 0 else None
 
+        rain = {}
+        for returnPeriod, rainFileKey in self.rainFiles.items():
+            value = mean_of(rainFileKey)
+            if value is not None:
+                rain[returnPeriod] = value
+        return {"i1id": mean_of("I1ID"), "p0": mean_of("P0"), "rain": rain, "mean_h": mean_of("MDT")}
+
+    def _setStatisticsFromSums(self, sums):
+        """Sets i1id, p0, rain and (if "MDT" is given) meanH from (sum, count) pairs."""
+        means = self._meansFromSums(sums)
+        self.i1id = means["i1id"]
+        self.p0 = means["p0"]
+        self.rain = means["rain"]
+        if "MDT" in sums:
+            self.meanH = means["mean_h"]
+
+    @staticmethod
+    def _concentrationTime(max_distance, min_h, max_h):
+        """Témez concentration time (hours) from the longest flow path (m) and the relief."""
+        if max_distance > 0:
+            delta_h = max_h - min_h
+            if delta_h <= 0:
+                return 0
+            return 0.3 * (
+                (max_distance / 1000.0)
+                / math.pow((delta_h / max_distance), 0.25)
+            )**0.76
+        return 0
+
+    def _outletPixel(self, pt_utm):
+        """(x_pixel, y_pixel) of an outlet in the MDT; ValueError if it is outside or on NoData."""
         inv_geoTransform = gdal.InvGeoTransform(self.geoTransform)
         if inv_geoTransform is None:
             raise Exception("Could not invert geotransform for MDT.")
@@ -125,46 +145,394 @@ class BasinCalculatorRefactored:
         if not (0 <= y_pixel < rows and 0 <= x_pixel < cols):
             raise ValueError(f"Punto de salida ({pt_utm}) fuera de los límites del MDT raster.")
 
-        initial_h = self.mdt[y_pixel, x_pixel]
-        if initial_h == self.nodataMdt:
+        if self.mdt[y_pixel, x_pixel] == self.nodataMdt:
             raise ValueError(f"Punto de salida ({pt_utm}) en valor NoData del MDT.")
+        return x_pixel, y_pixel
+
+    def calculate(self, pt_utm, geometry=True):
+        """
+        Basin statistics of the outlet pt_utm (UTM coordinates). With the accumulated
+        rasters they are read at the outlet cell and the basin is only traversed when
+        `geometry` is True, to build the contour, the flow-length raster and the
+        longest flow path.
+        """
+        # Estado de la cuenca anterior: si el nuevo punto está justo aguas abajo sólo se
+        # añaden las aportaciones laterales en lugar de recorrer de nuevo toda la cuenca.
+        previous = self._basinState()
+        self._resetValues()
+        self.pt_utm = pt_utm
+
+        x_pixel, y_pixel = self._outletPixel(pt_utm)
+        initial_h = self.mdt[y_pixel, x_pixel]
 
         self.minH = initial_h
         self.maxH = initial_h
         self.xMaxDistance, self.yMaxDistance = pt_utm[0], pt_utm[1]
 
-        self._processCell(x_pixel, y_pixel, distance=0)
-
-        self.i1id = self._mean(self.i1idValues)
-        self.p0 = self._mean(self.p0Values)
-        self.rain = {k: self._mean(v) for k, v in self.rainValues.items()}
+        accumulated = None
+        if self.accumulatedAttributes is not None:
+            accumulated = self.accumulatedAttributes.read(y_pixel, x_pixel)
 
-        if self.maxDistance > 0:
-            delta_h = self.maxH - self.minH
-            if delta_h <= 0:
-                self.concentrationTime = 0
+        if accumulated is None or geometry:
+            if previous is not None and self._isNudgeDownstream(previous, x_pixel, y_pixel):
+                self._extendBasin(previous, x_pixel, y_pixel, with_sums=accumulated is None)
             else:
-                self.concentrationTime = 0.3 * (
-                    (self.maxDistance / 1000.0)
-                    / math.pow((delta_h / self.maxDistance), 0.25)
-                )**0.76
-        else:
-            self.concentrationTime = 0
-
-        self.computeBasinContour()
+                self._traverseBasin(x_pixel, y_pixel)
+                if accumulated is None:
+                    sums = self.zonalStatistics.sums(self.trace.rows, self.trace.cols)
+                    sums["MDT"] = self.basinSums["MDT"]
+                    self.basinSums = sums
+        if accumulated is not None:
+            self._setAccumulatedBasin(accumulated)
+        self._setStatisticsFromSums(self.basinSums)
+
+        self.concentrationTime = self._concentrationTime(self.maxDistance, self.minH, self.maxH)
+        self.concentrationTimes = calculate_concentration_times(
+            self.maxDistance, self.maxH - self.minH, self.area / 1_000_000,
+            self.meanH - float(initial_h) if self.meanH is not None else None,
+        )
+
+        if geometry:
+            self.computeFlowPathAnalysis()
+            self.computeBasinContour()
+
+    def _setAccumulatedBasin(self, accumulated):
+        """
+        Area, heights, longest flow path and layer sums from the accumulated rasters
+        (AccumulatedAttributes.read). If the basin was also traversed, the farthest
+        cell is located in the trace so that the flow path follows it.
+        """
+        self.area = accumulated["cells"] * self.cellarea
+        if not np.isnan(accumulated["min_h"]):
+            self.minH = min(self.minH, accumulated["min_h"])
+            self.maxH = max(self.maxH, accumulated["max_h"])
+        self.basinSums = accumulated["sums"]
+
+        self.farthestPos = None
+        farthest = accumulated["farthest"]
+        self.maxDistance = self._accumulatedMaxDistance(accumulated)
+        if self.maxDistance == 0:
+            return
+        row, col = divmod(farthest, self.mdt.shape[1])
+        self.xMaxDistance, self.yMaxDistance = gdal.ApplyGeoTransform(self.geoTransform, col + 0.5, row + 0.5)
+        if self.trace is not None:
+            self.farthestPos = int(np.flatnonzero(self.trace.cells == farthest)[0])
+
+    def _accumulatedMaxDistance(self, accumulated):
+        """Longest flow path (m) from the steps stored in the accumulated rasters."""
+        if accumulated["farthest"] < 0:
+            return 0.0
+        # Misma fórmula que UpstreamIndex.trace para las distancias.
+        return float(accumulated["orth_steps"] * self.cellsize
+                     + accumulated["diag_steps"] * (DIAGONAL_STEP * self.cellsize))
+
+    def calculate_many(self, points):
+        """
+        Basin statistics for several outlets (UTM coordinates) in one pass, e.g.
+        every culvert along a road.
+
+        Outlets are processed in flow order, upstream first. The catchment of an
+        outlet is traced only down to the outlets nested inside it. Their area,
+        heights, longest flow path and layer sums are reused instead of walked
+        again. No geometry is computed and the single-outlet state is left
+        untouched.
+
+        Returns one dict per point, in input order, with point, area (m2),
+        concentration_time (h), max_distance (m), min_h, max_h, mean_h, p0,
+        i1id and rain ({return period: mean}). Points outside the MDT or on
+        NoData get {"point", "error"} instead.
+        """
+        ncols = self.mdt.shape[1]
+        results = [None] * len(points)
+        outlet_of_point = {}
+        for i, pt_utm in enumerate(points):
+            try:
+                x_pixel, y_pixel = self._outletPixel(pt_utm)
+            except ValueError as e:
+                results[i] = {"point": pt_utm, "error": str(e)}
+                continue
+            outlet_of_point[i] = y_pixel * ncols + x_pixel
+
+        # Salida inmediatamente aguas abajo de cada salida y distancia de flujo hasta ella.
+        outlets = set(outlet_of_point.values())
+        children = defaultdict(list)
+        parent = {}
+        for cell in outlets:
+            row, col = divmod(cell, ncols)
+            target, distance = walk_downstream(self.dirs, row, col, self.cellsize, outlets - {cell})
+            if target is not None:
+                children[target].append((cell, distance))
+                parent[cell] = target
+
+        # Orden de flujo (Kahn): cada salida después de todas las que drenan hacia ella.
+        pending = {cell: len(children[cell]) for cell in outlets}
+        ready = sorted(cell for cell, n in pending.items() if n == 0)
+        stats = {}
+        while ready:
+            cell = ready.pop()
+            stats[cell] = self._nestedBasinStatistics(cell, children[cell], stats)
+            downstream = parent.get(cell)
+            if downstream is not None:
+                pending[downstream] -= 1
+                if pending[downstream] == 0:
+                    ready.append(downstream)
+        # Salidas encadenadas en un ciclo de FLOWDIRS: se calculan sin reutilizar nada.
+        for cell in sorted(outlets - stats.keys()):
+            stats[cell] = self._nestedBasinStatistics(cell, [], stats)
+
+        for i, cell in outlet_of_point.items():
+            basin = stats[cell]
+            result = {
+                "point": points[i],
+                "area": basin["cells"] * self.cellarea,
+                "concentration_time": self._concentrationTime(basin["max_distance"], basin["min_h"], basin["max_h"]),
+                "max_distance": basin["max_distance"],
+                "min_h": basin["min_h"],
+                "max_h": basin["max_h"],
+            }
+            result.update(self._meansFromSums(basin["sums"]))
+            results[i] = result
+        return results
+
+    def _nestedBasinStatistics(self, cell, children, stats):
+        """
+        Cell count, height range, longest flow path and layer sums of the basin
+        of `cell`. `children` lists (outlet, flow distance) of the nested
+        outlets whose statistics are already in `stats`. With the accumulated
+        rasters they are read at `cell` without traversing the basin.
+        """
+        row, col = divmod(cell, self.mdt.shape[1])
+        accumulated = None
+        if self.accumulatedAttributes is not None:
+            accumulated = self.accumulatedAttributes.read(row, col)
+        if accumulated is not None:
+            min_h = max_h = float(self.mdt[row, col])
+            if not np.isnan(accumulated["min_h"]):
+                min_h = min(min_h, accumulated["min_h"])
+                max_h = max(max_h, accumulated["max_h"])
+            return {"cells": accumulated["cells"], "min_h": min_h, "max_h": max_h,
+                    "max_distance": self._accumulatedMaxDistance(accumulated), "sums": accumulated["sums"]}
+
+        trace = trace_upstream(self.dirs, row, col, self.cellsize, stop_cells=[c for c, _ in children])
+
+        heights = self.mdt.reshape(-1)[trace.cells]
+        valid_h = heights != self.nodataMdt
+        min_h = max_h = float(self.mdt[row, col])
+        sums = self.zonalStatistics.sums(trace.rows, trace.cols)
+        sums["MDT"] = (float(heights[valid_h].sum(dtype=np.float64)), int(valid_h.sum()))
+        if valid_h.any():
+            min_h = min(min_h, float(heights[valid_h].min()))
+            max_h = max(max_h, float(heights[valid_h].max()))
+        farthest = farthest_position(trace, valid_h)
+        max_distance = float(trace.distances[farthest]) if farthest is not None else 0.0
+
+        n_cells = len(trace)
+        for child, distance in children:
+            child_stats = stats[child]
+            n_cells += child_stats["cells"]
+            min_h = min(min_h, child_stats["min_h"])
+            max_h = max(max_h, child_stats["max_h"])
+            max_distance = max(max_distance, distance + child_stats["max_distance"])
+            for key, (total, count) in child_stats["sums"].items():
+                own_total, own_count = sums.get(key, (0.0, 0))
+                sums[key] = (own_total + total, own_count + count)
+
+        return {"cells": n_cells, "min_h": min_h, "max_h": max_h, "max_distance": max_distance, "sums": sums}
+
+    def calculate_subbasins(self, min_order=SUBBASIN_MIN_ORDER, min_area_km2=None):
+        """
+        Splits the last calculated basin into sub-basins at the confluences of
+        its streams, reusing the trace of calculate() (no new traversal).
+
+        A cell is a stream cell if its Strahler order is >= min_order and its
+        drained area is >= min_area_km2 (each threshold only if given). Every
+        stream cell that joins another stream cell at a confluence starts a
+        new sub-basin, as does the basin outlet. Sub-basins are incremental:
+        each one excludes the sub-basins above it.
+
+        Sets subbasinLabels (int32 raster over basinWindow, 0 outside the
+        basin), subbasinGeometryUTM / subbasinGeometry ({id: polygon}) and
+        subbasins, a list of dicts with id, downstream_id, outlet_x, outlet_y,
+        strahler_order, area (m2), concentration_time (h), max_distance (m),
+        min_h, max_h, mean_h, p0, i1id and rain ({return period: mean}).
+        """
+        if self.trace is None:
+            raise ValueError("Calcula primero la cuenca con calculate().")
+        if min_order is None and min_area_km2 is None:
+            raise ValueError("Indica un orden de Strahler o un área mínima para las subcuencas.")
+
+        trace = self.trace
+        parent = trace.parent_pos
+        levels = topological_levels(parent)
+        order = strahler_order(parent, levels)
+
+        stream = np.ones(len(trace), dtype=bool)
+        if min_order is not None:
+            stream &= order >= min_order
+        if min_area_km2 is not None:
+            drained = accumulate(np.ones(len(trace), dtype=np.int64), parent, levels)
+            stream &= drained * self.cellarea >= min_area_km2 * 1_000_000
+
+        # Salidas de subcuenca: tramos de cauce que confluyen con otro tramo de cauce.
+        has_parent = parent >= 0
+        stream_children = np.bincount(parent[stream & has_parent], minlength=len(trace))
+        is_outlet = ~has_parent
+        is_outlet[has_parent] = stream[has_parent] & (stream_children[parent[has_parent]] >= 2)
+        outlet_pos = np.nonzero(is_outlet)[0]
+        n_subbasins = outlet_pos.size
+        own_label = np.zeros(len(trace), dtype=np.int32)
+        own_label[outlet_pos] = np.arange(1, n_subbasins + 1, dtype=np.int32)
+
+        # Etiquetado de aguas abajo hacia aguas arriba: cada celda hereda la etiqueta de
+        # su celda aguas abajo salvo que sea la salida de una subcuenca.
+        labels = np.zeros(len(trace), dtype=np.int32)
+        for level in reversed(levels):
+            inherited = labels[np.maximum(parent[level], 0)]
+            labels[level] = np.where(is_outlet[level], own_label[level], inherited)
+
+        rows, cols = trace.rows, trace.cols
+        row0, col0 = self.basinWindow
+        self.subbasinLabels = np.zeros(self.basinCells.shape, dtype=np.int32)
+        self.subbasinLabels[rows - row0, cols - col0] = labels
+
+        # Estadísticas por subcuenca con np.bincount sobre las etiquetas.
+        n_bins = n_subbasins + 1
+        cells = np.bincount(labels, minlength=n_bins)
+        heights = self.mdt.reshape(-1)[trace.cells].astype(np.float64)
+        valid_h = heights != self.nodataMdt
+        h_sum = np.bincount(labels[valid_h], weights=heights[valid_h], minlength=n_bins)
+        h_count = np.bincount(labels[valid_h], minlength=n_bins)
+        min_h = np.full(n_bins, np.inf)
+        max_h = np.full(n_bins, -np.inf)
+        np.minimum.at(min_h, labels[valid_h], heights[valid_h])
+        np.maximum.at(max_h, labels[valid_h], heights[valid_h])
+        # Longitud de flujo hasta la salida de la propia subcuenca.
+        local_distance = trace.distances - trace.distances[outlet_pos[labels - 1]]
+        max_distance = np.zeros(n_bins)
+        np.maximum.at(max_distance, labels[valid_h], local_distance[valid_h])
+        layer_sums = self.zonalStatistics.grouped_sums(rows, cols, labels, n_bins)
+
+        downstream_label = np.zeros(n_bins, dtype=np.int32)
+        downstream_label[1:] = labels[np.maximum(parent[outlet_pos], 0)]
+        downstream_label[1] = 0
+
+        self.subbasins = []
+        for label in range(1, n_bins):
+            pos = outlet_pos[label - 1]
+            outlet_row, outlet_col = divmod(int(trace.cells[pos]), self.mdt.shape[1])
+            outlet_x, outlet_y = gdal.ApplyGeoTransform(self.geoTransform, outlet_col + 0.5, outlet_row + 0.5)
+            sums = {key: (float(total[label]), int(count[label])) for key, (total, count) in layer_sums.items()}
+            sums["MDT"] = (float(h_sum[label]), int(h_count[label]))
+            has_h = h_count[label] > 0
+            subbasin = {
+                "id": label,
+                "downstream_id": int(downstream_label[label]) or None,
+                "outlet_x": outlet_x,
+                "outlet_y": outlet_y,
+                "strahler_order": int(order[pos]),
+                "area": int(cells[label]) * self.cellarea,
+                "concentration_time": self._concentrationTime(
+                    float(max_distance[label]), float(min_h[label]), float(max_h[label])
+                ) if has_h else 0,
+                "max_distance": float(max_distance[label]),
+                "min_h": float(min_h[label]) if has_h else None,
+                "max_h": float(max_h[label]) if has_h else None,
+            }
+            subbasin.update(self._meansFromSums(sums))
+            self.subbasins.append(subbasin)
+
+        polygons, transformer = self._polygonizeWindow(self.subbasinLabels)
+        parts = defaultdict(list)
+        for dn, geom in polygons:
+            if dn > 0:
+                parts[dn].append(geom)
+        self.subbasinGeometryUTM = {dn: shapely.union_all(geoms) for dn, geoms in parts.items()}
+        self.subbasinGeometry = {dn: reproject_geometry(geom, transformer) for dn, geom in self.subbasinGeometryUTM.items()}
+        return self.subbasins
 
     def computeBasinContour(self):
         """
         Generates the basin polygon from the basinCells array, filtering to keep
-        only the desired polygon, and transforms it to WGS84.
+        only the desired polygon, and transforms it to WGS84. Only the basin's
+        bounding window is polygonized, georeferenced with an offset geotransform.
+        Besides the full-resolution geometries it stores basinGeometryDisplay, a
+        topology-preserving simplification meant for the map.
         """
-        rows, cols = self.mdt.shape
+        polygons, transformer = self._polygonizeWindow(self.basinCells)
+
+        self.basinGeometry = []
+        self.basinGeometryUTM = []
+        self.basinGeometryDisplay = []
+        
+        # 3. Iterar y guardar solo el polígono con el valor correcto (DN=1)
+        for dn, shapely_geom_utm in polygons:
+            if dn == 1: # <-- Este es el filtro clave
+                self.basinGeometryUTM.append(shapely_geom_utm)
+                self.basinGeometry.append(reproject_geometry(shapely_geom_utm, transformer))
+
+                # Se simplifica en UTM (tolerancia en metros) y después se reproyecta.
+                simplified_utm = shapely_geom_utm.simplify(DISPLAY_SIMPLIFY_CELLS * self.cellsize, preserve_topology=True)
+                self.basinGeometryDisplay.append(reproject_geometry(simplified_utm, transformer))
+        # --- FIN DE LA MEJORA 1 ---
+
+    def computeFlowPathAnalysis(self):
+        """
+        Builds the flow-length raster over basinWindow and the longest flow path
+        polyline (UTM and WGS84) with its elevation profile from the in-memory MDT.
+        """
+        trace = self.trace
+        row0, col0 = self.basinWindow
+        self.flowLength = np.full(self.basinCells.shape, np.nan, dtype=np.float32)
+        self.flowLength[trace.rows - row0, trace.cols - col0] = trace.distances
+
+        # Recorrido desde la celda más alejada hasta la salida siguiendo parent_pos.
+        path = []
+        pos = self.farthestPos if self.farthestPos is not None else 0
+        while pos >= 0:
+            path.append(pos)
+            pos = int(trace.parent_pos[pos])
+        path = np.asarray(path, dtype=np.int64)
+        rows, cols = np.divmod(trace.cells[path], self.mdt.shape[1])
+        gt = self.geoTransform
+        x = gt[0] + (cols + 0.5) * gt[1] + (rows + 0.5) * gt[2]
+        y = gt[3] + (cols + 0.5) * gt[4] + (rows + 0.5) * gt[5]
+        heights = self.mdt[rows, cols].astype(np.float64)
+        heights[heights == self.nodataMdt] = np.nan
+
+        self.longestFlowPathProfile = {
+            "distance_m": self.maxDistance - trace.distances[path],
+            "elevation_m": heights,
+        }
+        if path.size > 1:
+            self.longestFlowPathUTM = LineString(np.column_stack((x, y)))
+            self.longestFlowPath = reproject_geometry(self.longestFlowPathUTM, self._wgs84Transformer())
+
+
+    def _wgs84Transformer(self):
+        # El Transformer se cachea para todo el proceso por par de CRS (core_logic.crs_transform).
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(self.crs_wkt)
+        return get_transformer(srs.ExportToProj4(), WGS84)
+
+    def _polygonizeWindow(self, array):
+        """
+        Polygonizes a raster aligned with basinWindow. Returns the list of
+        (pixel value, UTM shapely geometry) pairs and a transformer to WGS84.
+        """
+        rows, cols = array.shape
+        row0, col0 = self.basinWindow
+        gt = self.geoTransform
+        window_gt = (
+            gt[0] + col0 * gt[1] + row0 * gt[2], gt[1], gt[2],
+            gt[3] + col0 * gt[4] + row0 * gt[5], gt[4], gt[5],
+        )
+        gdal_type = gdal.GDT_Byte if array.dtype.itemsize == 1 else gdal.GDT_Int32
         src_drv = gdal.GetDriverByName("MEM")
-        src_ds = src_drv.Create("", cols, rows, 1, gdal.GDT_Byte)
-        src_ds.SetGeoTransform(self.geoTransform)
+        src_ds = src_drv.Create("", cols, rows, 1, gdal_type)
+        src_ds.SetGeoTransform(window_gt)
         src_ds.SetProjection(self.crs_wkt)
         band = src_ds.GetRasterBand(1)
-        band.WriteArray(self.basinCells)
+        band.WriteArray(array)
         band.SetNoDataValue(0)
 
         dst_drv = ogr.GetDriverByName("Memory")
@@ -183,27 +551,17 @@ class BasinCalculatorRefactored:
         # 2. Ejecutar Polygonize, guardando el valor del píxel en el campo 'DN' (índice 0)
         gdal.Polygonize(band, None, dst_layer, 0, [], callback=None)
 
-        source_crs = srs.ExportToProj4()
-        target_crs = "EPSG:4326"
-        transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
+        transformer = self._wgs84Transformer()
 
-        self.basinGeometry = []
-        self.basinGeometryUTM = []
-        
-        # 3. Iterar y guardar solo el polígono con el valor correcto (DN=1)
+        polygons = []
         for feature in dst_layer:
-            if feature.GetField("DN") == 1: # <-- Este es el filtro clave
-                ogr_geom = feature.GetGeometryRef()
-                if ogr_geom:
-                    shapely_geom_utm = shape(json.loads(ogr_geom.ExportToJson()))
-                    self.basinGeometryUTM.append(shapely_geom_utm)
-                    
-                    shapely_geom_wgs84 = shapely_transform(transformer.transform, shapely_geom_utm)
-                    self.basinGeometry.append(shapely_geom_wgs84)
-        # --- FIN DE LA MEJORA 1 ---
+            ogr_geom = feature.GetGeometryRef()
+            if ogr_geom:
+                polygons.append((feature.GetField("DN"), wkb.loads(bytes(ogr_geom.ExportToWkb()))))
 
         src_ds = None
         dst_ds = None
+        return polygons, transformer
 
     # --- MEJORA 2: FUNCIÓN DE EXPORTACIÓN MEJORADA ---
     def export_basin_to_shapefile(self, output_path):
@@ -234,78 +592,137 @@ class BasinCalculatorRefactored:
             print(f"Error exporting shapefile to {output_path}: {e}")
             return False
 
-    def _getValueAtCoordinate(self, x_utm, y_utm, layer_name_key):
-        layer_data = self.secondaryLayers.get(layer_name_key)
-        layer_gt = self.secondaryTransforms.get(layer_name_key)
-        layer_nodata = self.secondaryNodata.get(layer_name_key)
-
-        if layer_data is None or layer_gt is None:
-            return None
-
-        inv_layer_gt = gdal.InvGeoTransform(layer_gt)
-        if inv_layer_gt is None:
-            return None
-
-        px, py = gdal.ApplyGeoTransform(inv_layer_gt, x_utm, y_utm)
-        px, py = int(px), int(py)
-
-        rows, cols = layer_data.shape
-        if not (0 <= py < rows and 0 <= px < cols):
-            return None
-
-        val = layer_data[py, px]
-        if val == layer_nodata:
-            return None
+    def _traverseBasin(self, x, y):
+        """
+        Collects the upstream cells of (x, y) and fills the basin mask, area,
+        heights and farthest point. Uses the precomputed upstream index when
+        available and the iterative traversal otherwise.
+        """
+        if self.upstreamIndex is not None and self.upstreamIndex.covers(y, x):
+            trace = self.upstreamIndex.trace(self.dirs, y, x, self.cellsize)
+            row0, col0, mask = self.upstreamIndex.catchment_window(y, x, trace.cells)
+            self.basinCells = mask.astype(np.int8)
+            self.basinWindow = (row0, col0)
         else:
-            return val
+            trace = trace_upstream(self.dirs, y, x, self.cellsize)
+            self._addToBasinMask(trace.rows, trace.cols)
+        self.trace = trace
+        self.outletCell = int(trace.cells[0])
+
+        self.area = len(trace) * self.cellarea
+
+        heights = self.mdt.reshape(-1)[trace.cells]
+        valid_h = heights != self.nodataMdt
+        if valid_h.any():
+            self.minH = min(self.minH, heights[valid_h].min())
+            self.maxH = max(self.maxH, heights[valid_h].max())
+        self.basinSums = {"MDT": (float(heights[valid_h].sum(dtype=np.float64)), int(valid_h.sum()))}
+
+        self._setFarthest(farthest_position(trace, valid_h))
+
+    def _addToBasinMask(self, rows, cols):
+        """Sets the given cells in basinCells, growing its window to cover them."""
+        row0, col0 = int(rows.min()), int(cols.min())
+        row1, col1 = int(rows.max()) + 1, int(cols.max()) + 1
+        old_mask = self.basinCells
+        if old_mask is not None:
+            old_row0, old_col0 = self.basinWindow
+            row0, col0 = min(row0, old_row0), min(col0, old_col0)
+            row1 = max(row1, old_row0 + old_mask.shape[0])
+            col1 = max(col1, old_col0 + old_mask.shape[1])
+        self.basinCells = np.zeros((row1 - row0, col1 - col0), dtype=np.int8)
+        if old_mask is not None:
+            self.basinCells[old_row0 - row0:old_row0 - row0 + old_mask.shape[0],
+                            old_col0 - col0:old_col0 - col0 + old_mask.shape[1]] = old_mask
+        self.basinCells[rows - row0, cols - col0] = 1
+        self.basinWindow = (row0, col0)
+
+    def _setFarthest(self, farthest):
+        """Stores the farthest trace position, its flow distance and its coordinates."""
+        self.farthestPos = farthest
+        if farthest is not None:
+            self.maxDistance = float(self.trace.distances[farthest])
+            row, col = divmod(int(self.trace.cells[farthest]), self.mdt.shape[1])
+            self.xMaxDistance, self.yMaxDistance = gdal.ApplyGeoTransform(self.geoTransform, col + 0.5, row + 0.5)
+
+    def _basinState(self):
+        """State of the last calculated basin needed to extend it, or None."""
+        if self.trace is None or self.basinSums is None:
+            return None
+        return {
+            "outlet": self.outletCell, "trace": self.trace, "mask": self.basinCells,
+            "window": self.basinWindow, "sums": self.basinSums, "farthest": self.farthestPos,
+            "min_h": self.minH, "max_h": self.maxH,
+        }
 
-    directions_to_check = [
-        (-1, 0, 1), (-1, -1, 2), (0, -1, 4), (1, -1, 8),
-        (1, 0, 16), (1, 1, 32), (0, 1, 64), (-1, 1, 128),
-    ]
+    def _isNudgeDownstream(self, previous, x, y):
+        """True if (x, y) lies at most NUDGE_MAX_STEPS cells down the D8 path of the previous outlet."""
+        ncols = self.mdt.shape[1]
+        row, col = divmod(previous["outlet"], ncols)
+        cell = y * ncols + x
+        target, _ = walk_downstream(self.dirs, row, col, self.cellsize, {cell}, max_steps=NUDGE_MAX_STEPS)
+        # En un ciclo de FLOWDIRS el nuevo punto también estaría aguas arriba del anterior.
+        return target is not None and not (previous["trace"].cells == cell).any()
 
-    def _processCell(self, x, y, distance=0):
-        rows, cols = self.mdt.shape
-        if not (0 <= y < rows and 0 <= x < cols):
-            return
-        if (x, y) in self.visited_cells:
-            return
-        self.visited_cells.add((x, y))
-
-        self.basinCells[y, x] = 1
-
-        coordx_utm, coordy_utm = gdal.ApplyGeoTransform(self.geoTransform, x + 0.5, y + 0.5)
-
-        p0 = self._getValueAtCoordinate(coordx_utm, coordy_utm, "P0")
-        if p0 is not None and p0 > 0:
-            self.p0Values.append(p0)
-        i1id = self._getValueAtCoordinate(coordx_utm, coordy_utm, "I1ID")
-        if i1id is not None and i1id > 0:
-            self.i1idValues.append(i1id)
-        for returnPeriod_key in self.rainFiles.keys():
-            rain = self._getValueAtCoordinate(coordx_utm, coordy_utm, returnPeriod_key)
-            if rain is not None and rain > 0:
-                self.rainValues[returnPeriod_key].append(rain)
-
-        h = self.mdt[y, x]
-        if h != self.nodataMdt:
-            self.minH = min(self.minH, h)
-            self.maxH = max(self.maxH, h)
-
-            if distance > self.maxDistance:
-                self.maxDistance = distance
-                self.xMaxDistance, self.yMaxDistance = coordx_utm, coordy_utm
-            elif distance == self.maxDistance and h > self.maxH:
-                self.maxH = h
-                self.xMaxDistance, self.yMaxDistance = coordx_utm, coordy_utm
-
-        self.area += self.cellarea
-
-        for dx, dy, direction_value_of_neighbor in self.directions_to_check:
-            x2 = x + dx
-            y2 = y + dy
-            
-            if 0 <= y2 < rows and 0 <= x2 < cols:
-                if self.dirs[y2, x2] == direction_value_of_neighbor:
-                    distToNextCell = 1 if (dx == 0 or dy == 0) else 1.414
-                    self._processCell(x2, y2, distance + distToNextCell * self.cellsize)
+    def _extendBasin(self, previous, x, y, with_sums=True):
+        """
+        Basin of (x, y) built from the previous basin, which drains into it. Only
+        the lateral area between both outlets is traced; the previous cells are
+        appended with their distances shifted by the flow length between outlets.
+        The layer sums are only gathered if `with_sums` is True.
+        """
+        ncols = self.mdt.shape[1]
+        old = previous["trace"]
+        old_outlet = previous["outlet"]
+        lateral = trace_upstream(self.dirs, y, x, self.cellsize, stop_cells=[old_outlet])
+        n_lateral = len(lateral)
+
+        # Enlace de la salida anterior con su celda aguas abajo, que está en `lateral`.
+        row, col = divmod(old_outlet, ncols)
+        code = int(self.dirs[row, col])
+        drow, dcol = D8_DOWNSTREAM[code]
+        down_pos = int(np.nonzero(lateral.cells == (row + drow) * ncols + col + dcol)[0][0])
+        step = 1 if (drow == 0 or dcol == 0) else DIAGONAL_STEP
+        shift = lateral.distances[down_pos] + step * self.cellsize
+
+        parent_pos = old.parent_pos + n_lateral
+        parent_pos[0] = down_pos
+        branch = old.branch.copy()
+        branch[0] = D8_BRANCH[code]
+        self.trace = UpstreamTrace(
+            lateral.shape,
+            np.concatenate((lateral.cells, old.cells)),
+            np.concatenate((lateral.parent_pos, parent_pos)),
+            np.concatenate((lateral.branch, branch)),
+            np.concatenate((lateral.distances, old.distances + shift)),
+            None,
+        )
+        self.outletCell = int(lateral.cells[0])
+        self.area = len(self.trace) * self.cellarea
+
+        self.basinCells, self.basinWindow = previous["mask"], previous["window"]
+        self._addToBasinMask(lateral.rows, lateral.cols)
+
+        heights = self.mdt.reshape(-1)[lateral.cells]
+        valid_h = heights != self.nodataMdt
+        self.minH = min(self.minH, previous["min_h"])
+        self.maxH = max(self.maxH, previous["max_h"])
+        if valid_h.any():
+            self.minH = min(self.minH, heights[valid_h].min())
+            self.maxH = max(self.maxH, heights[valid_h].max())
+
+        if with_sums:
+            sums = self.zonalStatistics.sums(lateral.rows, lateral.cols)
+            sums["MDT"] = (float(heights[valid_h].sum(dtype=np.float64)), int(valid_h.sum()))
+            for key, (total, count) in previous["sums"].items():
+                own_total, own_count = sums.get(key, (0.0, 0))
+                sums[key] = (own_total + total, own_count + count)
+            self.basinSums = sums
+
+        # Candidatos al punto más alejado: celdas laterales válidas y el más alejado de la
+        # cuenca anterior (o su salida, si era una sola celda).
+        candidates = np.zeros(len(self.trace), dtype=bool)
+        candidates[:n_lateral] = valid_h
+        old_farthest = previous["farthest"]
+        candidates[n_lateral + (old_farthest if old_farthest is not None else 0)] = True
+        self._setFarthest(farthest_position(self.trace, candidates))
@@ -0,0 +1,152 @@
+# core_logic/basin_data.py
+
+import os
+
+import streamlit as st
+
+from .asset_prefetch import wait_for_assets
+from .upstream_index import UpstreamIndex, UPSTREAM_INDEX_DIR
+from .accumulated_attributes import AccumulatedAttributes, ACCUMULATED_DIR
+from .raster_store import RasterStore, RASTER_STORE_DIR
+from .zonal_stats import ZonalStatistics
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    GDAL_AVAILABLE = False
+    gdal = None
+
+# Capas que necesita la Pestaña 1 (claves de LAYER_MAPPING).
+RAIN_FILES = {
+    2: "RAIN_2", 5: "RAIN_5", 10: "RAIN_10",
+    25: "RAIN_25", 100: "RAIN_100", 500: "RAIN_500",
+}
+BASIN_LAYERS = ("MDT", "FLOWDIRS", "I1ID", "P0") + tuple(RAIN_FILES.values())
+
+
+class BasinDataContext:
+    """
+    Read-only raster data used by BasinCalculatorRefactored: MDT, FLOWDIRS, the
+    secondary layers (I1ID, P0, rain) and the optional precomputed products.
+
+    It is loaded once per process (see get_basin_data_context) and shared by every
+    session; all arrays are flagged as non-writeable so no calculation can modify
+    them in place.
+    """
+
+    def __init__(self, layer_mapping):
+        if not GDAL_AVAILABLE:
+            raise ImportError("GDAL no está disponible. No se pueden cargar las capas de la Pestaña 1.")
+
+        gdal.UseExceptions()
+        gdal.AllRegister()
+
+        self.secondaryLayers = {}
+        self.secondaryNodata = {}
+        self.secondaryTransforms = {}
+        self.rainFiles = dict(RAIN_FILES)
+
+        # Si las capas se han ingerido con python -m core_logic.raster_store se abren
+        # con np.memmap (páginas compartidas entre procesos); si no, se leen con GDAL.
+        store = RasterStore.open(RASTER_STORE_DIR, BASIN_LAYERS)
+        if store is not None:
+            self._load_from_store(store)
+        else:
+            self._load_from_gdal(layer_mapping)
+
+        self.cellsize = self.geoTransform[1]
+        self.cellarea = self.cellsize * self.cellsize
+
+        # Correspondencia celda del MDT -> píxel de cada capa secundaria, calculada una
+        # vez; las estadísticas se devuelven con las claves de LAYER_MAPPING.
+        layer_keys = {"I1ID": "I1ID", "P0": "P0", **self.rainFiles}
+        self.zonalStatistics = ZonalStatistics(
+            {layer_keys[name]: array for name, array in self.secondaryLayers.items()},
+            {layer_keys[name]: gt for name, gt in self.secondaryTransforms.items()},
+            {layer_keys[name]: nodata for name, nodata in self.secondaryNodata.items()},
+            self.geoTransform, self.mdt.shape,
+        )
+
+        # Índice de intervalos precalculado (python -m core_logic.upstream_index). Si no
+        # existe, calculate() recorre el árbol de flujo en cada cálculo.
+        self.upstreamIndex = UpstreamIndex.open(UPSTREAM_INDEX_DIR, expected_shape=self.dirs.shape)
+        # Sumas y recuentos acumulados (python -m core_logic.accumulated_attributes): con
+        # ellos P0, I1ID y la lluvia media salen de un píxel en vez de recorrer la cuenca.
+        self.accumulatedAttributes = AccumulatedAttributes.open(ACCUMULATED_DIR, expected_shape=self.mdt.shape)
+
+    def _load_from_store(self, store):
+        self.local_layer_paths = {key: os.path.join(store.folder, f"{key}.npy") for key in BASIN_LAYERS}
+
+        self.mdt, mdt_meta = store.load("MDT")
+        self.nodataMdt = mdt_meta["nodata"]
+        self.geoTransform = mdt_meta["geotransform"]
+        self.crs_wkt = mdt_meta["projection"]
+
+        self.dirs, dirs_meta = store.load("FLOWDIRS")
+        self.nodataDirs = dirs_meta["nodata"]
+
+        for name, key in [("I1ID", "I1ID"), ("P0", "P0")] + list(self.rainFiles.items()):
+            array, meta = store.load(key)
+            self.secondaryLayers[name] = array
+            self.secondaryTransforms[name] = meta["geotransform"]
+            self.secondaryNodata[name] = meta["nodata"]
+
+    def _load_from_gdal(self, layer_mapping):
+        # MDT y FLOWDIRS se descargan desde el arranque (asset_prefetch) y aquí sólo se
+        # espera a que terminen; las capas secundarias se descargan al pedirlas.
+        self.local_layer_paths = wait_for_assets(BASIN_LAYERS, layer_mapping)
+
+        mdt_path = self.local_layer_paths["MDT"]
+        flowdirs_path = self.local_layer_paths["FLOWDIRS"]
+
+        mdt_dataset = gdal.Open(mdt_path, gdal.GA_ReadOnly)
+        if mdt_dataset is None:
+            raise FileNotFoundError(f"No se pudo abrir el dataset MDT en {mdt_path}")
+
+        mdt_band = mdt_dataset.GetRasterBand(1)
+        self.nodataMdt = mdt_band.GetNoDataValue()
+        self.mdt = self._read_only(mdt_band.ReadAsArray())
+        self.geoTransform = mdt_dataset.GetGeoTransform()
+        self.crs_wkt = mdt_dataset.GetProjection()
+
+        flowdirs_dataset = gdal.Open(flowdirs_path, gdal.GA_ReadOnly)
+        if flowdirs_dataset is None:
+            raise FileNotFoundError(f"No se pudo abrir el dataset FLOWDIRS en {flowdirs_path}")
+        flowdirs_band = flowdirs_dataset.GetRasterBand(1)
+        self.nodataDirs = flowdirs_band.GetNoDataValue()
+        self.dirs = self._read_only(flowdirs_band.ReadAsArray())
+
+        self._open_secondary_layer(self.local_layer_paths["I1ID"], "I1ID")
+        self._open_secondary_layer(self.local_layer_paths["P0"], "P0")
+        for returnPeriod, rainFileKey in self.rainFiles.items():
+            self._open_secondary_layer(self.local_layer_paths[rainFileKey], returnPeriod)
+
+    @staticmethod
+    def _read_only(array):
+        array.flags.writeable = False
+        return array
+
+    def _open_secondary_layer(self, path, name):
+        ds = gdal.Open(path, gdal.GA_ReadOnly)
+        if ds is None:
+            print(f"Warning: Could not open secondary layer dataset at {path}")
+            return
+        band = ds.GetRasterBand(1)
+        self.secondaryLayers[name] = self._read_only(band.ReadAsArray())
+        self.secondaryTransforms[name] = ds.GetGeoTransform()
+        self.secondaryNodata[name] = band.GetNoDataValue()
+        ds = None
+
+
+@st.cache_resource(show_spinner="Cargando capas de la Pestaña 1...")
+def _load_basin_data_context(layer_items):
+    return BasinDataContext(dict(layer_items))
+
+
+def get_basin_data_context(layer_mapping):
+    """
+    Process-wide BasinDataContext for `layer_mapping`. The first call loads the
+    rasters; every later call (from any session or thread) gets the same object.
+    """
+    layer_items = tuple(sorted((key, layer_mapping[key]) for key in BASIN_LAYERS))
+    return _load_basin_data_context(layer_items)
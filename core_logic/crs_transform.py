@@ -0,0 +1,99 @@
+# core_logic/crs_transform.py
+#
+# Transformaciones de coordenadas entre CRS.
+#
+# Crear un pyproj.Transformer cuesta del orden de milisegundos (consulta a la base de datos
+# de PROJ), así que se guardan en una caché de proceso indexada por el par de CRS. Desde
+# pyproj 3.1 un Transformer puede usarse desde varios hilos a la vez (cada hilo tiene su
+# propio contexto de PROJ). No se usa threading.local porque Streamlit ejecuta cada rerun
+# en un hilo nuevo y la caché se vaciaría en cada clic. Las funciones trabajan con arrays: una
+# sola llamada a PROJ para todos los puntos de una lista o todos los vértices de una o
+# varias geometrías, en lugar de un punto o un callback por vértice.
+
+import threading
+
+import numpy as np
+import shapely
+from pyproj import CRS, Proj, Transformer
+
+WGS84 = "EPSG:4326"
+UTM30N = "EPSG:25830"
+WEB_MERCATOR = "EPSG:3857"
+
+_transformers = {}
+_transformers_lock = threading.Lock()
+
+
+def _crs_key(crs):
+    # Clave hashable y barata, sin exportar el WKT en cada llamada: las cadenas y códigos
+    # EPSG tal cual; los CRS de pyproj (y Proj de pysheds) por la definición con la que se
+    # crearon (srs); los CRS de rasterio por to_string(), que da "EPSG:xxxx" cuando tienen
+    # código (rasterio lo guarda tras la primera consulta) y sólo si no el WKT.
+    if isinstance(crs, str):
+        return crs
+    if isinstance(crs, int):
+        return f"EPSG:{crs}"
+    if isinstance(crs, Proj):
+        crs = crs.crs
+    if isinstance(crs, CRS):
+        return crs.srs
+    return crs.to_string()
+
+
+def get_transformer(src_crs, dst_crs):
+    """
+    Process-wide cached always_xy Transformer from `src_crs` to `dst_crs`, or None when
+    both CRS are equivalent (no transformation needed).
+    """
+    key = (_crs_key(src_crs), _crs_key(dst_crs))
+    try:
+        return _transformers[key]
+    except KeyError:
+        pass
+    with _transformers_lock:
+        if key not in _transformers:
+            src, dst = CRS.from_user_input(key[0]), CRS.from_user_input(key[1])
+            _transformers[key] = None if src == dst else Transformer.from_crs(src, dst, always_xy=True)
+        return _transformers[key]
+
+
+def transform_points(xs, ys, src_crs, dst_crs):
+    """Arrays (xs, ys) transformed from `src_crs` to `dst_crs` with one PROJ call."""
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    transformer = get_transformer(src_crs, dst_crs)
+    if transformer is None:
+        return xs, ys
+    return transformer.transform(xs, ys)
+
+
+def transform_point(x, y, src_crs, dst_crs):
+    """Single point (x, y) as floats in `dst_crs`."""
+    transformer = get_transformer(src_crs, dst_crs)
+    if transformer is None:
+        return float(x), float(y)
+    x, y = transformer.transform(x, y)
+    return float(x), float(y)
+
+
+def transform_coords(coords, src_crs, dst_crs):
+    """(N, 2) coordinate array transformed to `dst_crs`."""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    xs, ys = transform_points(coords[:, 0], coords[:, 1], src_crs, dst_crs)
+    return np.column_stack((xs, ys))
+
+
+def reproject_geometry(geom, transformer):
+    """Reprojects all the coordinates of a shapely geometry (or array of them) with a single pyproj call."""
+    if transformer is None:
+        return geom
+
+    def transform_xy(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+    return shapely.transform(geom, transform_xy)
+
+
+def transform_geometry(geom, src_crs, dst_crs):
+    """Shapely geometry, or array of geometries (lines, polygons...), transformed to `dst_crs`."""
+    return reproject_geometry(geom, get_transformer(src_crs, dst_crs))
@@ -1,16 +1,23 @@
 import requests
 import io
-import tempfile
 import os
 # --- ¡¡¡ESTE IMPORT FALTABA Y ES LA CAUSA DEL ERROR!!! ---
 import streamlit as st 
 # --- ¡¡¡AHORA SÍ ESTÁ!!! ---
-from streamlit import cache_resource
-import rasterio
+import threading
+from collections import OrderedDict
+from rasterio.transform import rowcol
+from rasterio.windows import Window
 import fiona
-from shapely.geometry import shape, Point
+import shapely
+from shapely.geometry import shape
 import json
-from pyproj import CRS, Transformer
+import numpy as np
+from pyproj import CRS
+
+from .asset_cache import get_asset_cache
+from .raster_pool import open_raster
+from .crs_transform import UTM30N, WGS84, transform_geometry, transform_point, transform_points
 
 LAYER_MAPPING = {
     "BASINS": "https://pub-e3d06a464df847c6962ef2ff7362c24e.r2.dev/caumax-hidrologia-data/demarcaciones_hidrograficas.gpkg",
@@ -34,7 +41,12 @@ LAYER_MAPPING = {
     "FLOW_500": "https://pub-e3d06a464df847c6962ef2ff7362c24e.r2.dev/caumax-hidrologia-data/q500_COG.tif",
 }
 
-_temp_dir = tempfile.TemporaryDirectory()
+# Productos derivados que se generan offline a partir de las capas de LAYER_MAPPING
+# (índices de flujo, rásters acumulados...). Configurable para apuntar a un disco persistente.
+DERIVED_DATA_DIR = os.environ.get(
+    "CAUMAX_DERIVED_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "derived"),
+)
 
 # @st.cache_resource(ttl=3600)
 # def get_local_path_from_url(url):
@@ -63,41 +75,18 @@ _temp_dir = tempfile.TemporaryDirectory()
 #         print(f"Error crítico durante la descarga del archivo {url}: {e}")
 #         return None
 
-@st.cache_resource(ttl=3600)
 def get_local_path_from_url(url):
     """
-    Toma una URL, descarga el archivo a un directorio temporal persistente
-    y devuelve la RUTA LOCAL a ese archivo.
+    Toma una URL y devuelve la RUTA LOCAL del archivo en la caché persistente de
+    capas (core_logic.asset_cache), descargándolo sólo si falta o ha cambiado.
     """
-    print(f"DEBUG: get_local_path_from_url - Intentando obtener ruta local para URL: {url}") # <-- Nuevo print
     try:
-        filename = os.path.basename(url)
-        local_path = os.path.join(_temp_dir.name, filename)
-
-        if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
-            print(f"DEBUG: get_local_path_from_url - Archivo ya existe localmente: {local_path}") # <-- Nuevo print
-            return local_path
-
-        print(f"DEBUG: get_local_path_from_url - Descargando archivo a: {local_path}") # <-- Nuevo print
-        with requests.get(url, stream=True, timeout=30) as r: # <-- Añadir timeout
-            r.raise_for_status() # Esto lanzará un error si la descarga no es 200 OK
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        
-        if os.path.getsize(local_path) == 0:
-            print(f"ERROR: get_local_path_from_url - Archivo descargado está vacío: {local_path}") # <-- Nuevo print
-            return None
-
-        print(f"DEBUG: get_local_path_from_url - Descarga exitosa. Ruta local: {local_path}") # <-- Nuevo print
-        return local_path
+        return get_asset_cache().fetch(url)
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: get_local_path_from_url - Error de red/descarga para {url}: {e}") # <-- Nuevo print
+        print(f"ERROR: get_local_path_from_url - Error de red/descarga para {url}: {e}")
         return None
     except Exception as e:
-        print(f"ERROR: get_local_path_from_url - Error crítico inesperado durante la descarga de {url}: {e}") # <-- Nuevo print
-        import traceback
-        print(traceback.format_exc()) # <-- Imprimir traceback completo
+        print(f"ERROR: get_local_path_from_url - Error crítico inesperado durante la descarga de {url}: {e}")
         return None
 
 def get_layer_path(layer_key):
@@ -108,100 +97,276 @@ def load_geojson_from_gpkg(local_gpkg_path):
     try:
         with fiona.open(local_gpkg_path, 'r') as source:
             source_crs = CRS(source.crs)
-            target_crs = CRS("EPSG:4326")
-            transformer = None
-            if source_crs != target_crs:
-                transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
-            for feature in source:
-                geom = shape(feature['geometry'])
-                if transformer:
-                    from shapely.ops import transform
-                    geom = transform(transformer.transform, geom)
-                feature_dict = {
-                    "type": "Feature",
-                    "properties": dict(feature['properties']),
-                    "geometry": geom.__geo_interface__
-                }
-                features.append(feature_dict)
+            records = [(shape(feature['geometry']), dict(feature['properties'])) for feature in source]
+        # Todas las geometrías a EPSG:4326 con una sola llamada a PROJ.
+        geoms = transform_geometry(np.array([geom for geom, _ in records], dtype=object), source_crs, WGS84)
+        for geom, (_, properties) in zip(geoms, records):
+            feature_dict = {
+                "type": "Feature",
+                "properties": properties,
+                "geometry": geom.__geo_interface__
+            }
+            features.append(feature_dict)
         return {"type": "FeatureCollection", "features": features}
     except Exception as e:
         print(f"Error crítico cargando GeoJSON desde la ruta local {local_gpkg_path}: {e}")
         return None
 
+# --- LECTURA DE PÍXELES POR BLOQUES ---
+# get_raster_value_at_point ya no descarga el ráster entero: abre el COG remoto con
+# /vsicurl/ (peticiones HTTP por rangos), lee sólo el bloque interno que contiene el píxel
+# y lo guarda en una caché LRU en memoria compartida por todas las sesiones.
+# Los datasets se piden al pool de core_logic.raster_pool, que los mantiene abiertos entre
+# consultas (con las opciones VSICURL_OPTIONS).
+RASTER_BLOCK_CACHE_BYTES = int(os.environ.get("CAUMAX_BLOCK_CACHE_MB", "64")) * 1024 * 1024
+
+
+class RasterBlockCache:
+    """LRU de bloques de ráster (arrays) limitada por bytes, segura entre hilos."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.bytes += block.nbytes
+            while self.bytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.bytes = 0
+
+
+_raster_block_cache = RasterBlockCache(RASTER_BLOCK_CACHE_BYTES)
+
+
+def _raster_open_path(raster_path_url):
+    if raster_path_url.startswith(("http://", "https://")):
+        return "/vsicurl/" + raster_path_url
+    return raster_path_url
+
+
+@st.cache_resource(ttl=3600)
+def _get_raster_header(raster_path_url):
+    """Metadatos de la banda 1 de un ráster (sin leer píxeles), una vez por proceso."""
+    with open_raster(_raster_open_path(raster_path_url)) as src:
+        return {
+            "crs": CRS(src.crs),
+            "transform": src.transform,
+            "width": src.width,
+            "height": src.height,
+            "nodata": src.nodata,
+            "block_shape": src.block_shapes[0],
+            "count": src.count,
+            "descriptions": src.descriptions,
+        }
+
+
+def _read_raster_blocks(raster_path_url, header, blocks, indexes=1):
+    """
+    {(block_row, block_col): array} de los bloques pedidos. Los que no están en la caché
+    se leen con un único préstamo del dataset del pool. Con indexes=None se leen todas las bandas
+    y cada bloque es un array (bandas, filas, columnas).
+    """
+    out = {}
+    missing = []
+    for block_row, block_col in blocks:
+        block = _raster_block_cache.get((raster_path_url, indexes, block_row, block_col))
+        if block is None:
+            missing.append((block_row, block_col))
+        else:
+            out[(block_row, block_col)] = block
+    if missing:
+        block_height, block_width = header["block_shape"]
+        with open_raster(_raster_open_path(raster_path_url)) as src:
+            for block_row, block_col in missing:
+                window = Window(
+                    block_col * block_width, block_row * block_height,
+                    min(block_width, header["width"] - block_col * block_width),
+                    min(block_height, header["height"] - block_row * block_height),
+                )
+                block = src.read(indexes, window=window)
+                _raster_block_cache.put((raster_path_url, indexes, block_row, block_col), block)
+                out[(block_row, block_col)] = block
+    return out
+
+
+def _read_raster_block(raster_path_url, header, block_row, block_col):
+    return _read_raster_blocks(raster_path_url, header, [(block_row, block_col)])[(block_row, block_col)]
+
+
 def get_raster_value_at_point(raster_path_url, point_utm):
-    # Para los rásters de la Pestaña 1 (que son pequeños) y los de interpolación (FLOW_X, RAIN_X)
-    # se descargan al disco.
-    local_raster_path = get_local_path_from_url(raster_path_url)
-    if not local_raster_path: return None
+    # Lectura por ventana del bloque que contiene el píxel (ver RasterBlockCache): el coste
+    # del primer clic ya no depende del tamaño del ráster.
+    if not raster_path_url: return None
     try:
-        with rasterio.open(local_raster_path) as src:
-            point_crs = CRS("EPSG:25830")
-            raster_crs = CRS(src.crs)
-            if point_crs != raster_crs:
-                transformer = Transformer.from_crs(point_crs, raster_crs, always_xy=True)
-                point_x, point_y = transformer.transform(point_utm[0], point_utm[1])
-            else:
-                point_x, point_y = point_utm
-            row, col = src.index(point_x, point_y)
-            if not (0 <= row < src.height and 0 <= col < src.width): return None
-            value = src.read(1)[row, col]
-            if src.nodata is not None and value == src.nodata: return None
-            return value
+        header = _get_raster_header(raster_path_url)
+        point_x, point_y = transform_point(point_utm[0], point_utm[1], UTM30N, header["crs"])
+        row, col = rowcol(header["transform"], point_x, point_y)
+        if not (0 <= row < header["height"] and 0 <= col < header["width"]): return None
+        block_height, block_width = header["block_shape"]
+        block = _read_raster_block(raster_path_url, header, row // block_height, col // block_width)
+        value = block[row % block_height, col % block_width]
+        if header["nodata"] is not None and value == header["nodata"]: return None
+        return value
     except Exception as e:
         print(f"ERROR: Fallo al obtener valor de raster en {raster_path_url} para punto {point_utm}: {e}")
         return None
 
-def get_vector_feature_at_point(vector_path_url, point_utm):
+# --- CUBO DE CUANTILES ---
+# Los COG FLOW_*/RAIN_* comparten rejilla; python -m core_logic.quantile_cube los empaqueta
+# en un único GeoTIFF multibanda intercalado por píxel, de modo que un bloque trae los doce
+# cuantiles de cada píxel. La descripción de cada banda es su clave de LAYER_MAPPING.
+QUANTILE_CUBE_PATH = os.environ.get("CAUMAX_QUANTILE_CUBE", os.path.join(DERIVED_DATA_DIR, "quantile_cube.tif"))
+
+
+def _is_single_point(point_or_points):
+    return (len(point_or_points) == 2
+            and all(isinstance(v, (int, float, np.number)) for v in point_or_points))
+
+
+def sample_quantiles(point_or_points, cube_path=QUANTILE_CUBE_PATH):
+    """
+    Cuantiles de caudal y lluvia de todos los periodos de retorno en uno o varios puntos
+    (EPSG:25830) con una sola pasada de lectura sobre el cubo de cuantiles.
+
+    Devuelve {"FLOW": {T: valor}, "RAIN": {T: valor}} para un punto, o una lista de esos
+    diccionarios para una lista de puntos; None en los píxeles nodata o fuera del ráster.
+    Si el cubo no existe o no se puede leer devuelve None y el llamante debe recurrir a
+    get_raster_value_at_point capa a capa.
+    """
+    if not cube_path: return None
+    if not cube_path.startswith(("http://", "https://")) and not os.path.exists(cube_path): return None
+    single = _is_single_point(point_or_points)
+    points = np.asarray([point_or_points] if single else point_or_points, dtype=np.float64).reshape(-1, 2)
+    try:
+        header = _get_raster_header(cube_path)
+        bands = []
+        for description in header["descriptions"]:
+            variable, return_period = (description or "").rsplit("_", 1)
+            bands.append((variable, int(return_period)))
+
+        xs, ys = transform_points(points[:, 0], points[:, 1], UTM30N, header["crs"])
+        rows, cols = rowcol(header["transform"], xs, ys)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < header["height"]) & (cols >= 0) & (cols < header["width"])
+
+        block_height, block_width = header["block_shape"]
+        needed = {(int(r) // block_height, int(c) // block_width) for r, c in zip(rows[inside], cols[inside])}
+        blocks = _read_raster_blocks(cube_path, header, sorted(needed), indexes=None)
+
+        results = []
+        for row, col, is_inside in zip(rows, cols, inside):
+            values = {"FLOW": {}, "RAIN": {}}
+            pixel = None
+            if is_inside:
+                block = blocks[(int(row) // block_height, int(col) // block_width)]
+                pixel = block[:, int(row) % block_height, int(col) % block_width]
+            for band, (variable, return_period) in enumerate(bands):
+                value = None if pixel is None else pixel[band]
+                if value is not None and header["nodata"] is not None and value == header["nodata"]:
+                    value = None
+                values.setdefault(variable, {})[return_period] = value
+            results.append(values)
+        return results[0] if single else results
+    except Exception as e:
+        print(f"Warning: No se pudo leer el cubo de cuantiles {cube_path}: {e}")
+        return None
+
+# --- CONSULTA PUNTO EN POLÍGONO ---
+# Las capas vectoriales (regiones...) se leen una vez por proceso: polígonos preparados en
+# el CRS de la capa y un STRtree sobre ellos; los puntos se pasan al CRS de la capa con
+# core_logic.crs_transform. Cada consulta
+# es una búsqueda en el árbol en lugar de recorrer y convertir todas las features.
+class VectorLayerIndex:
+    """Polígonos preparados de una capa vectorial con un STRtree para consultas punto en polígono."""
+
+    def __init__(self, local_vector_path):
+        with fiona.open(local_vector_path, 'r') as source:
+            source_crs = CRS(source.crs)
+            self.features = list(source)
+        geoms = [shape(f['geometry']) if f['geometry'] is not None else shapely.Polygon() for f in self.features]
+        self.geoms = np.array(geoms, dtype=object)
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+        self.crs_wkt = source_crs.to_wkt()
+
+    def classify(self, xs, ys):
+        """Índice de la primera feature (en orden de la capa) que contiene cada punto; -1 si ninguna."""
+        xs, ys = transform_points(xs, ys, UTM30N, self.crs_wkt)
+        points = shapely.points(xs, ys)
+        point_idx, feature_idx = self.tree.query(points, predicate="within")
+        # Como el bucle original, si varias features contienen el punto gana la primera.
+        result = np.full(points.shape, len(self.features), dtype=np.int64)
+        np.minimum.at(result, point_idx, feature_idx)
+        result[result == len(self.features)] = -1
+        return result
+
+
+@st.cache_resource(ttl=3600)
+def _get_vector_layer_index(vector_path_url):
     # Para vectores (gpkg) siempre descargamos
     local_vector_path = get_local_path_from_url(vector_path_url)
     if not local_vector_path: return None
-    point_shapely = Point(point_utm)
+    return VectorLayerIndex(local_vector_path)
+
+
+def get_vector_features_at_points(vector_path_url, points_utm):
+    """
+    Feature de la capa que contiene cada punto (EPSG:25830), o None para los puntos que
+    no caen en ninguna. Todos los puntos se clasifican con una sola consulta al STRtree.
+    """
     try:
-        with fiona.open(local_vector_path, 'r') as source:
-            source_crs = CRS(source.crs)
-            point_crs = CRS("EPSG:25830")
-            if source_crs != point_crs:
-                transformer = Transformer.from_crs(point_crs, source_crs, always_xy=True)
-                from shapely.ops import transform
-                point_shapely = transform(transformer.transform, point_shapely)
-            for feature in source:
-                geom_shapely = shape(feature['geometry'])
-                if geom_shapely.contains(point_shapely):
-                    return feature
-            return None
+        index = _get_vector_layer_index(vector_path_url)
+        if index is None: return None
+        points = np.asarray(points_utm, dtype=np.float64).reshape(-1, 2)
+        return [index.features[i] if i >= 0 else None for i in index.classify(points[:, 0], points[:, 1])]
+    except Exception as e:
+        print(f"ERROR: Fallo al clasificar puntos en {vector_path_url}: {e}")
+        return None
+
+
+def get_vector_feature_at_point(vector_path_url, point_utm):
+    try:
+        index = _get_vector_layer_index(vector_path_url)
+        if index is None: return None
+        i = index.classify([point_utm[0]], [point_utm[1]])[0]
+        return index.features[i] if i >= 0 else None
     except Exception as e:
         print(f"ERROR: Fallo al obtener feature vectorial en {vector_path_url} para punto {point_utm}: {e}")
         return None
     
     
 # --- INICIO: NUEVA FUNCIÓN DE DESCARGA FORZADA ---
-# Usamos un decorador de caché diferente para esta función para evitar conflictos
-@cache_resource(ttl=3600)
 def force_download_to_local_path(url):
     """
-    Toma una URL, SIEMPRE descarga el archivo a un directorio temporal
-    y devuelve la RUTA LOCAL. Esta función es para las librerías
-    antiguas que no pueden leer URLs directamente.
+    Toma una URL y devuelve la RUTA LOCAL de una copia descargada, para las
+    librerías antiguas que no pueden leer URLs directamente. Comparte la caché
+    persistente con get_local_path_from_url.
     """
     try:
-        filename = os.path.basename(url)
-        local_path = os.path.join(_temp_dir.name, filename)
-
-        # Si el archivo ya existe, lo usamos.
-        if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
-            return local_path
-
-        # Si no, lo descargamos.
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        
-        if os.path.getsize(local_path) == 0:
-            return None
-
-        return local_path
+        return get_asset_cache().fetch(url)
     except Exception as e:
         print(f"Error crítico durante la descarga forzada del archivo {url}: {e}")
         return None
@@ -116,6 +116,54 @@ def calculate_rational_method(area_km2, concentration_time_h, i1id, p0, p0_corre
 
     return flow_m3_s, intermediate_variables
 
+# --- Concentration Time Formulas ---
+
+CONCENTRATION_TIME_FORMULAS = ("temez", "kirpich", "california", "giandotti")
+
+
+def calculate_concentration_times(length_m, delta_h_m, area_km2=None, mean_h_above_outlet_m=None):
+    """
+    Concentration time (hours) of every supported formula, vectorized with NumPy.
+
+    Args:
+        length_m: longest flow path length (m), scalar or array.
+        delta_h_m: elevation drop along the basin (m), scalar or array.
+        area_km2: basin area (km²); required only by Giandotti.
+        mean_h_above_outlet_m: mean basin elevation minus outlet elevation (m);
+            required only by Giandotti.
+
+    Returns:
+        dict {formula: float or ndarray}. A formula gives 0 where its inputs are
+        not positive, as BasinCalculatorRefactored does for Témez.
+    """
+    length_m = np.asarray(length_m, dtype=np.float64)
+    delta_h_m = np.asarray(delta_h_m, dtype=np.float64)
+    valid = (length_m > 0) & (delta_h_m > 0)
+    length = np.where(valid, length_m, 1.0)
+    drop = np.where(valid, delta_h_m, 1.0)
+    slope = drop / length
+
+    times = {
+        # Témez (Instrucción 5.2-IC), L en km y pendiente en m/m.
+        "temez": np.where(valid, 0.3 * (length / 1000.0 / slope**0.25)**0.76, 0.0),
+        # Kirpich, en minutos con L en m.
+        "kirpich": np.where(valid, 0.0195 * length**0.77 * slope**-0.385 / 60.0, 0.0),
+        # California Culverts Practice, L en km y desnivel en m: Kirpich con el desnivel total.
+        "california": np.where(valid, (0.87 * (length / 1000.0)**3 / drop)**0.385, 0.0),
+    }
+    if area_km2 is not None and mean_h_above_outlet_m is not None:
+        area = np.asarray(area_km2, dtype=np.float64)
+        relief = np.asarray(mean_h_above_outlet_m, dtype=np.float64)
+        ok = (area > 0) & (relief > 0) & (length_m > 0)
+        times["giandotti"] = np.where(
+            ok,
+            (4.0 * np.sqrt(np.where(ok, area, 0.0)) + 1.5 * length_m / 1000.0)
+            / (0.8 * np.sqrt(np.where(ok, relief, 1.0))),
+            0.0,
+        )
+    return {name: (float(value) if value.ndim == 0 else value) for name, value in times.items()}
+
+
 # --- Curve Fitting and Flow Calculation for Interpolation ---
 
 def get_median_for_plot(return_period):
@@ -247,6 +295,23 @@ def get_flow_from_gev(return_period, gev_params):
         except (ValueError, OverflowError): # Math domain error (e.g., negative base for power)
             return 0 # Or handle as error
 
+def get_flows_from_gev(return_periods, gev_params):
+    """
+    Vectorized get_flow_from_gev: array of flows for an array of return periods.
+    gev_params: (alpha, mu, k)
+    """
+    alpha, mu, k = gev_params
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        prob = 1 - 1.0 / np.asarray(return_periods, dtype=np.float64)
+        base_power = -np.log(prob)
+        if k == 0: # Gumbel case
+            flows = mu - alpha * np.log(base_power)
+        else:
+            flows = mu + alpha / k * (1 - np.power(base_power, k))
+    # Mismo criterio que la versión escalar: fuera del dominio se devuelve 0.
+    valid = (prob > 0) & (prob < 1) & np.isfinite(flows)
+    return np.where(valid, flows, 0.0)
+
 def calculate_tcev_fit(qs, return_periods):
     """
     Performs TCEV curve fitting using scipy.optimize.minimize.
@@ -413,38 +478,59 @@ def _tcev_sqdif_helper(qs_arr, fs_arr, a1, a2, lam1, lam2):
     return difsum
 
 
-def get_flow_from_tcev(return_period, tcev_params):
+def get_flows_from_tcev(return_periods, tcev_params):
     """
-    Calculates flow from TCEV parameters for a given return period.
+    Vectorized TCEV quantiles: array of flows for an array of return periods.
     tcev_params: (alpha1, alpha2, lambda1, lambda2)
+
+    Solves exp(-alpha1*exp(-lambda1*Q) - alpha2*exp(-lambda2*Q)) = 1 - 1/T for all the
+    periods at once with Newton iterations on the log of the exponent, bracketed and
+    seeded from the Gumbel component that dominates each tail.
     """
-    alpha1, alpha2, lambda1, lambda2 = tcev_params
-    prob = 1 - 1.0 / return_period
-    if prob <= 0 or prob >= 1:
-        return 0
+    alpha1, alpha2, lambda1, lambda2 = (float(p) for p in tcev_params)
+    return_periods = np.asarray(return_periods, dtype=np.float64)
+    flows = np.zeros(return_periods.shape)
+    if min(alpha1, alpha2, lambda1, lambda2) <= 0:
+        print(f"Warning: Parámetros TCEV no válidos: {tcev_params}")
+        return flows
+
+    # F(Q) = 1 - 1/T  <=>  g(Q) = alpha1*exp(-lambda1*Q) + alpha2*exp(-lambda2*Q) = y, con
+    # y = -ln(1 - 1/T). Se resuelve h(Q) = ln g(Q) - ln y = 0: h es decreciente y convexa.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_y = np.log(-np.log1p(-1.0 / return_periods))
+    valid = (return_periods > 1) & np.isfinite(log_y)
+    log_y = log_y[valid]
+    log_a = np.array([math.log(alpha1), math.log(alpha2)])[:, None]
+    lam = np.array([lambda1, lambda2])[:, None]
+
+    # Cuantil de cada componente de Gumbel por separado. Como g es mayor que cada término
+    # y menor que el doble del mayor, la raíz está entre el mayor de ellos (semilla) y ese
+    # mismo desplazado ln(2)/lambda: h >= 0 en la semilla y, al ser convexa, Newton avanza
+    # de forma monótona hacia la raíz sin salir del intervalo.
+    gumbel = (log_a - log_y) / lam
+    lower = gumbel.max(axis=0)
+    upper = (gumbel + math.log(2.0) / lam).max(axis=0)
+    q = lower.copy()
+    active = np.ones(q.shape, dtype=bool)
+    for _ in range(100):
+        terms = log_a - lam * q[active]
+        log_g = np.logaddexp(terms[0], terms[1])
+        h = log_g - log_y[active]
+        # -h' es la media de lambda ponderada por el peso de cada término en g.
+        slope = (lam * np.exp(terms - log_g)).sum(axis=0)
+        q_new = np.clip(q[active] + h / slope, lower[active], upper[active])
+        converged = np.abs(q_new - q[active]) <= 4 * np.finfo(np.float64).eps * np.maximum(np.abs(q_new), 1.0)
+        q[active] = q_new
+        active[np.flatnonzero(active)[converged]] = False
+        if not active.any():
+            break
+    flows[valid] = q
+    return flows
 
-    def _f_tcev_solver(val):
-        try:
-            term1 = np.clip(-val * lambda1, -700, 700)
-            term2 = np.clip(-val * lambda2, -700, 700)
-            return (
-                math.exp(
-                    (-alpha1 * math.exp(term1))
-                    - (alpha2 * math.exp(term2))
-                )
-                - prob
-            )
-        except (OverflowError, ValueError):
-            return 1e10 # Return a large value to push solver away
 
-    try:
-        # Initial guess for fsolve, can be refined based on return_period range
-        initial_guess = 75 # Default from original code
-        if return_period > 100: initial_guess = 150
-        if return_period > 250: initial_guess = 300
-        if return_period > 400: initial_guess = 400
-
-        flow = fsolve(_f_tcev_solver, initial_guess)[0]
-        return flow
-    except Exception:
-        return 0 # Return 0 or handle error if solver fails
+def get_flow_from_tcev(return_period, tcev_params):
+    """
+    Calculates flow from TCEV parameters for a given return period.
+    tcev_params: (alpha1, alpha2, lambda1, lambda2)
+    """
+    return float(get_flows_from_tcev([return_period], tcev_params)[0])
@@ -0,0 +1,202 @@
+# core_logic/map_layers.py
+#
+# Capas vectoriales del mapa interactivo (ZONES, BASINS, RIVERS).
+#
+# Cada capa se carga una vez por proceso con st.cache_resource (sin la copia por pickle de
+# st.cache_data en cada acceso) y se guarda ya serializada como cadena GeoJSON. El mapa la
+# incrusta tal cual con SerializedGeoJson, en lugar de que folium.GeoJson recorra todas las
+# features para calcular estilos e identificadores y vuelva a serializarlas en cada rerun.
+#
+# Además cada capa sirve vistas: MapLayer.view(bounds, zoom) devuelve sólo las features
+# que cortan la extensión visible (consulta a un STRtree), simplificadas según la banda de
+# zoom. Las versiones simplificadas y serializadas de cada banda se calculan una vez.
+
+import json
+import math
+import threading
+
+import numpy as np
+import shapely
+import streamlit as st
+from branca.element import Element, Template
+from folium.elements import ElementAddToElement
+from folium.map import Layer
+
+from .gis_utils import get_layer_path, get_local_path_from_url, load_geojson_from_gpkg
+
+
+def _script_safe_json(data):
+    # JSON compacto que se puede incrustar dentro de <script> (como el filtro tojson de folium).
+    text = json.dumps(data, separators=(",", ":"))
+    return text.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+
+
+# Bandas de zoom (mínimo, máximo) de Leaflet. En cada banda las geometrías se simplifican
+# con una tolerancia de un píxel del zoom máximo de la banda; la última va sin simplificar.
+ZOOM_BANDS = ((0, 7), (8, 9), (10, 11), (12, 13), (14, 30))
+# Margen que se añade a cada lado de la vista (fracción de su ancho/alto), para que los
+# desplazamientos pequeños no obliguen a pedir otra vista.
+VIEW_PADDING = 0.5
+TILE_SIZE_PX = 256
+
+
+def zoom_band(zoom):
+    """Index in ZOOM_BANDS of a Leaflet zoom level."""
+    for i, (_, max_zoom) in enumerate(ZOOM_BANDS):
+        if zoom <= max_zoom:
+            return i
+    return len(ZOOM_BANDS) - 1
+
+
+def _band_tolerance(band):
+    if band == len(ZOOM_BANDS) - 1:
+        return 0.0
+    return 360.0 / (TILE_SIZE_PX * 2 ** ZOOM_BANDS[band][1])
+
+
+def padded_bounds(bounds, padding=VIEW_PADDING):
+    """(west, south, east, north) grown by `padding` times its width/height on each side."""
+    west, south, east, north = bounds
+    dx, dy = (east - west) * padding, (north - south) * padding
+    return (west - dx, max(south - dy, -90.0), east + dx, min(north + dy, 90.0))
+
+
+def viewport_bounds(center, zoom, width_px=1200, height_px=600):
+    """Approximate (west, south, east, north) of a Web Mercator map of the given size."""
+    lat, lon = center
+    world_px = TILE_SIZE_PX * 2 ** zoom
+    half_lon = width_px / 2 * 360.0 / world_px
+    y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+    half_y = height_px / 2 * 2 * math.pi / world_px
+    south = math.degrees(2 * math.atan(math.exp(y - half_y)) - math.pi / 2)
+    north = math.degrees(2 * math.atan(math.exp(y + half_y)) - math.pi / 2)
+    return (lon - half_lon, south, lon + half_lon, north)
+
+
+class MapLayer:
+    """
+    A vector layer ready for the map, in EPSG:4326. `geojson` is the whole
+    FeatureCollection serialized once; view() serves the features that intersect
+    a bounding box, simplified for the zoom band. `geoms` and `properties` (JSON
+    strings) are aligned with the features. Instances are shared by every session;
+    the per-band caches are filled under a lock.
+    """
+
+    __slots__ = ("key", "geojson", "feature_count", "geoms", "tree", "properties", "_bands", "_lock")
+
+    def __init__(self, key, feature_collection):
+        self.key = key
+        self.geojson = _script_safe_json(feature_collection)
+        features = feature_collection["features"]
+        self.feature_count = len(features)
+        self.geoms = np.array([shapely.geometry.shape(f["geometry"]) if f["geometry"] else None for f in features],
+                              dtype=object)
+        self.tree = shapely.STRtree(self.geoms)
+        self.properties = [_script_safe_json(f.get("properties") or {}) for f in features]
+        self._bands = {}
+        self._lock = threading.Lock()
+
+    def _band_features(self, band):
+        """Serialized Feature of every geometry simplified for `band` (None if it vanishes)."""
+        with self._lock:
+            serialized = self._bands.get(band)
+            if serialized is not None:
+                return serialized
+            tolerance = _band_tolerance(band)
+            geoms = self.geoms
+            if tolerance > 0:
+                geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+                # Rejilla de la mitad de la tolerancia: menos dígitos en el JSON.
+                try:
+                    geoms = shapely.set_precision(geoms, tolerance / 2)
+                except shapely.errors.GEOSException:
+                    pass
+            texts = shapely.to_geojson(geoms)
+            empty = shapely.is_empty(geoms) | shapely.is_missing(geoms)
+            serialized = [
+                None if empty[i] else
+                f'{{"type":"Feature","properties":{self.properties[i]},"geometry":{texts[i]}}}'
+                for i in range(len(texts))
+            ]
+            self._bands[band] = serialized
+            return serialized
+
+    def view(self, bounds, zoom):
+        """
+        FeatureCollection string with the features intersecting `bounds` (west, south,
+        east, north) simplified for `zoom`, and the number of features it contains.
+        """
+        band = self._band_features(zoom_band(zoom))
+        hits = np.sort(self.tree.query(shapely.box(*bounds), predicate="intersects"))
+        features = [band[i] for i in hits if band[i] is not None]
+        return '{"type":"FeatureCollection","features":[' + ",".join(features) + "]}", len(features)
+
+
+@st.cache_resource(show_spinner=False)
+def get_map_layer(layer_key):
+    """Process-wide MapLayer for a LAYER_MAPPING vector key, or None if it cannot be loaded."""
+    try:
+        gpkg_url = get_layer_path(layer_key)
+        if not gpkg_url:
+            print(f"ERROR: No se encontró la URL para la capa '{layer_key}' en LAYER_MAPPING.")
+            return None
+
+        local_gpkg_path = get_local_path_from_url(gpkg_url)
+        if not local_gpkg_path:
+            print(f"ERROR: Falló la descarga del archivo para la capa '{layer_key}' desde la URL: {gpkg_url}")
+            return None
+
+        geojson_data = load_geojson_from_gpkg(local_gpkg_path)
+        if not geojson_data:
+            print(f"ERROR: Falló el procesamiento del archivo local '{local_gpkg_path}' para la capa '{layer_key}'.")
+            return None
+        return MapLayer(layer_key, geojson_data)
+    except Exception as e:
+        # Si hay un error se registra en los logs y la app simplemente no dibuja la capa.
+        print(f"Error crítico al cargar la capa {layer_key}: {e}")
+        return None
+
+
+class _RawScript(Element):
+    """Script fragment that is emitted as is (not compiled as a Jinja template)."""
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+class SerializedGeoJson(Layer):
+    """
+    GeoJSON overlay that embeds an already serialized string with one fixed style
+    (a Leaflet path options dict) for every feature.
+    """
+
+    # streamlit_folium no renderiza la figura: llama a la macro script de cada elemento.
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.geojson }}, {style: {{ this.style|tojson }}});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, geojson, style, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "SerializedGeoJson"
+        self.geojson = geojson
+        self.style = style
+
+    def render(self, **kwargs):
+        # Como Layer.render + MacroElement.render, salvo que el script se añade a la figura
+        # con _RawScript: branca compilaría el GeoJSON entero como plantilla en cada rerun.
+        if self.show:
+            self.add_child(ElementAddToElement(element_name=self.get_name(),
+                                               element_parent_name=self._parent.get_name()),
+                           name=self.get_name() + "_add")
+        script = self._template.module.script(self, kwargs)
+        self.get_root().script.add_child(_RawScript(script), name=self.get_name())
+        for element in self._children.values():
+            element.render(**kwargs)
@@ -0,0 +1,95 @@
+# core_logic/quantile_cube.py
+#
+# Cubo multibanda con los cuantiles de caudal y lluvia (FLOW_*/RAIN_* de LAYER_MAPPING).
+#
+# Los doce COG comparten rejilla. Aquí se empaquetan en un único GeoTIFF tileado e
+# intercalado por píxel (INTERLEAVE=PIXEL): cada bloque comprimido guarda juntos los doce
+# valores de cada píxel, y gis_utils.sample_quantiles obtiene todos los periodos de retorno
+# de muchos puntos con una lectura por bloque en vez de doce.
+#
+# Construcción (offline, una vez por versión de las capas):
+#     python -m core_logic.quantile_cube [--output RUTA] [--block-size 256]
+
+import argparse
+import os
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from .gis_utils import LAYER_MAPPING, QUANTILE_CUBE_PATH, get_local_path_from_url
+
+QUANTILE_VARIABLES = ("FLOW", "RAIN")
+QUANTILE_RETURN_PERIODS = tuple(sorted(
+    int(key.split("_")[1]) for key in LAYER_MAPPING if key.startswith("FLOW_")
+))
+# Orden de las bandas del cubo: primero todos los caudales y después todas las lluvias.
+QUANTILE_LAYERS = tuple(
+    f"{variable}_{return_period}"
+    for variable in QUANTILE_VARIABLES for return_period in QUANTILE_RETURN_PERIODS
+)
+CUBE_NODATA = -9999.0
+CUBE_BLOCK_SIZE = 256
+
+
+def build_quantile_cube(source_paths, output_path, block_size=CUBE_BLOCK_SIZE):
+    """
+    Writes the layers of `source_paths` ({layer key: path}, in band order) to a
+    pixel-interleaved, tiled Float32 GeoTIFF at `output_path`. Every source must
+    share the CRS, transform and size of the first one.
+    """
+    keys = list(source_paths)
+    sources = [rasterio.open(source_paths[key]) for key in keys]
+    try:
+        reference = sources[0]
+        for key, src in zip(keys, sources):
+            if (src.crs != reference.crs or src.transform != reference.transform
+                    or src.shape != reference.shape):
+                raise ValueError(f"La capa {key} no comparte la rejilla de {keys[0]}; no se puede empaquetar en el cubo.")
+
+        profile = {
+            "driver": "GTiff", "dtype": "float32", "count": len(keys),
+            "width": reference.width, "height": reference.height,
+            "crs": reference.crs, "transform": reference.transform, "nodata": CUBE_NODATA,
+            "tiled": True, "blockxsize": block_size, "blockysize": block_size,
+            "interleave": "pixel", "compress": "deflate", "predictor": 3, "bigtiff": "if_safer",
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        tmp_path = output_path + ".tmp"
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            for band, key in enumerate(keys, start=1):
+                variable, return_period = key.rsplit("_", 1)
+                dst.set_band_description(band, key)
+                dst.update_tags(band, VARIABLE=variable, RETURN_PERIOD=return_period, SOURCE=source_paths[key])
+            dst.update_tags(LAYERS=",".join(keys))
+
+            # Se escribe por franjas de una fila de bloques: la memoria no depende del tamaño.
+            for row0 in range(0, reference.height, block_size):
+                window = Window(0, row0, reference.width, min(block_size, reference.height - row0))
+                stripe = np.empty((len(keys), int(window.height), int(window.width)), dtype=np.float32)
+                for band, src in enumerate(sources):
+                    data = src.read(1, window=window)
+                    invalid = ~np.isfinite(data) if src.nodata is None else (data == src.nodata)
+                    stripe[band] = data
+                    stripe[band][invalid] = CUBE_NODATA
+                dst.write(stripe, window=window)
+        os.replace(tmp_path, output_path)
+    finally:
+        for src in sources:
+            src.close()
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Empaqueta los COG FLOW_*/RAIN_* en un cubo multibanda.")
+    parser.add_argument("--output", default=QUANTILE_CUBE_PATH, help="Ruta del GeoTIFF de salida.")
+    parser.add_argument("--block-size", type=int, default=CUBE_BLOCK_SIZE, help="Lado de los bloques internos.")
+    args = parser.parse_args()
+
+    source_paths = {key: get_local_path_from_url(LAYER_MAPPING[key]) for key in QUANTILE_LAYERS}
+    build_quantile_cube(source_paths, args.output, args.block_size)
+    print(f"Cubo de cuantiles con {len(QUANTILE_LAYERS)} bandas escrito en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
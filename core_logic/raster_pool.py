@@ -0,0 +1,200 @@
+# core_logic/raster_pool.py
+#
+# Pool de datasets ráster abiertos (rasterio o GDAL), compartido por todo el proceso.
+#
+# Abrir un ráster cuesta leer y analizar su cabecera y, en un COG remoto (/vsicurl/), al
+# menos una petición HTTP. El pool guarda los datasets abiertos por ruta o URL y los presta
+# en exclusiva: un dataset sólo lo usa un hilo a la vez (ni rasterio ni GDAL permiten
+# compartirlo entre hilos) y al terminar vuelve al pool para la siguiente consulta. No se
+# guardan en threading.local porque Streamlit ejecuta cada rerun en un hilo nuevo y los
+# datasets se perderían en cada clic.
+#
+# El número de datasets abiertos está acotado (se cierran los menos usados recientemente)
+# y los que llevan más de RASTER_POOL_IDLE_SECONDS sin usarse se cierran. stats() da las
+# aperturas, reutilizaciones y cierres.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import rasterio
+import rasterio.errors
+
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    GDAL_AVAILABLE = False
+    gdal = None
+
+RASTER_POOL_SIZE = int(os.environ.get("CAUMAX_RASTER_POOL_SIZE", "16"))
+RASTER_POOL_IDLE_SECONDS = float(os.environ.get("CAUMAX_RASTER_POOL_IDLE_S", "300"))
+VSICURL_OPTIONS = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "VSI_CACHE": "TRUE",
+}
+
+
+class RasterSource:
+    """One opened dataset of the pool ("rasterio" or "gdal" backend) and its usage bookkeeping."""
+
+    __slots__ = ("key", "backend", "dataset", "opened_at", "last_used", "uses")
+
+    def __init__(self, path, backend="rasterio"):
+        self.key = (backend, path)
+        self.backend = backend
+        if backend == "gdal":
+            if not GDAL_AVAILABLE:
+                raise ImportError("GDAL no está disponible.")
+            self.dataset = gdal.Open(path, gdal.GA_ReadOnly)
+            if self.dataset is None:
+                raise FileNotFoundError(f"No se pudo abrir el ráster {path}")
+        else:
+            self.dataset = rasterio.open(path)
+        self.opened_at = self.last_used = time.monotonic()
+        self.uses = 0
+
+    def close(self):
+        if self.backend == "rasterio" and self.dataset is not None:
+            self.dataset.close()
+        # Un dataset de GDAL se cierra al soltar la última referencia.
+        self.dataset = None
+
+
+class RasterSourcePool:
+    """
+    Process-wide pool of opened rasters keyed by (backend, path or URL). open() lends a
+    dataset to the calling thread and takes it back afterwards; at most `max_open`
+    datasets stay open and idle ones are closed after `idle_seconds`.
+    """
+
+    def __init__(self, max_open=RASTER_POOL_SIZE, idle_seconds=RASTER_POOL_IDLE_SECONDS, env_options=VSICURL_OPTIONS):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.env_options = dict(env_options)
+        self.opens = 0
+        self.reuses = 0
+        self.evictions = 0
+        self.idle_evictions = 0
+        self.errors = 0
+        self.open_seconds = 0.0
+        self._idle = OrderedDict()  # id(source) -> RasterSource, del menos al más reciente
+        self._lent = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, path, backend="rasterio"):
+        """Context manager yielding an opened dataset of `path` for the exclusive use of the caller."""
+        with rasterio.Env(**self.env_options):
+            source = self._checkout((backend, path))
+            try:
+                yield source.dataset
+            except (rasterio.errors.RasterioError, OSError, RuntimeError):
+                # Tras un error de lectura el estado del dataset no es fiable: no vuelve al pool.
+                self._discard(source)
+                raise
+            finally:
+                if source.dataset is not None:
+                    self._checkin(source)
+
+    def _checkout(self, key):
+        with self._lock:
+            self._close_idle(time.monotonic())
+            for source_id, source in reversed(self._idle.items()):
+                if source.key == key:
+                    del self._idle[source_id]
+                    self._lent += 1
+                    self.reuses += 1
+                    source.uses += 1
+                    return source
+            self._lent += 1
+        start = time.perf_counter()
+        try:
+            source = RasterSource(key[1], backend=key[0])
+        except Exception:
+            with self._lock:
+                self._lent -= 1
+                self.errors += 1
+            raise
+        with self._lock:
+            self.opens += 1
+            self.open_seconds += time.perf_counter() - start
+        source.uses += 1
+        return source
+
+    def _checkin(self, source):
+        closing = []
+        with self._lock:
+            self._lent -= 1
+            source.last_used = time.monotonic()
+            self._idle[id(source)] = source
+            while self._idle and len(self._idle) + self._lent > self.max_open:
+                _, evicted = self._idle.popitem(last=False)
+                closing.append(evicted)
+                self.evictions += 1
+        for evicted in closing:
+            evicted.close()
+
+    def _discard(self, source):
+        with self._lock:
+            self._lent -= 1
+            self.errors += 1
+        source.close()
+
+    def _close_idle(self, now):
+        # Se llama con el lock tomado; _idle está ordenado por último uso.
+        while self._idle:
+            source_id, source = next(iter(self._idle.items()))
+            if now - source.last_used < self.idle_seconds:
+                break
+            del self._idle[source_id]
+            source.close()
+            self.idle_evictions += 1
+
+    def close_idle(self):
+        """Closes the datasets that have been idle for longer than idle_seconds."""
+        with self._lock:
+            self._close_idle(time.monotonic())
+
+    def clear(self):
+        """Closes every idle dataset."""
+        with self._lock:
+            idle = list(self._idle.values())
+            self._idle.clear()
+        for source in idle:
+            source.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "opens": self.opens,
+                "reuses": self.reuses,
+                "evictions": self.evictions,
+                "idle_evictions": self.idle_evictions,
+                "errors": self.errors,
+                "open_seconds": self.open_seconds,
+                "idle": len(self._idle),
+                "lent": self._lent,
+            }
+
+
+_raster_pool = None
+_raster_pool_lock = threading.Lock()
+
+
+def get_raster_pool():
+    """Process-wide RasterSourcePool."""
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool is None:
+            _raster_pool = RasterSourcePool()
+        return _raster_pool
+
+
+def open_raster(path, backend="rasterio"):
+    """Shortcut for get_raster_pool().open(path, backend)."""
+    return get_raster_pool().open(path, backend=backend)
@@ -0,0 +1,116 @@
+# core_logic/raster_store.py
+#
+# Almacén de rásters en formato .npy sin comprimir para las capas de la Pestaña 1.
+#
+# Cada capa se guarda como <CLAVE>.npy (cabecera alineada, datos contiguos) más un
+# <CLAVE>.json con geotransformación, proyección y nodata. Se abren con np.memmap en modo
+# lectura, así que varios procesos comparten las páginas a través de la caché del sistema
+# operativo y sólo se cargan en memoria las páginas que realmente se tocan.
+#
+# Ingesta (offline, una vez por versión de las capas):
+#     python -m core_logic.raster_store [--output CARPETA] [--layers MDT FLOWDIRS ...]
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from .gis_utils import DERIVED_DATA_DIR, LAYER_MAPPING, get_local_path_from_url
+
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    GDAL_AVAILABLE = False
+    gdal = None
+
+RASTER_STORE_DIR = os.path.join(DERIVED_DATA_DIR, "raster_store")
+# Filas que se leen de GDAL en cada pasada durante la ingesta.
+INGEST_ROWS_PER_CHUNK = 1024
+
+
+def ingest_raster(source_path, key, output_dir):
+    """Copies band 1 of `source_path` into <output_dir>/<key>.npy plus its JSON sidecar."""
+    ds = gdal.Open(source_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise FileNotFoundError(f"No se pudo abrir el ráster {source_path}")
+    band = ds.GetRasterBand(1)
+    rows, cols = ds.RasterYSize, ds.RasterXSize
+    first = band.ReadAsArray(0, 0, cols, min(INGEST_ROWS_PER_CHUNK, rows))
+
+    os.makedirs(output_dir, exist_ok=True)
+    npy_path = os.path.join(output_dir, f"{key}.npy")
+    tmp_path = npy_path + ".tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=first.dtype, shape=(rows, cols))
+    out[:first.shape[0]] = first
+    for row0 in range(first.shape[0], rows, INGEST_ROWS_PER_CHUNK):
+        n_rows = min(INGEST_ROWS_PER_CHUNK, rows - row0)
+        out[row0:row0 + n_rows] = band.ReadAsArray(0, row0, cols, n_rows)
+    out.flush()
+    del out
+    os.replace(tmp_path, npy_path)
+
+    meta = {
+        "shape": [rows, cols],
+        "dtype": str(first.dtype),
+        "geotransform": list(ds.GetGeoTransform()),
+        "projection": ds.GetProjection(),
+        "nodata": band.GetNoDataValue(),
+        "source": source_path,
+    }
+    with open(os.path.join(output_dir, f"{key}.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    ds = None
+    return meta
+
+
+class RasterStore:
+    """Read-only access to the layers written by ingest_raster."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    @classmethod
+    def open(cls, folder=RASTER_STORE_DIR, required_keys=()):
+        """Returns the store if every key in `required_keys` has been ingested, otherwise None."""
+        store = cls(folder)
+        if not all(store.has(key) for key in required_keys):
+            return None
+        return store
+
+    def has(self, key):
+        return (os.path.exists(os.path.join(self.folder, f"{key}.npy"))
+                and os.path.exists(os.path.join(self.folder, f"{key}.json")))
+
+    def load(self, key):
+        """(memory-mapped array, metadata dict) for layer `key`."""
+        with open(os.path.join(self.folder, f"{key}.json")) as f:
+            meta = json.load(f)
+        array = np.load(os.path.join(self.folder, f"{key}.npy"), mmap_mode="r")
+        if list(array.shape) != meta["shape"]:
+            raise ValueError(f"El ráster almacenado {key} no coincide con su metadato.")
+        meta["geotransform"] = tuple(meta["geotransform"])
+        return array, meta
+
+
+def main():
+    from .basin_data import BASIN_LAYERS
+
+    parser = argparse.ArgumentParser(description="Convierte las capas de la Pestaña 1 a .npy mapeables en memoria.")
+    parser.add_argument("--output", default=RASTER_STORE_DIR, help="Carpeta del almacén.")
+    parser.add_argument("--layers", nargs="+", default=list(BASIN_LAYERS), help="Claves de LAYER_MAPPING a convertir.")
+    args = parser.parse_args()
+
+    if not GDAL_AVAILABLE:
+        raise ImportError("GDAL no está disponible. No se puede construir el almacén de rásters.")
+    gdal.UseExceptions()
+
+    for key in args.layers:
+        source_path = get_local_path_from_url(LAYER_MAPPING[key])
+        meta = ingest_raster(source_path, key, args.output)
+        print(f"Capa {key} almacenada: {meta['shape'][0]}x{meta['shape'][1]} {meta['dtype']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# core_logic/upstream_index.py
+#
+# Índice de intervalos aguas arriba sobre FLOWDIRS.
+#
+# Las celdas se numeran con un recorrido en profundidad (preorden) del árbol de flujo
+# invertido. Cada celda guarda su número de entrada (tin) y el tamaño de su subárbol,
+# de modo que "c está aguas arriba de o" equivale a tin[o] <= tin[c] < tin[o] + size[o]
+# y la cuenca de o es el tramo order[tin[o]:tin[o] + size[o]].
+#
+# Construcción (offline, una vez por versión de dir_COG.tif):
+#     python -m core_logic.upstream_index [--flowdirs RUTA_O_URL] [--output CARPETA]
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from .gis_utils import DERIVED_DATA_DIR, LAYER_MAPPING, get_local_path_from_url
+from .upstream_traversal import D8_BRANCH, D8_DOWNSTREAM, DIAGONAL_STEP, UpstreamTrace
+
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    GDAL_AVAILABLE = False
+    gdal = None
+
+UPSTREAM_INDEX_DIR = os.path.join(DERIVED_DATA_DIR, "upstream_index")
+
+
+def downstream_indices(dirs):
+    """Flat index of the downstream cell of every cell, or -1 if it drains out of the grid."""
+    flat = dirs.reshape(-1)
+    return downstream_indices_of(np.arange(flat.size, dtype=np.int64), flat, dirs.shape)
+
+
+def downstream_indices_of(cells, dirs_values, shape):
+    """downstream_indices() restricted to the given flat cells and their D8 codes."""
+    rows, cols = shape
+    down = np.full(cells.size, -1, dtype=np.int64)
+    for code, (drow, dcol) in D8_DOWNSTREAM.items():
+        idx = np.nonzero(dirs_values == code)[0]
+        r2 = cells[idx] // cols + drow
+        c2 = cells[idx] % cols + dcol
+        inside = (r2 >= 0) & (r2 < rows) & (c2 >= 0) & (c2 < cols)
+        down[idx[inside]] = r2[inside] * cols + c2[inside]
+    return down
+
+
+def branch_indices(dirs_values):
+    """Position in D8_NEIGHBOURS of each D8 code (0 for invalid codes)."""
+    branch = np.zeros(len(dirs_values), dtype=np.uint8)
+    for code, k in D8_BRANCH.items():
+        branch[dirs_values == code] = k
+    return branch
+
+
+def topological_levels(down):
+    """
+    Kahn ordering of the flow tree, from the headwaters to the outlets. Every cell
+    appears in a later level than all the cells that drain into it. Cells trapped
+    in flow-direction cycles never appear.
+    """
+    has_down = down >= 0
+    indegree = np.bincount(down[has_down], minlength=down.size)
+    frontier = np.nonzero(indegree == 0)[0]
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        parents = down[frontier]
+        parents = parents[parents >= 0]
+        if parents.size == 0:
+            break
+        parents, counts = np.unique(parents, return_counts=True)
+        indegree[parents] -= counts
+        frontier = parents[indegree[parents] == 0]
+    return levels
+
+
+def accumulate(values, down, levels, ufunc=np.add):
+    """
+    Flow accumulation: every cell receives the sum of `values` over itself and all
+    the cells that drain into it. `levels` comes from topological_levels(down).
+    Another binary ufunc (e.g. np.fmin, np.fmax) gives the minimum or maximum instead.
+    """
+    acc = np.array(values, copy=True)
+    for level in levels:
+        parents = down[level]
+        drains = parents >= 0
+        ufunc.at(acc, parents[drains], acc[level[drains]])
+    return acc
+
+
+def longest_upstream_paths(down, levels, dirs_values, valid):
+    """
+    Longest flow path ending at every cell, starting at a cell where `valid` is True.
+
+    Returns (orth_steps, diag_steps, farthest): the orthogonal and diagonal steps of
+    the path and the flat index of its first cell (-1 where no valid cell drains into
+    the cell). Lengths are compared exactly in steps; ties go to the tributary that
+    comes first in D8_NEIGHBOURS order, like farthest_position() does.
+    """
+    n = down.size
+    diagonal = np.isin(dirs_values, [code for code, (drow, dcol) in D8_DOWNSTREAM.items() if drow and dcol])
+    # Longitud en milésimas de celda: 1000 por paso ortogonal y 1414 por paso diagonal.
+    step = np.where(diagonal, int(round(DIAGONAL_STEP * 1000)), 1000).astype(np.int64)
+    branch = branch_indices(dirs_values).astype(np.int16)
+    length = np.where(valid, 0, -1).astype(np.int64)
+    orth_steps = np.zeros(n, dtype=np.int32)
+    diag_steps = np.zeros(n, dtype=np.int32)
+    farthest = np.where(valid, np.arange(n, dtype=np.int64), -1)
+    best_branch = np.full(n, np.iinfo(np.int16).max, dtype=np.int16)
+    for level in levels:
+        parents = down[level]
+        drains = (parents >= 0) & (length[level] >= 0)
+        if not drains.any():
+            continue
+        children = level[drains]
+        parents = parents[drains]
+        candidate = length[children] + step[children]
+        # Mejor afluente de cada celda en este nivel: el más largo y, a igualdad, el de
+        # menor posición en D8_NEIGHBOURS.
+        order = np.lexsort((branch[children], -candidate, parents))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = parents[order[1:]] != parents[order[:-1]]
+        best = order[first]
+        children, parents, candidate = children[best], parents[best], candidate[best]
+        # Los afluentes de una celda pueden repartirse entre varios niveles.
+        better = (candidate > length[parents]) | (
+            (candidate == length[parents]) & (branch[children] < best_branch[parents]))
+        children, parents = children[better], parents[better]
+        length[parents] = candidate[better]
+        best_branch[parents] = branch[children]
+        farthest[parents] = farthest[children]
+        orth_steps[parents] = orth_steps[children] + ~diagonal[children]
+        diag_steps[parents] = diag_steps[children] + diagonal[children]
+    return orth_steps, diag_steps, farthest
+
+
+def strahler_order(down, levels):
+    """
+    Strahler order of every cell of the flow tree: 1 for headwater cells, and
+    one more than the highest tributary order where two or more tributaries of
+    that order meet. `levels` comes from topological_levels(down).
+    """
+    max_child = np.zeros(down.size, dtype=np.int32)
+    n_max_child = np.zeros(down.size, dtype=np.int32)
+    order = np.zeros(down.size, dtype=np.int32)
+    for level in levels:
+        highest = max_child[level]
+        order[level] = np.where(highest == 0, 1, np.where(n_max_child[level] >= 2, highest + 1, highest))
+        parents = down[level]
+        drains = parents >= 0
+        if not drains.any():
+            continue
+        parents, inverse = np.unique(parents[drains], return_inverse=True)
+        child_order = order[level[drains]]
+        level_max = np.zeros(parents.size, dtype=np.int32)
+        np.maximum.at(level_max, inverse, child_order)
+        level_count = np.bincount(inverse, weights=child_order == level_max[inverse]).astype(np.int32)
+        current = max_child[parents]
+        n_max_child[parents] = np.where(level_max > current, level_count,
+                                        np.where(level_max == current, n_max_child[parents] + level_count,
+                                                 n_max_child[parents]))
+        max_child[parents] = np.maximum(current, level_max)
+    return order
+
+
+def build_upstream_index(dirs):
+    """
+    Computes the preorder numbering of the reversed flow tree.
+
+    Returns a dict of flat arrays: tin, size, order, orth_steps, diag_steps and
+    cycles (cells whose upstream area cannot be expressed as an interval).
+    """
+    n = dirs.size
+    index_dtype = np.int32 if n < np.iinfo(np.int32).max else np.int64
+    down = downstream_indices(dirs)
+    levels = topological_levels(down)
+
+    processed = np.zeros(n, dtype=bool)
+    for level in levels:
+        processed[level] = True
+    cycles = np.nonzero(~processed)[0]
+    # Las celdas en ciclos se tratan como raíces; calculate() las resuelve recorriendo.
+    down[cycles] = -1
+
+    size = accumulate(np.ones(n, dtype=np.int64), down, levels)
+
+    # Desplazamiento de cada afluente dentro de su padre: suma de los tamaños de los
+    # hermanos que el recorrido en profundidad visita antes (orden de D8_NEIGHBOURS).
+    branch = branch_indices(dirs.reshape(-1))
+    children = np.nonzero(down >= 0)[0]
+    children = children[np.lexsort((branch[children], down[children]))]
+    child_sizes = size[children]
+    before = np.cumsum(child_sizes) - child_sizes
+    parents = down[children]
+    group_start = np.r_[True, parents[1:] != parents[:-1]]
+    group_id = np.cumsum(group_start) - 1
+    sibling_offset = np.zeros(n, dtype=np.int64)
+    sibling_offset[children] = before - before[group_start][group_id]
+    del before, parents, group_start, group_id, child_sizes
+
+    tin = np.zeros(n, dtype=np.int64)
+    roots = np.nonzero(down < 0)[0]
+    root_sizes = size[roots]
+    tin[roots] = np.cumsum(root_sizes) - root_sizes
+
+    orth_steps = np.zeros(n, dtype=np.int32)
+    diag_steps = np.zeros(n, dtype=np.int32)
+    diagonal = (branch % 2) == 1
+    for level in reversed(levels):
+        cells = level[down[level] >= 0]
+        parents = down[cells]
+        tin[cells] = tin[parents] + 1 + sibling_offset[cells]
+        orth_steps[cells] = orth_steps[parents] + ~diagonal[cells]
+        diag_steps[cells] = diag_steps[parents] + diagonal[cells]
+
+    order = np.empty(n, dtype=index_dtype)
+    order[tin] = np.arange(n, dtype=index_dtype)
+    return {
+        "tin": tin.astype(index_dtype),
+        "size": size.astype(index_dtype),
+        "order": order,
+        "orth_steps": orth_steps,
+        "diag_steps": diag_steps,
+        "cycles": cycles,
+    }
+
+
+def write_upstream_index(dirs, output_dir, geo_transform=None, projection=None, source=None):
+    """Builds the index for `dirs` and stores it as .npy files plus an index.json sidecar."""
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = build_upstream_index(dirs)
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+    meta = {
+        "shape": list(dirs.shape),
+        "geotransform": list(geo_transform) if geo_transform else None,
+        "projection": projection,
+        "source": source,
+        "cycles": int(arrays["cycles"].size),
+    }
+    with open(os.path.join(output_dir, "index.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class UpstreamIndex:
+    """Read-only, memory-mapped view of an index written by write_upstream_index."""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, "index.json")) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta["shape"])
+        self.tin = np.load(os.path.join(folder, "tin.npy"), mmap_mode="r")
+        self.size = np.load(os.path.join(folder, "size.npy"), mmap_mode="r")
+        self.order = np.load(os.path.join(folder, "order.npy"), mmap_mode="r")
+        self.orth_steps = np.load(os.path.join(folder, "orth_steps.npy"), mmap_mode="r")
+        self.diag_steps = np.load(os.path.join(folder, "diag_steps.npy"), mmap_mode="r")
+        self.cycles = set(np.load(os.path.join(folder, "cycles.npy")).tolist())
+
+    @classmethod
+    def open(cls, folder=UPSTREAM_INDEX_DIR, expected_shape=None):
+        """Opens the index if it exists (and matches `expected_shape`), otherwise returns None."""
+        if not os.path.exists(os.path.join(folder, "index.json")):
+            return None
+        try:
+            index = cls(folder)
+        except Exception as e:
+            print(f"Warning: No se pudo abrir el índice aguas arriba en {folder}: {e}")
+            return None
+        if expected_shape is not None and index.shape != tuple(expected_shape):
+            print(f"Warning: El índice aguas arriba de {folder} no coincide con FLOWDIRS "
+                  f"({index.shape} != {tuple(expected_shape)}). Se ignora.")
+            return None
+        return index
+
+    def covers(self, row, col):
+        """False for outlets inside flow-direction cycles, which need a real traversal."""
+        return int(row) * self.shape[1] + int(col) not in self.cycles
+
+    def interval(self, row, col):
+        outlet = int(row) * self.shape[1] + int(col)
+        lo = int(self.tin[outlet])
+        return lo, lo + int(self.size[outlet])
+
+    def is_upstream(self, cells, row, col):
+        """Vectorised test: which flat `cells` drain into (row, col)."""
+        lo, hi = self.interval(row, col)
+        tin = self.tin[np.asarray(cells)]
+        return (tin >= lo) & (tin < hi)
+
+    def catchment_cells(self, row, col):
+        """Flat indices of the catchment of (row, col), in depth-first visit order."""
+        lo, hi = self.interval(row, col)
+        return np.asarray(self.order[lo:hi], dtype=np.int64)
+
+    def catchment_window(self, row, col, cells=None):
+        """
+        Bounding window of the catchment and its mask, computed with one interval
+        comparison over the window. Returns (row0, col0, mask).
+        """
+        if cells is None:
+            cells = self.catchment_cells(row, col)
+        lo, hi = self.interval(row, col)
+        cols = self.shape[1]
+        cell_rows = cells // cols
+        cell_cols = cells % cols
+        row0, row1 = int(cell_rows.min()), int(cell_rows.max()) + 1
+        col0, col1 = int(cell_cols.min()), int(cell_cols.max()) + 1
+        window = self.tin.reshape(self.shape)[row0:row1, col0:col1]
+        return row0, col0, (window >= lo) & (window < hi)
+
+    def trace(self, dirs, row, col, cellsize):
+        """
+        Same result as upstream_traversal.trace_upstream, read from the index. Cells
+        come in depth-first order and distances are rebuilt from the step counts, so
+        they match the traversal up to floating-point rounding.
+        """
+        cells = self.catchment_cells(row, col)
+        outlet = cells[0]
+        dirs_values = dirs.reshape(-1)[cells]
+        down = downstream_indices_of(cells, dirs_values, self.shape)
+        lo = int(self.tin[outlet])
+        parent_pos = np.full(cells.size, -1, dtype=np.int64)
+        parent_pos[1:] = np.asarray(self.tin[down[1:]], dtype=np.int64) - lo
+        branch = branch_indices(dirs_values)
+        branch[0] = 0
+        orth = np.asarray(self.orth_steps[cells], dtype=np.int64) - int(self.orth_steps[outlet])
+        diag = np.asarray(self.diag_steps[cells], dtype=np.int64) - int(self.diag_steps[outlet])
+        distances = orth * cellsize + diag * (DIAGONAL_STEP * cellsize)
+        return UpstreamTrace(self.shape, cells, parent_pos, branch, distances, None)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el índice de intervalos aguas arriba de FLOWDIRS.")
+    parser.add_argument("--flowdirs", default=LAYER_MAPPING["FLOWDIRS"], help="Ruta local o URL del ráster de direcciones de flujo.")
+    parser.add_argument("--output", default=UPSTREAM_INDEX_DIR, help="Carpeta de salida del índice.")
+    args = parser.parse_args()
+
+    if not GDAL_AVAILABLE:
+        raise ImportError("GDAL no está disponible. No se puede construir el índice aguas arriba.")
+    gdal.UseExceptions()
+
+    flowdirs_path = args.flowdirs
+    if flowdirs_path.startswith("http"):
+        flowdirs_path = get_local_path_from_url(flowdirs_path)
+    ds = gdal.Open(flowdirs_path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise FileNotFoundError(f"No se pudo abrir el dataset FLOWDIRS en {flowdirs_path}")
+    dirs = ds.GetRasterBand(1).ReadAsArray()
+    meta = write_upstream_index(dirs, args.output, ds.GetGeoTransform(), ds.GetProjection(), args.flowdirs)
+    print(f"Índice aguas arriba escrito en {args.output}: {dirs.size} celdas, {meta['cycles']} en ciclos.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# core_logic/upstream_traversal.py
+
+import numpy as np
+
+# Vecinos D8 que drenan hacia la celda actual: (dx, dy, código del vecino).
+# Es la tabla D8 de referencia: D8_DOWNSTREAM, D8_BRANCH y upstream_index se derivan
+# de ella. El orden importa para desempatar el punto más alejado igual que el
+# recorrido recursivo original.
+D8_NEIGHBOURS = (
+    (-1, 0, 1), (-1, -1, 2), (0, -1, 4), (1, -1, 8),
+    (1, 0, 16), (1, 1, 32), (0, 1, 64), (-1, 1, 128),
+)
+DIAGONAL_STEP = 1.414
+# Tolerancia relativa para considerar empatadas dos distancias de flujo. Dos recorridos
+# de longitud distinta difieren al menos en 0.002 celdas (pasos de 1 y 1.414), muy por
+# encima del error de redondeo de las sumas.
+TIE_TOLERANCE = 1e-9
+# Código D8 -> (drow, dcol) de la celda aguas abajo.
+D8_DOWNSTREAM = {code: (-dy, -dx) for dx, dy, code in D8_NEIGHBOURS}
+# Código D8 -> posición en D8_NEIGHBOURS (orden de visita de los afluentes).
+D8_BRANCH = {code: k for k, (_, _, code) in enumerate(D8_NEIGHBOURS)}
+
+
+class UpstreamTrace:
+    """
+    Result of an upstream traversal from an outlet cell.
+
+    All arrays are aligned and a cell always appears after the cell it drains
+    into. trace_upstream() orders them level by level (the outlet first, then the
+    cells one step upstream, and so on); UpstreamIndex.trace() in depth-first order.
+
+    cells:         flat indices (row * ncols + col) of the basin cells.
+    parent_pos:    position in `cells` of the downstream cell (-1 for the outlet).
+    branch:        index in D8_NEIGHBOURS used to reach the cell from its parent.
+    distances:     flow distance to the outlet, accumulated exactly like the
+                   original recursive traversal did.
+    level_offsets: start position of every level in `cells` (plus the total size),
+                   or None when the cells are not ordered by level.
+    """
+
+    def __init__(self, shape, cells, parent_pos, branch, distances, level_offsets):
+        self.shape = shape
+        self.cells = cells
+        self.parent_pos = parent_pos
+        self.branch = branch
+        self.distances = distances
+        self.level_offsets = level_offsets
+
+    def __len__(self):
+        return len(self.cells)
+
+    @property
+    def rows(self):
+        return self.cells // self.shape[1]
+
+    @property
+    def cols(self):
+        return self.cells % self.shape[1]
+
+    def branch_path(self, pos):
+        """Sequence of branch indices from the outlet down to the cell at `pos`."""
+        path = []
+        while pos > 0:
+            path.append(int(self.branch[pos]))
+            pos = int(self.parent_pos[pos])
+        path.reverse()
+        return path
+
+
+def trace_upstream(dirs, row, col, cellsize, stop_cells=None):
+    """
+    Collects every cell that drains into (row, col) using an explicit frontier
+    over flat cell indices instead of one Python call per cell.
+
+    dirs:       2D array of D8 flow directions (ESRI codes 1..128).
+    cellsize:   cell size in map units, used to accumulate flow distances.
+    stop_cells: optional flat indices that are never entered (their upstream
+                area is left out of the trace).
+
+    Returns an UpstreamTrace.
+    """
+    rows, cols = dirs.shape
+    dirs_flat = dirs.reshape(-1)
+    outlet = int(row) * cols + int(col)
+
+    stop = np.array([outlet], dtype=np.int64)
+    if stop_cells is not None and len(stop_cells) > 0:
+        stop = np.union1d(stop, np.asarray(stop_cells, dtype=np.int64))
+
+    cells_chunks = [np.array([outlet], dtype=np.int64)]
+    parent_chunks = [np.array([-1], dtype=np.int64)]
+    branch_chunks = [np.array([0], dtype=np.uint8)]
+    dist_chunks = [np.array([0.0])]
+    level_offsets = [0]
+
+    frontier = cells_chunks[0]
+    frontier_dist = dist_chunks[0]
+    frontier_start = 0
+    total = 1
+
+    while frontier.size:
+        fr = frontier // cols
+        fc = frontier - fr * cols
+
+        new_cells, new_parents, new_branch, new_dist = [], [], [], []
+        for k, (dx, dy, code) in enumerate(D8_NEIGHBOURS):
+            r2 = fr + dy
+            c2 = fc + dx
+            inside = np.nonzero((r2 >= 0) & (r2 < rows) & (c2 >= 0) & (c2 < cols))[0]
+            if inside.size == 0:
+                continue
+            neighbours = r2[inside] * cols + c2[inside]
+            hit = dirs_flat[neighbours] == code
+            if not hit.any():
+                continue
+            src = inside[hit]
+            neighbours = neighbours[hit]
+            # Una celda sólo tiene una celda aguas abajo, así que sólo el punto de
+            # salida puede volver a alcanzarse (ciclo en FLOWDIRS).
+            keep = ~np.isin(neighbours, stop)
+            if not keep.all():
+                src = src[keep]
+                neighbours = neighbours[keep]
+            if neighbours.size == 0:
+                continue
+            step = 1 if (dx == 0 or dy == 0) else DIAGONAL_STEP
+            new_cells.append(neighbours)
+            new_parents.append(src + frontier_start)
+            new_branch.append(np.full(neighbours.size, k, dtype=np.uint8))
+            new_dist.append(frontier_dist[src] + step * cellsize)
+
+        if not new_cells:
+            break
+
+        frontier = np.concatenate(new_cells)
+        frontier_dist = np.concatenate(new_dist)
+        frontier_start = total
+        total += frontier.size
+        level_offsets.append(frontier_start)
+
+        cells_chunks.append(frontier)
+        parent_chunks.append(np.concatenate(new_parents))
+        branch_chunks.append(np.concatenate(new_branch))
+        dist_chunks.append(frontier_dist)
+
+    level_offsets.append(total)
+    return UpstreamTrace(
+        (rows, cols),
+        np.concatenate(cells_chunks),
+        np.concatenate(parent_chunks),
+        np.concatenate(branch_chunks),
+        np.concatenate(dist_chunks),
+        np.asarray(level_offsets, dtype=np.int64),
+    )
+
+
+def farthest_position(trace, candidates_mask=None):
+    """
+    Position in the trace of the farthest cell, or None if every candidate sits
+    at distance 0.
+
+    Ties are resolved like the recursive depth-first traversal: the winner is the
+    first cell visited, i.e. the one whose branch path from the outlet is
+    lexicographically smallest. Distances within TIE_TOLERANCE (relative) of the
+    maximum count as tied, so that the rounding of the accumulated sums (which
+    depends on where they started, e.g. after moving the outlet) does not pick
+    a different cell.
+    """
+    distances = trace.distances
+    if candidates_mask is not None:
+        distances = np.where(candidates_mask, distances, -np.inf)
+    if distances.size == 0:
+        return None
+    max_distance = distances.max()
+    if not max_distance > 0:
+        return None
+    tied = np.nonzero(distances >= max_distance * (1 - TIE_TOLERANCE))[0]
+    if tied.size == 1:
+        return int(tied[0])
+    return int(min(tied, key=trace.branch_path))
+
+
+def walk_downstream(dirs, row, col, cellsize, targets, max_steps=None):
+    """
+    Follows the D8 path downstream of (row, col) until it reaches one of the
+    flat indices in `targets`.
+
+    Returns (target, distance): the first target found and the flow distance
+    from (row, col) to it, or (None, distance walked) if the path leaves the
+    grid, hits an invalid code, closes a cycle or exceeds max_steps first.
+    """
+    rows, cols = dirs.shape
+    start = int(row) * cols + int(col)
+    seen = {start}
+    orth_steps = diag_steps = 0
+    while True:
+        step = D8_DOWNSTREAM.get(int(dirs[row, col]))
+        if step is None:
+            break
+        row, col = row + step[0], col + step[1]
+        if not (0 <= row < rows and 0 <= col < cols):
+            break
+        if step[0] == 0 or step[1] == 0:
+            orth_steps += 1
+        else:
+            diag_steps += 1
+        cell = row * cols + col
+        if cell in targets:
+            return cell, (orth_steps + diag_steps * DIAGONAL_STEP) * cellsize
+        if cell in seen or (max_steps is not None and orth_steps + diag_steps >= max_steps):
+            break
+        seen.add(cell)
+    return None, (orth_steps + diag_steps * DIAGONAL_STEP) * cellsize
@@ -0,0 +1,361 @@
+# core_logic/vector_tiles.py
+#
+# Teselas vectoriales (Mapbox Vector Tiles) de las capas vectoriales del mapa (ZONES,
+# BASINS, RIVERS), servidas por un pequeño servidor HTTP local.
+#
+# En lugar de incrustar GeoJSON en la página, el mapa usa folium.plugins.VectorGridProtobuf
+# y el navegador pide sólo las teselas visibles: /tiles/<capa>/<z>/<x>/<y>.pbf. Cada tesela
+# se genera a partir de la MapLayer compartida (core_logic/map_layers.py) proyectada una
+# vez a Web Mercator: consulta al STRtree, paso a coordenadas de tesela, recorte al borde
+# con margen y simplificación a una unidad de tesela. Las teselas se guardan en disco, en
+# una carpeta por capa y versión del fichero de origen, hasta CAUMAX_TILE_CACHE_MB (se
+# borran las menos usadas recientemente), y los zooms bajos se precalculan al arrancar.
+#
+# El servidor sólo se activa si se da CAUMAX_TILE_URL, la URL de las teselas tal como la
+# ve el navegador (en local, http://localhost:8765/tiles/{layer}/{z}/{x}/{y}.pbf; en un
+# despliegue, la ruta del proxy que reenvía al puerto CAUMAX_TILE_PORT). Escucha sólo en
+# 127.0.0.1 salvo que CAUMAX_TILE_BIND diga otra cosa (p. ej. 0.0.0.0 si el proxy está en
+# otra máquina). Sin CAUMAX_TILE_URL, o sin mapbox_vector_tile (opcional),
+# get_tile_server() devuelve None y el mapa sigue con las vistas GeoJSON de map_layers.
+
+import http.server
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import shapely
+import streamlit as st
+from folium.plugins import VectorGridProtobuf
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+from .crs_transform import WEB_MERCATOR, WGS84, transform_points
+from .gis_utils import get_layer_path, get_local_path_from_url
+from .map_layers import get_map_layer
+
+VECTOR_TILE_LAYERS = ("ZONES", "BASINS", "RIVERS")
+# URL de las teselas tal como la ve el navegador ({layer}, {z}, {x}, {y}).
+TILE_URL = os.environ.get("CAUMAX_TILE_URL") or None
+TILE_SERVER_ENABLED = TILE_URL is not None
+TILE_PORT = int(os.environ.get("CAUMAX_TILE_PORT", "8765"))
+TILE_BIND = os.environ.get("CAUMAX_TILE_BIND", "127.0.0.1")
+TILE_CACHE_DIR = os.environ.get("CAUMAX_TILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "caumax_tiles"))
+TILE_CACHE_MAX_BYTES = int(float(os.environ.get("CAUMAX_TILE_CACHE_MB", "256")) * 1024 * 1024)
+TILE_PRECOMPUTE_ZOOM = int(os.environ.get("CAUMAX_TILE_PRECOMPUTE_ZOOM", "7"))
+TILE_MAX_ZOOM = 14
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # Margen de recorte, en unidades de tesela, para que no se vean los bordes.
+
+WEB_MERCATOR_HALF = 20037508.342789244
+MAX_MERCATOR_LAT = 85.05112878
+_TILE_PATH = re.compile(r"^/tiles/(\w+)/(\d+)/(\d+)/(\d+)\.pbf$")
+
+
+def tile_bounds(z, x, y):
+    """(minx, miny, maxx, maxy) of an XYZ tile in EPSG:3857."""
+    size = 2 * WEB_MERCATOR_HALF / 2 ** z
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def tiles_in_bounds(bounds, z):
+    """XYZ tiles (x, y) at zoom `z` that cover the EPSG:4326 `bounds` (west, south, east, north)."""
+    west, south, east, north = bounds
+    n = 2 ** z
+
+    def tile_y(lat):
+        lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+        return int(np.clip((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n, 0, n - 1))
+
+    x0, x1 = (int(np.clip((lon + 180.0) / 360.0 * n, 0, n - 1)) for lon in (west, east))
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(tile_y(north), tile_y(south) + 1)]
+
+
+class TileDiskBudget:
+    """
+    Size limit of the on-disk tile cache under `root`, shared by all the layers. When
+    the tiles written exceed `max_bytes`, the least recently used ones (by mtime, which
+    is refreshed on every hit) are deleted down to `low_water` of the limit.
+    """
+
+    def __init__(self, root, max_bytes=TILE_CACHE_MAX_BYTES, low_water=0.8):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.removed = 0
+        self._lock = threading.Lock()
+        self._used = sum(size for _, _, size in self._tiles(remove_tmp=True))
+        if self._used > self.max_bytes:
+            self._prune()
+
+    def _tiles(self, remove_tmp=False):
+        tiles = []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    # Al arrancar son restos de una escritura interrumpida; después, teselas
+                    # que otro hilo está escribiendo.
+                    if remove_tmp:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    continue
+                tiles.append((info.st_mtime, path, info.st_size))
+        return tiles
+
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def add(self, nbytes):
+        with self._lock:
+            self._used += nbytes
+            if self._used > self.max_bytes:
+                self._prune()
+
+    def _prune(self):
+        tiles = sorted(self._tiles())
+        self._used = sum(size for _, _, size in tiles)
+        target = self.max_bytes * self.low_water
+        for _, path, size in tiles:
+            if self._used <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._used -= size
+            self.removed += 1
+
+
+class VectorTileSource:
+    """
+    MVT tiles of one MapLayer: geometries projected to EPSG:3857 once, indexed with an
+    STRtree, and each rendered tile kept on disk under `cache_dir` (within `budget`).
+    """
+
+    def __init__(self, map_layer, cache_dir, budget=None):
+        self.key = map_layer.key
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.properties = map_layer.properties
+        geoms_wgs84 = map_layer.geoms
+        self.bounds = tuple(shapely.total_bounds(geoms_wgs84))
+
+        def project(coords):
+            lat = np.clip(coords[:, 1], -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+            return np.column_stack(transform_points(coords[:, 0], lat, WGS84, WEB_MERCATOR))
+
+        self.geoms = shapely.transform(geoms_wgs84, project)
+        self.tree = shapely.STRtree(self.geoms)
+        # Tamaño de cada geometría (longitud, o raíz del área en polígonos): recortar y simplificar
+        # no lo aumenta, así que sirve para descartar antes las de menos de un píxel.
+        dimension = shapely.get_dimensions(self.geoms)
+        self.sizes = np.where(dimension == 2, np.sqrt(shapely.area(self.geoms)), shapely.length(self.geoms))
+        self.sizes[dimension == 0] = np.inf
+        self.rendered = 0
+        self.cache_hits = 0
+
+    def _tile_path(self, z, x, y):
+        return os.path.join(self.cache_dir, str(z), str(x), f"{y}.pbf")
+
+    def tile(self, z, x, y):
+        """Encoded tile (bytes, empty for a tile without features), from disk when possible."""
+        path = self._tile_path(z, x, y)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            self.cache_hits += 1
+            if self.budget is not None:
+                self.budget.touch(path)
+            return data
+        except FileNotFoundError:
+            pass
+
+        data = self.render(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.rendered += 1
+        if self.budget is not None:
+            self.budget.add(len(data))
+        return data
+
+    def render(self, z, x, y):
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        unit = (maxx - minx) / TILE_EXTENT
+        margin = TILE_BUFFER * unit
+        # Fuera las features de menos de un píxel de pantalla (tesela de 256 px): no se verían
+        # y, en los zooms bajos, son la mayor parte de la red fluvial.
+        pixel = TILE_EXTENT / 256
+        hits = np.sort(self.tree.query(shapely.box(minx - margin, miny - margin, maxx + margin, maxy + margin)))
+        hits = hits[~(self.sizes[hits] < pixel * unit)]
+        if not len(hits):
+            return b""
+
+        # A coordenadas de tesela (0..TILE_EXTENT, y hacia arriba) de una vez para todas las
+        # features: así mapbox_vector_tile no cuantiza geometría a geometría en Python.
+        geoms = shapely.transform(self.geoms[hits], lambda xy: (xy - (minx, miny)) / unit)
+        geoms = shapely.clip_by_rect(geoms, -TILE_BUFFER, -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER,
+                                     TILE_EXTENT + TILE_BUFFER)
+        geoms = shapely.simplify(geoms, 1.0, preserve_topology=True)
+        dimension = shapely.get_dimensions(geoms)
+        visible = ~shapely.is_empty(geoms) & (shapely.get_type_id(geoms) <= 6) & (
+            ((dimension == 1) & (shapely.length(geoms) >= pixel))
+            | ((dimension == 2) & (shapely.area(geoms) >= pixel * pixel))
+            | (dimension == 0)
+        )
+        features = [{"geometry": geom, "properties": json.loads(self.properties[i])}
+                    for geom, i in zip(geoms[visible], hits[visible])]
+        if not features:
+            return b""
+        return mapbox_vector_tile.encode(
+            [{"name": self.key, "features": features}],
+            default_options={"quantize_bounds": None, "extents": TILE_EXTENT},
+        )
+
+
+class VectorTileServer:
+    """
+    Local HTTP endpoint, on `bind`:`port`, for the MVT tiles of `layer_keys`. Sources are
+    built on the first request of each layer; start() also precomputes zooms
+    0..`precompute_zoom` in the background.
+    """
+
+    def __init__(self, url_template, layer_keys=VECTOR_TILE_LAYERS, cache_dir=TILE_CACHE_DIR, port=TILE_PORT,
+                 bind=TILE_BIND, precompute_zoom=TILE_PRECOMPUTE_ZOOM, cache_max_bytes=TILE_CACHE_MAX_BYTES):
+        self.layer_keys = tuple(layer_keys)
+        self.cache_dir = cache_dir
+        self.budget = TileDiskBudget(cache_dir, cache_max_bytes)
+        self.port = port
+        self.bind = bind
+        self.url_template = url_template
+        self.precompute_zoom = precompute_zoom
+        self.precomputed = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def source(self, layer_key):
+        """VectorTileSource of a layer, or None if it is not served or cannot be loaded."""
+        if layer_key not in self.layer_keys:
+            return None
+        with self._lock:
+            if layer_key not in self._sources:
+                map_layer = get_map_layer(layer_key)
+                if map_layer is None:
+                    return None
+                # Una carpeta por versión del fichero de origen (la caché de capas lo guarda por contenido).
+                local_path = get_local_path_from_url(get_layer_path(layer_key))
+                version = os.path.splitext(os.path.basename(local_path))[0][:16] if local_path else "sin_version"
+                folder = os.path.join(self.cache_dir, f"{layer_key}-{version}")
+                self._sources[layer_key] = VectorTileSource(map_layer, folder, self.budget)
+            return self._sources[layer_key]
+
+    def url_for(self, layer_key):
+        return self.url_template.replace("{layer}", layer_key)
+
+    def start(self):
+        if self._server is not None:
+            return self
+        server_ref = self
+
+        class TileHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = _TILE_PATH.match(self.path.split("?")[0])
+                if not match:
+                    self.send_error(404)
+                    return
+                layer_key, (z, x, y) = match.group(1), (int(v) for v in match.group(2, 3, 4))
+                if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+                    self.send_error(400)
+                    return
+                source = server_ref.source(layer_key)
+                if source is None:
+                    self.send_error(404)
+                    return
+                try:
+                    data = source.tile(z, x, y)
+                except Exception as e:
+                    print(f"Warning: No se pudo generar la tesela {layer_key}/{z}/{x}/{y}: {e}")
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.send_header("Cache-Control", "public, max-age=86400")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((self.bind, self.port), TileHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="vector-tiles").start()
+        threading.Thread(target=self.precompute, daemon=True, name="vector-tiles-precompute").start()
+        return self
+
+    def precompute(self):
+        """Renders zooms 0..precompute_zoom of every layer over its extent into the disk cache."""
+        for layer_key in self.layer_keys:
+            start = time.perf_counter()
+            source = self.source(layer_key)
+            if source is None:
+                continue
+            tiles = [(z, x, y) for z in range(self.precompute_zoom + 1) for x, y in tiles_in_bounds(source.bounds, z)]
+            with ThreadPoolExecutor(max_workers=4, thread_name_prefix="tile-precompute") as pool:
+                for _ in pool.map(lambda zxy: source.tile(*zxy), tiles):
+                    pass
+            self.precomputed[layer_key] = len(tiles)
+            print(f"Teselas de {layer_key}: {len(tiles)} precalculadas (zoom 0-{self.precompute_zoom}) "
+                  f"en {time.perf_counter() - start:.1f} s")
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def layer(self, layer_key, style, name=None, show=True):
+        """folium VectorGridProtobuf overlay of a served layer with one Leaflet path style."""
+        options = {
+            "vectorTileLayerStyles": {layer_key: style},
+            "maxNativeZoom": TILE_MAX_ZOOM,
+            "interactive": False,
+        }
+        return VectorGridProtobuf(self.url_for(layer_key), name, options, show=show)
+
+
+@st.cache_resource(show_spinner=False)
+def get_tile_server():
+    """
+    Process-wide VectorTileServer, or None if vector tiles are unavailable or not enabled
+    (CAUMAX_TILE_URL unset).
+    """
+    if mapbox_vector_tile is None or not TILE_SERVER_ENABLED:
+        return None
+    try:
+        return VectorTileServer(TILE_URL).start()
+    except OSError as e:
+        print(f"Warning: No se pudo abrir el servidor de teselas en {TILE_BIND}:{TILE_PORT}: {e}")
+        return None
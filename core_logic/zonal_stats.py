@@ -0,0 +1,120 @@
+# core_logic/zonal_stats.py
+#
+# Estadísticas zonales de las capas secundarias (P0, I1ID, lluvia) sobre las celdas de una
+# cuenca del MDT.
+#
+# La correspondencia celda del MDT -> píxel de cada capa se calcula una vez por proceso.
+# Sin rotación es separable: un vector de columnas y otro de filas. Después los valores
+# de toda la cuenca se recogen con una sola indexación por capa.
+
+import numpy as np
+
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    GDAL_AVAILABLE = False
+    gdal = None
+
+
+class LayerSampler:
+    """
+    Samples a layer at the cell centres of a base grid. Pixel lookup reproduces
+    gdal.ApplyGeoTransform + int() on the centre coordinates, as the original
+    per-cell _getValueAtCoordinate did.
+    """
+
+    def __init__(self, layer, layer_gt, layer_nodata, grid_gt, grid_shape):
+        self.layer = layer
+        self.nodata = layer_nodata
+        self.grid_gt = tuple(grid_gt)
+        self.inv_gt = gdal.InvGeoTransform(tuple(layer_gt))
+        if self.inv_gt is None:
+            raise ValueError("No se pudo invertir la geotransformación de la capa.")
+
+        rows, cols = grid_shape
+        separable = (self.grid_gt[2] == 0 and self.grid_gt[4] == 0
+                     and self.inv_gt[2] == 0 and self.inv_gt[4] == 0)
+        if separable:
+            # Columna del MDT -> columna de la capa y fila del MDT -> fila de la capa;
+            # -1 marca los centros que caen fuera de la capa.
+            x = self.grid_gt[0] + (np.arange(cols) + 0.5) * self.grid_gt[1]
+            y = self.grid_gt[3] + (np.arange(rows) + 0.5) * self.grid_gt[5]
+            self.col_map = self._clip(np.trunc(self.inv_gt[0] + x * self.inv_gt[1]), layer.shape[1])
+            self.row_map = self._clip(np.trunc(self.inv_gt[3] + y * self.inv_gt[5]), layer.shape[0])
+        else:
+            self.col_map = None
+            self.row_map = None
+
+    @staticmethod
+    def _clip(index, size):
+        index = index.astype(np.int64)
+        index[(index < 0) | (index >= size)] = -1
+        return index
+
+    def pixels(self, rows, cols):
+        """(py, px) of the layer pixels under the given grid cells; -1 where outside."""
+        if self.col_map is not None:
+            return self.row_map[rows], self.col_map[cols]
+        x = self.grid_gt[0] + (cols + 0.5) * self.grid_gt[1] + (rows + 0.5) * self.grid_gt[2]
+        y = self.grid_gt[3] + (cols + 0.5) * self.grid_gt[4] + (rows + 0.5) * self.grid_gt[5]
+        px = self._clip(np.trunc(self.inv_gt[0] + x * self.inv_gt[1] + y * self.inv_gt[2]), self.layer.shape[1])
+        py = self._clip(np.trunc(self.inv_gt[3] + x * self.inv_gt[4] + y * self.inv_gt[5]), self.layer.shape[0])
+        return py, px
+
+    def sample(self, rows, cols, positive_only=True):
+        """
+        float64 values at the given grid cells, NaN where the centre falls outside
+        the layer, on nodata or (if positive_only) on values <= 0.
+        """
+        py, px = self.pixels(np.asarray(rows), np.asarray(cols))
+        inside = (py >= 0) & (px >= 0)
+        out = np.full(py.shape, np.nan)
+        values = self.layer[py[inside], px[inside]]
+        valid = np.ones(values.shape, dtype=bool)
+        if self.nodata is not None:
+            valid &= values != self.nodata
+        if positive_only:
+            valid &= values > 0
+        inside_idx = np.nonzero(inside)[0]
+        out[inside_idx[valid]] = values[valid]
+        return out
+
+    def sum_count(self, rows, cols, positive_only=True):
+        """(sum, count) of the valid values at the given grid cells."""
+        values = self.sample(rows, cols, positive_only)
+        valid = ~np.isnan(values)
+        return float(values[valid].sum()), int(valid.sum())
+
+
+class ZonalStatistics:
+    """
+    One LayerSampler per secondary layer over the MDT grid. `layers`,
+    `transforms` and `nodata` are dicts keyed by the name returned in the
+    statistics.
+    """
+
+    def __init__(self, layers, transforms, nodata, grid_gt, grid_shape):
+        self.samplers = {
+            name: LayerSampler(layers[name], transforms[name], nodata.get(name), grid_gt, grid_shape)
+            for name in layers
+        }
+
+    def sums(self, rows, cols):
+        """{name: (sum, count)} of the valid (> 0, not nodata) values over the given cells."""
+        return {name: sampler.sum_count(rows, cols) for name, sampler in self.samplers.items()}
+
+    def grouped_sums(self, rows, cols, labels, n_labels):
+        """
+        {name: (sums, counts)} per label: arrays of length n_labels aggregated
+        with np.bincount over the integer `labels` of the given cells.
+        """
+        out = {}
+        for name, sampler in self.samplers.items():
+            values = sampler.sample(rows, cols)
+            valid = ~np.isnan(values)
+            out[name] = (
+                np.bincount(labels[valid], weights=values[valid], minlength=n_labels),
+                np.bincount(labels[valid], minlength=n_labels),
+            )
+        return out
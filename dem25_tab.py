@@ -16,7 +16,6 @@ import zipfile
 import tempfile
 from folium.plugins import Draw
 from shapely.geometry import shape, Point, LineString, Polygon
-from pyproj import CRS, Transformer
 import base64
 from PIL import Image
 import locale # Asegúrate de que esta línea está al principio del archivo
@@ -34,6 +33,8 @@ from rasterio.mask import mask
 from rasterio import features
 import rasterio
 from core_logic.gis_utils import get_local_path_from_url # Necesitamos esta para los GPKG y ZIPs
+from core_logic.crs_transform import WGS84, transform_point
+from core_logic.vector_tiles import get_tile_server # Red fluvial y demarcaciones como teselas MVT
 
 import branca.colormap as cm
 # ==============================================================================
@@ -81,8 +82,7 @@ def delinear_cuenca_desde_punto(_dem_bytes, outlet_coords_wgs84, umbral_rio_expo
         grid = Grid.from_raster(dem_path_for_pysheds, nodata=no_data_value)
         dem = grid.read_raster(dem_path_for_pysheds, nodata=no_data_value)
 
-        transformer_wgs84_to_dem_crs = Transformer.from_crs("EPSG:4326", dem_crs, always_xy=True)
-        x_dem_crs, y_dem_crs = transformer_wgs84_to_dem_crs.transform(outlet_coords_wgs84['lng'], outlet_coords_wgs84['lat'])
+        x_dem_crs, y_dem_crs = transform_point(outlet_coords_wgs84['lng'], outlet_coords_wgs84['lat'], WGS84, dem_crs)
 
         # Asegurarse de que el punto de salida esté dentro de los límites del DEM
         if not (grid.extent[0] <= x_dem_crs <= grid.extent[1] and grid.extent[2] <= y_dem_crs <= grid.extent[3]):
@@ -557,6 +557,11 @@ def render_dem25_tab():
     
     if st.session_state.get('user_drawn_geojson'): folium.GeoJson(json.loads(st.session_state.user_drawn_geojson), name="Polígono Dibujado", style_function=lambda x: {'color': 'magenta', 'weight': 3, 'fillOpacity': 0.2, 'dashArray': '5, 5'}).add_to(m)
     if 'poligono_results' in st.session_state and "error" not in st.session_state.poligono_results: folium.GeoJson(st.session_state.poligono_results['hojas'], name="Hojas (Polígono)", style_function=lambda x: {'color': 'magenta', 'weight': 2.5, 'fillOpacity': 0.5}).add_to(m)
+    # Capas de referencia como teselas vectoriales: sólo se cargan las visibles.
+    tile_server = get_tile_server()
+    if tile_server:
+        tile_server.layer("BASINS", {'color': 'black', 'weight': 1, 'fill': True, 'fillOpacity': 0.05}, name="Demarcaciones", show=False).add_to(m)
+        tile_server.layer("RIVERS", {'color': 'cyan', 'weight': 2.0}, name="Red Fluvial").add_to(m)
     if st.session_state.get("drawing_mode_active"): Draw(export=True, filename='data.geojson', position='topleft', draw_options={'polyline': False, 'rectangle': False, 'circle': False, 'marker': False, 'circlemarker': False, 'polygon': {'shapeOptions': {'color': 'magenta', 'weight': 3, 'fillOpacity': 0.2}}}, edit_options={'edit': False}).add_to(m)
     folium.LayerControl().add_to(m)
     map_output = st_folium(m, key="situacion_map", use_container_width=True, height=800, returned_objects=['all_drawings'])
@@ -20,7 +20,8 @@ from streamlit_folium import st_folium
 from branca.colormap import linear
 import traceback
 
-from pyproj import Transformer, CRS
+from pyproj import CRS
+from core_logic.crs_transform import UTM30N, WGS84, transform_point, transform_points
 from pysheds.grid import Grid
 from pysheds.sview import Raster
 from affine import Affine
@@ -316,9 +317,8 @@ def render_delineation_tab():
         st.subheader("5. Delineación Interactiva en el Mapa")
         
         try:
-            source_crs_utm = CRS("EPSG:25830"); target_crs_wgs84 = CRS("EPSG:4326")
-            transformer_utm_to_wgs = Transformer.from_crs(source_crs_utm, target_crs_wgs84, always_xy=True)
-            lon_init, lat_init = transformer_utm_to_wgs.transform(st.session_state.x_utm, st.session_state.y_utm)
+            target_crs_wgs84 = CRS("EPSG:4326")
+            lon_init, lat_init = transform_point(st.session_state.x_utm, st.session_state.y_utm, UTM30N, WGS84)
             map_center = [lat_init, lon_init]
 
             m = folium.Map(location=map_center, zoom_start=12, tiles='OpenStreetMap')
@@ -331,10 +331,8 @@ def render_delineation_tab():
             colormap = plt.get_cmap('YlGnBu')
             acc_rgba = colormap(acc_norm)
             
-            transformer_dem_to_wgs = Transformer.from_crs(grid.crs, target_crs_wgs84, always_xy=True)
             min_x, max_x, min_y, max_y = grid.extent
-            bl_lon, bl_lat = transformer_dem_to_wgs.transform(min_x, min_y)
-            tr_lon, tr_lat = transformer_dem_to_wgs.transform(max_x, max_y)
+            (bl_lon, tr_lon), (bl_lat, tr_lat) = transform_points([min_x, max_x], [min_y, max_y], grid.crs, WGS84)
             bounds_wgs84 = [[bl_lat, bl_lon], [tr_lat, tr_lon]]
             
             folium.raster_layers.ImageOverlay(image=acc_rgba, bounds=bounds_wgs84, opacity=0.7, name='Acumulación de Flujo').add_to(m)
@@ -375,8 +373,7 @@ def render_delineation_tab():
                     with st.spinner("Delineando nueva cuenca..."):
                         st.session_state.delineation_click_wgs84 = {"lat": current_click["lat"], "lon": current_click["lng"]}
                         
-                        transformer_wgs_to_dem = Transformer.from_crs(target_crs_wgs84, grid.crs, always_xy=True)
-                        x_dem, y_dem = transformer_wgs_to_dem.transform(current_click["lng"], current_click["lat"])
+                        x_dem, y_dem = transform_point(current_click["lng"], current_click["lat"], WGS84, grid.crs)
                         
                         catchment_data = delineate_catchment_from_coords(processed_data, x_dem, y_dem)
                         
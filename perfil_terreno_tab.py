@@ -6,7 +6,6 @@
 import streamlit as st
 import os
 import geopandas as gpd
-import rasterio
 from rasterio.mask import mask
 from rasterio.io import MemoryFile
 import numpy as np
@@ -20,6 +19,7 @@ from shapely.geometry import LineString, mapping
 import zipfile
 import tempfile
 import requests # Necesario para descargar a MemoryFile en precalcular_acumulacion
+from core_logic.raster_pool import open_raster # Datasets abiertos compartidos entre consultas
 
 # --- 2. CONFIGURACIÓN Y RUTAS (Sin cambios) ---
 MDT25_PATH = "https://pub-e3d06a464df847c6962ef2ff7362c24e.r2.dev/caumax-hidrologia-data/MDT25_peninsula_UTM30N_COG.tif"
@@ -36,7 +36,7 @@ def clip_raster_to_geometry(raster_path, _geometry_gdf):
         return None, None
     print(f"LOG: Abriendo ráster (COG) directamente desde URL: {raster_path}...")
     try:
-        with rasterio.open(raster_path) as src: # Rasterio puede abrir la URL directamente
+        with open_raster(raster_path) as src: # Rasterio puede abrir la URL directamente; el pool lo mantiene abierto
             geometry_gdf_reprojected = _geometry_gdf.to_crs(src.crs)
             out_image, out_transform = mask(dataset=src, shapes=geometry_gdf_reprojected.geometry, crop=True, nodata=src.nodata)
             out_meta = src.meta.copy(); out_meta.update({"driver":"GTiff","height":out_image.shape[1],"width":out_image.shape[2],"transform":out_transform,"nodata":src.nodata})
@@ -53,34 +53,28 @@ def raster_to_bytes(raster_image, raster_meta):
         return memfile.read()
 
 def sample_rasters_along_line(_line_geom, _rasters_data):
-    # Abrimos los datasets UNA VEZ fuera del bucle.
+    # Los datasets se toman del pool (core_logic.raster_pool): siguen abiertos entre perfiles.
     # _rasters_data['dem_bytes'] etc. son ahora las URLs de los COGs.
-    dem_src = rasterio.open(_rasters_data['dem_bytes'])
-    corine_src = rasterio.open(_rasters_data['corine_bytes'])
-    cn_src = rasterio.open(_rasters_data['cn_bytes'])
-    
     gdf_line = gpd.GeoDataFrame(geometry=[_line_geom], crs="EPSG:4326").to_crs(_rasters_data['dem_meta']['crs'])
     distances, dem_values, corine_values, cn_values = [], [], [], []
     num_samples = 150
-    for i in range(num_samples + 1):
-        point = gdf_line.geometry.iloc[0].interpolate(i / num_samples, normalized=True)
-        distance = gdf_line.geometry.iloc[0].project(point)
-        
-        # Leemos los valores del ráster usando los objetos 'src' ya abiertos.
-        dem_val = next(dem_src.sample([(point.x, point.y)]))[0]
-        corine_val = next(corine_src.sample([(point.x, point.y)]))[0]
-        cn_val = next(cn_src.sample([(point.x, point.y)]))[0]
-        
-        distances.append(distance / 1000)
-        dem_values.append(dem_val if dem_val > -999 else np.nan)
-        corine_values.append(corine_val)
-        cn_values.append(cn_val if cn_val > 0 else np.nan)
+    with open_raster(_rasters_data['dem_bytes']) as dem_src, \
+            open_raster(_rasters_data['corine_bytes']) as corine_src, \
+            open_raster(_rasters_data['cn_bytes']) as cn_src:
+        for i in range(num_samples + 1):
+            point = gdf_line.geometry.iloc[0].interpolate(i / num_samples, normalized=True)
+            distance = gdf_line.geometry.iloc[0].project(point)
+            
+            # Leemos los valores del ráster usando los objetos 'src' ya abiertos.
+            dem_val = next(dem_src.sample([(point.x, point.y)]))[0]
+            corine_val = next(corine_src.sample([(point.x, point.y)]))[0]
+            cn_val = next(cn_src.sample([(point.x, point.y)]))[0]
+            
+            distances.append(distance / 1000)
+            dem_values.append(dem_val if dem_val > -999 else np.nan)
+            corine_values.append(corine_val)
+            cn_values.append(cn_val if cn_val > 0 else np.nan)
 
-    # Es importante cerrar los datasets al final.
-    dem_src.close()
-    corine_src.close()
-    cn_src.close()
-    
     return distances, dem_values, corine_values, cn_values
 
 # --- 3. FUNCIÓN PRINCIPAL DE LA PESTAÑA (Sin cambios significativos en la lógica) ---